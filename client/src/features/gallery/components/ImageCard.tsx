@@ -23,6 +23,12 @@ export function ImageCard({
     onDownloadSession,
     onRegenerate,
 }: ImageCardProps) {
+    const srcSet = image.derivatives
+        ? Object.entries(image.derivatives)
+            .map(([width, url]) => `${url} ${width}w`)
+            .join(', ') || undefined
+        : undefined
+
     const aspectClasses = {
         '1:1': 'aspect-square',
         '4:3': 'aspect-[4/3]',
@@ -130,6 +136,8 @@ export function ImageCard({
                     <div className={`${aspectClasses[session.aspectRatio]} relative`}>
                         <img
                             src={image.url}
+                            srcSet={srcSet}
+                            sizes="(min-width: 1280px) 25vw, (min-width: 768px) 33vw, 100vw"
                             alt={image.roomType.name}
                             className="absolute inset-0 w-full h-full object-cover"
                             loading="lazy"
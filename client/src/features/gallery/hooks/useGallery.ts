@@ -60,6 +60,13 @@ export function useGallery() {
                         ? session.images.map((image) => ({
                             ...image,
                             url: resolveImageUrl(image.url),
+                            derivatives: image.derivatives
+                                ? Object.fromEntries(
+                                    Object.entries(image.derivatives as Record<string, string>).map(
+                                        ([width, url]) => [width, resolveImageUrl(url)]
+                                    )
+                                )
+                                : undefined,
                         }))
                         : [],
                 }))
@@ -243,6 +250,7 @@ export function useGallery() {
 
         // Collect selected images
         const imagesToDownload: { url: string; name: string }[] = []
+        const sessionIds = new Set<string>()
 
         sessions.forEach(session => {
             session.images.forEach(img => {
@@ -250,6 +258,7 @@ export function useGallery() {
                     // Ensure unique names
                     const name = `${session.designStyle.id}-${img.roomType.id}-${img.id.slice(0, 4)}.jpg`
                     imagesToDownload.push({ url: img.url, name })
+                    sessionIds.add(session.id)
                 }
             })
         })
@@ -260,6 +269,21 @@ export function useGallery() {
             return
         }
 
+        // When every image lives in server storage, let the server stream the
+        // ZIP so the browser never holds the whole archive in memory.
+        if (imagesToDownload.every(img => img.url.includes('/api/images/sessions/'))) {
+            const link = document.createElement('a')
+            link.href = api.galleryDownloadUrl([...sessionIds], selectedImages, fileName)
+            link.download = `${fileName}.zip`
+            document.body.appendChild(link)
+            link.click()
+            link.remove()
+
+            setDownloadModal(prev => ({ ...prev, isOpen: false, isDownloading: false, error: null }))
+            handleClearSelection()
+            return
+        }
+
         console.log('Downloading images:', imagesToDownload.map(img => img.url))
 
         try {
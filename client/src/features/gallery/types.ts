@@ -26,6 +26,8 @@ export interface GeneratedImage {
     id: string
     roomType: RoomType
     url: string
+    /** Downscaled WebP variants keyed by pixel width, for srcset */
+    derivatives?: Record<string, string>
     selected: boolean
 }
 
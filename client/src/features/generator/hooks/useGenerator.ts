@@ -37,17 +37,12 @@ export function useGenerator() {
     useEffect(() => {
         const loadInitialData = async () => {
             try {
-                const [opts, styles, allArchitects, allDesigners] = await Promise.all([
-                    api.getOptions(),
-                    api.getStyles(),
-                    api.getArchitects(),
-                    api.getDesigners()
-                ]);
-
-                setOptions(opts);
-                setDesignStyles(styles);
-                setArchitects(allArchitects);
-                setDesigners(allDesigners);
+                const catalog = await api.getBootstrap();
+
+                setOptions(catalog.options);
+                setDesignStyles(catalog.styles);
+                setArchitects(catalog.architects);
+                setDesigners(catalog.designers);
             } catch (err) {
                 console.error(err);
                 setError("Failed to load configuration data.");
@@ -72,18 +67,13 @@ export function useGenerator() {
         floorBoardWidthId?: string
     ) => {
         try {
-            // Initialize Progress
+            // Initialize Progress (rooms are generated concurrently on the server)
             const segments = roomTypeIds.map(id => ({
                 roomTypeId: id,
                 roomTypeName: options.roomTypes.find(r => r.id === id)?.name || id,
-                status: 'pending' as const
+                status: 'in-progress' as const
             }));
 
-            // Mark first as in-progress (optimistic)
-            if (segments.length > 0) {
-                segments[0].status = 'in-progress';
-            }
-
             setGenerationProgress({
                 isGenerating: true,
                 totalRoomTypes: roomTypeIds.length,
@@ -92,60 +82,43 @@ export function useGenerator() {
                 segments: segments
             });
 
-            // Orchestrate Generation (Sequentially to show progress)
-            // Even though backend can do batch, we do 1 by 1 for the UI effect
-
-            for (let i = 0; i < roomTypeIds.length; i++) {
-                const roomId = roomTypeIds[i];
-                const roomName = segments[i].roomTypeName;
-
-                // Update Progress: Current running
-                setGenerationProgress(prev => {
-                    if (!prev) return null;
-                    const newSegments = [...prev.segments];
-                    newSegments[i].status = 'in-progress';
-                    return {
-                        ...prev,
-                        currentRoomType: roomName,
-                        segments: newSegments
-                    };
-                });
-
-                // Call API for this single room
-                // We use the batch endpoint but with 1 item
-                const response = await api.generateImages({
-                    room_type_ids: [roomId],
-                    design_style_id: designStyleId,
-                    architect_id: architectId,
-                    designer_id: designerId,
-                    color_wheel_id: colorWheelId,
-                    aspect_ratio_id: aspectRatioId,
-                    image_quality_id: imageQualityId,
-                    flooring_type_id: flooringTypeId,
-                    floor_board_width_id: floorBoardWidthId
-                });
-
-                if (response.success) {
-                    // Update Progress: Completed this one
+            // Stream results so each room's progress shows as soon as it is stored
+            await api.generateImagesStream({
+                room_type_ids: roomTypeIds,
+                design_style_id: designStyleId,
+                architect_id: architectId,
+                designer_id: designerId,
+                color_wheel_id: colorWheelId,
+                aspect_ratio_id: aspectRatioId,
+                image_quality_id: imageQualityId,
+                flooring_type_id: flooringTypeId,
+                floor_board_width_id: floorBoardWidthId
+            }, {
+                onRoom: (event) => {
+                    if (!event.success) {
+                        console.error(`Failed to generate ${event.room_type_id}: ${event.error}`);
+                    }
+
                     setGenerationProgress(prev => {
                         if (!prev) return null;
-                        const newSegments = [...prev.segments];
-                        newSegments[i].status = 'completed';
+                        const index = prev.segments.findIndex(
+                            segment => segment.roomTypeId === event.room_type_id && segment.status === 'in-progress'
+                        );
+                        if (index === -1) return prev;
 
-                        // Check if next exists, mark pending (or let loop handle)
+                        const newSegments = [...prev.segments];
+                        newSegments[index] = { ...newSegments[index], status: 'completed' };
+                        const next = newSegments.find(segment => segment.status === 'in-progress');
 
                         return {
                             ...prev,
                             completedRoomTypes: prev.completedRoomTypes + 1,
+                            currentRoomType: next?.roomTypeName || prev.currentRoomType,
                             segments: newSegments
                         };
                     });
-                } else {
-                    // Handle error for this room?
-                    // For now continue?
-                    console.error(`Failed to generate ${roomName}`);
                 }
-            }
+            });
 
             // All Done
             setGenerationProgress(null);
@@ -29,6 +29,14 @@ export interface GlobalOptions {
     floorBoardWidths: FloorBoardWidth[];
 }
 
+export interface CatalogBootstrap {
+    catalogVersion: string | null;
+    options: GlobalOptions;
+    styles: DesignStyle[];
+    architects: Architect[];
+    designers: Designer[];
+}
+
 export interface GenerateRequest {
     room_type_ids: string[];
     design_style_id: string;
@@ -39,6 +47,7 @@ export interface GenerateRequest {
     image_quality_id: string;
     flooring_type_id?: string;
     floor_board_width_id?: string;
+    force_fresh?: boolean;
 }
 
 export interface GenerationResult {
@@ -55,7 +64,43 @@ export interface GenerationResponse {
     results: GenerationResult[];
 }
 
+export type GenerationJobStatus = 'queued' | 'running' | 'completed' | 'failed';
+
+export interface GenerationJob {
+    job_id: string;
+    status: GenerationJobStatus;
+    session_id: string;
+    error?: string | null;
+    total_rooms: number;
+    completed_rooms: number;
+    rooms: { room_type_id: string; status: 'pending' | 'in-progress' | 'completed' | 'failed' }[];
+    results: GenerationResult[];
+}
+
+export interface RoomStreamEvent {
+    room_type_id: string;
+    success: boolean;
+    url?: string;
+    error?: string;
+    model_used?: string | null;
+}
+
+export interface StreamHandlers {
+    onRoom?: (event: RoomStreamEvent) => void;
+}
+
+const JOB_POLL_INTERVAL_MS = 1500;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
 export const api = {
+    // Options, styles, architects and designers in one request
+    getBootstrap: async (): Promise<CatalogBootstrap> => {
+        const res = await fetch(`${API_BASE_URL}/bootstrap`);
+        if (!res.ok) throw new Error('Failed to fetch catalog');
+        return res.json();
+    },
+
     getOptions: async (): Promise<GlobalOptions> => {
         const res = await fetch(`${API_BASE_URL}/options`);
         if (!res.ok) throw new Error('Failed to fetch options');
@@ -82,7 +127,17 @@ export const api = {
         return res.json();
     },
 
-    generateImages: async (request: GenerateRequest): Promise<GenerationResponse> => {
+    getJob: async (jobId: string): Promise<GenerationJob> => {
+        const res = await fetch(`${API_BASE_URL}/jobs/${encodeURIComponent(jobId)}`);
+        if (!res.ok) throw new Error('Failed to fetch generation job');
+        return res.json();
+    },
+
+    // Queues a generation job and polls it until every room has finished.
+    generateImages: async (
+        request: GenerateRequest,
+        onProgress?: (job: GenerationJob) => void
+    ): Promise<GenerationResponse> => {
         const res = await fetch(`${API_BASE_URL}/generate`, {
             method: 'POST',
             headers: {
@@ -94,6 +149,83 @@ export const api = {
             const errorData = await res.json().catch(() => ({}));
             throw new Error(errorData.detail || 'Generation failed');
         }
-        return res.json();
+        const { job_id: jobId } = await res.json();
+
+        for (;;) {
+            const job = await api.getJob(jobId);
+            onProgress?.(job);
+            if (job.status === 'completed') {
+                return { success: true, results: job.results };
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Generation failed');
+            }
+            await sleep(JOB_POLL_INTERVAL_MS);
+        }
+    },
+
+    // Generates rooms over Server-Sent Events, reporting each room as it is stored.
+    // Resolves with the session id once the session has been saved.
+    generateImagesStream: async (
+        request: GenerateRequest,
+        handlers: StreamHandlers = {}
+    ): Promise<string> => {
+        const res = await fetch(`${API_BASE_URL}/generate/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+            },
+            body: JSON.stringify(request),
+        });
+        if (!res.ok || !res.body) {
+            const errorData = await res.json().catch(() => ({}));
+            throw new Error(errorData.detail || 'Generation failed');
+        }
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        for (;;) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary = buffer.indexOf('\n\n');
+            while (boundary !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                boundary = buffer.indexOf('\n\n');
+
+                let event = 'message';
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                }
+                const payload = data ? JSON.parse(data) : {};
+
+                if (event === 'room') {
+                    handlers.onRoom?.(payload as RoomStreamEvent);
+                } else if (event === 'complete') {
+                    return payload.session_id as string;
+                } else if (event === 'error') {
+                    throw new Error(payload.detail || 'Generation failed');
+                }
+            }
+        }
+
+        throw new Error('Generation stream ended unexpectedly');
+    },
+
+    // URL of a ZIP the server streams straight from storage.
+    galleryDownloadUrl: (sessionIds: string[], imageIds: string[], name: string): string => {
+        const params = new URLSearchParams({
+            sessionIds: sessionIds.join(','),
+            imageIds: imageIds.join(','),
+            name,
+        });
+        return `${API_BASE_URL}/gallery/download?${params.toString()}`;
     }
 };
@@ -5,5 +5,124 @@ load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-if not GOOGLE_API_KEY:
-    print("Warning: GOOGLE_API_KEY not found in environment variables.")
+# Logging: minimum level (DEBUG also logs full prompts) and line format,
+# "text" (key=value pairs) or "json" (one object per line).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+
+# Catalog CSV reader: "csv" (stdlib, fast cold start) or "pandas" (optional dependency).
+CATALOG_LOADER = os.getenv("CATALOG_LOADER", "csv").strip().lower()
+# How often the catalog CSVs are checked for edits and hot-reloaded (0 turns polling
+# off; POST /api/catalog/reload and SIGHUP still reload on demand).
+CATALOG_RELOAD_INTERVAL_SECONDS = float(os.getenv("CATALOG_RELOAD_INTERVAL_SECONDS", "5"))
+
+# Generation concurrency
+# Global cap on model calls running at once across all requests in this worker,
+# and the cap on rooms a single /generate request may run in parallel.
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "8"))
+GENERATION_PER_REQUEST_CONCURRENCY = int(os.getenv("GENERATION_PER_REQUEST_CONCURRENCY", "5"))
+
+# Image generation backend: "gemini" (the live API, needs GOOGLE_API_KEY) or
+# "fake" (deterministic synthetic images for offline development and load tests).
+# The fake's latency is log-normal around FAKE_BACKEND_LATENCY_MS; the rates are
+# the fraction of calls failing with a 503, a 429 or returning no image.
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "gemini").strip().lower()
+FAKE_BACKEND_LATENCY_MS = float(os.getenv("FAKE_BACKEND_LATENCY_MS", "1500"))
+FAKE_BACKEND_LATENCY_SIGMA = float(os.getenv("FAKE_BACKEND_LATENCY_SIGMA", "0.5"))
+FAKE_BACKEND_FAILURE_RATE = float(os.getenv("FAKE_BACKEND_FAILURE_RATE", "0"))
+FAKE_BACKEND_RATE_LIMIT_RATE = float(os.getenv("FAKE_BACKEND_RATE_LIMIT_RATE", "0"))
+FAKE_BACKEND_EMPTY_RATE = float(os.getenv("FAKE_BACKEND_EMPTY_RATE", "0"))
+FAKE_BACKEND_IMAGE_WIDTH = int(os.getenv("FAKE_BACKEND_IMAGE_WIDTH", "512"))
+FAKE_BACKEND_SEED = int(os.getenv("FAKE_BACKEND_SEED", "0"))
+
+# Gemini calls
+# Hard deadline per upstream call, retries (with jittered exponential backoff) for
+# transient errors, and an overall budget across retries and quality fallbacks.
+# With fallback on, a failed 4K request steps down 4K -> 2K -> 1K.
+GEMINI_CALL_TIMEOUT_SECONDS = float(os.getenv("GEMINI_CALL_TIMEOUT_SECONDS", "90"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_RETRY_BASE_DELAY_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_DELAY_SECONDS", "1"))
+GEMINI_RETRY_MAX_DELAY_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_DELAY_SECONDS", "16"))
+GEMINI_TOTAL_DEADLINE_SECONDS = float(os.getenv("GEMINI_TOTAL_DEADLINE_SECONDS", "240"))
+GEMINI_QUALITY_FALLBACK = os.getenv("GEMINI_QUALITY_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+# Gemini quota: "model=requests_per_minute:max_concurrency" pairs (unlisted models
+# use the default), and how many rooms each quality lane may have waiting before
+# new generation requests get 429 + Retry-After. Cheaper lanes are served first.
+def _parse_rate_limit(value: str):
+    rpm, _, concurrency = value.partition(":")
+    return float(rpm), int(concurrency or 1)
+
+GEMINI_MODEL_RATE_LIMITS = {
+    model.strip(): _parse_rate_limit(limit)
+    for model, _, limit in (
+        entry.partition("=") for entry in os.getenv(
+            "GEMINI_MODEL_RATE_LIMITS",
+            "gemini-2.5-flash-image=60:8,gemini-3-pro-image-preview=20:4",
+        ).split(",") if entry.strip()
+    )
+}
+GEMINI_DEFAULT_RATE_LIMIT = _parse_rate_limit(os.getenv("GEMINI_DEFAULT_RATE_LIMIT", "30:4"))
+GENERATION_LANE_MAX_QUEUED = {
+    lane.strip(): int(limit)
+    for lane, _, limit in (
+        entry.partition("=") for entry in os.getenv(
+            "GENERATION_LANE_MAX_QUEUED", "1k=64,2k=32,4k=16"
+        ).split(",") if entry.strip()
+    )
+}
+
+# Generation job queue
+# Number of jobs drained concurrently by this worker, and how long a claimed job
+# may go without a heartbeat before another worker (or a restart) picks it up.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+# Finished jobs (and batches whose jobs have all finished) are deleted by the
+# maintenance pass this many days after their last update; 0 keeps them forever.
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+# Largest batch (rooms after de-duplication) accepted by POST /generate/batch.
+BATCH_MAX_ROOMS = int(os.getenv("BATCH_MAX_ROOMS", "1000"))
+
+# Generation cache
+# Opt-in on-disk cache of generated images keyed by the exact model inputs.
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Gallery storage backend: "json" (single gallery_data.json file, small installs)
+# or "sqlite" (indexed embedded database, GALLERY_DB_PATH).
+GALLERY_BACKEND = os.getenv("GALLERY_BACKEND", "json").strip().lower()
+# How often a worker checks whether another process changed the gallery store
+# (a stat or a one-row query); 0 checks on every access.
+GALLERY_REFRESH_INTERVAL_SECONDS = float(os.getenv("GALLERY_REFRESH_INTERVAL_SECONDS", "1"))
+
+# Image layout for new saves: "session" (a directory of files per session) or
+# "content" (blobs named by SHA-256 in fan-out directories, identical bytes stored
+# once, per-session references in SQLite). URLs look the same either way, and
+# existing references are resolved whichever layout is set.
+IMAGE_STORAGE_LAYOUT = os.getenv("IMAGE_STORAGE_LAYOUT", "session").strip().lower()
+
+# Downscaled WebP derivatives written next to each saved image (needs Pillow).
+IMAGE_DERIVATIVE_WIDTHS = tuple(
+    int(w) for w in os.getenv("IMAGE_DERIVATIVE_WIDTHS", "256,512,1024").split(",") if w.strip()
+)
+
+# Image retention. A background task (in one worker at a time) deletes unstarred
+# sessions older than GALLERY_RETENTION_DAYS, evicts the least recently viewed
+# unstarred sessions while images take more than IMAGE_STORAGE_MAX_BYTES (down to
+# IMAGE_STORAGE_TARGET_RATIO of it), and removes image files no gallery session
+# references once they are ORPHAN_GRACE_SECONDS old. 0 turns a limit off. Work is
+# done MAINTENANCE_BATCH_SIZE entries at a time with a pause in between.
+MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "900"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "200"))
+MAINTENANCE_BATCH_PAUSE_SECONDS = float(os.getenv("MAINTENANCE_BATCH_PAUSE_SECONDS", "0.05"))
+GALLERY_RETENTION_DAYS = float(os.getenv("GALLERY_RETENTION_DAYS", "0"))
+IMAGE_STORAGE_MAX_BYTES = int(os.getenv("IMAGE_STORAGE_MAX_BYTES", "0"))
+IMAGE_STORAGE_TARGET_RATIO = float(os.getenv("IMAGE_STORAGE_TARGET_RATIO", "0.9"))
+ORPHAN_GRACE_SECONDS = float(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))
+
+# Image serving: bounded cache of validated paths and stat results, and how long
+# a cached stat (including "file missing") is trusted before re-checking disk.
+IMAGE_STAT_CACHE_SIZE = int(os.getenv("IMAGE_STAT_CACHE_SIZE", "8192"))
+IMAGE_STAT_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_STAT_CACHE_TTL_SECONDS", "10"))
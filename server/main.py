@@ -1,10 +1,58 @@
+import asyncio
+import signal
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from routers import data_routes, generate_routes, gallery_routes, image_routes
+from services import data_loader
+from services.gallery_service import gallery_service
+from services.job_queue import job_workers
+from services.log import get_logger
+from services.maintenance import image_maintenance
+from services.metrics import registry
+from services.system_prompt import system_prompt
 import uvicorn
 import os
 
-app = FastAPI()
+log = get_logger("app")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up before taking traffic: a worker that can't load the catalog fails
+    # to start instead of failing every request.
+    await run_in_threadpool(data_loader.warm_up)
+    await run_in_threadpool(gallery_service.warm_up)
+    try:
+        await run_in_threadpool(system_prompt.get)
+    except RuntimeError as e:
+        log.warning("System prompt unavailable at startup", error=str(e))
+
+    # Pick up catalog CSV edits without a restart: mtime polling, plus SIGHUP
+    # (per worker process) to force a reload.
+    data_loader.catalog_reloader.start()
+    loop = asyncio.get_running_loop()
+    sighup = getattr(signal, "SIGHUP", None)
+    try:
+        loop.add_signal_handler(sighup, data_loader.catalog_reloader.trigger)
+    except (NotImplementedError, RuntimeError, TypeError, ValueError):
+        sighup = None  # Windows, or not running in the main thread
+
+    # Drain queued (and resume interrupted) generation jobs in the background.
+    job_workers.start()
+    # Retention, quota eviction and the orphan sweep, in small batches.
+    image_maintenance.start()
+    yield
+    await image_maintenance.stop()
+    await job_workers.stop()
+    if sighup:
+        loop.remove_signal_handler(sighup)
+    await data_loader.catalog_reloader.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 # Allow common local dev hosts/ports and still support explicit origins.
@@ -35,5 +83,10 @@ app.include_router(image_routes.router, prefix="/api")
 def read_root():
     return {"message": "Room Scene Visualizer API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Stage timings and counters in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
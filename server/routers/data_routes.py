@@ -1,42 +1,99 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from typing import List, Optional
-from services.data_loader import get_data
+from services.data_loader import CatalogLoadError, catalog_reloader, get_catalog, get_data
+from services.encoded_response import VersionedPayloadCache, encoded_response
 
 router = APIRouter()
 
-@router.get("/options")
-def get_global_options():
-    data = get_data()
+# Catalog responses are serialized and compressed once per catalog version
+_payloads = VersionedPayloadCache()
+
+OPTION_KEYS = (
+    "roomTypes", "colorWheelOptions", "aspectRatios", "imageQualityOptions",
+    "flooringTypes", "floorBoardWidths",
+)
+
+def _options(data):
+    return {key: data.get(key, []) for key in OPTION_KEYS}
+
+def _catalog_response(request: Request, key, build, catalog=None):
+    """
+    Serve a catalog view from its pre-encoded payload. `build(catalog)` runs
+    once per catalog version; the header says which version answered.
+    """
+    # One snapshot per request, even if a reload lands meanwhile
+    catalog = catalog or get_catalog()
+    version = catalog.version if catalog else ""
+    payload = _payloads.get(version, key, lambda: build(catalog))
+    return encoded_response(request, payload, {"X-Catalog-Version": version})
+
+def _catalog_info(catalog):
+    if not catalog:
+        return {"version": None, "loadedAt": None, "styles": 0}
     return {
-        "roomTypes": data.get("roomTypes", []),
-        "colorWheelOptions": data.get("colorWheelOptions", []),
-        "aspectRatios": data.get("aspectRatios", []),
-        "imageQualityOptions": data.get("imageQualityOptions", []),
-        "flooringTypes": data.get("flooringTypes", []),
-        "floorBoardWidths": data.get("floorBoardWidths", [])
+        "version": catalog.version,
+        "loadedAt": catalog.loaded_at,
+        "styles": len(catalog.frontend_data["styles"]),
     }
 
+@router.get("/options")
+def get_global_options(request: Request):
+    return _catalog_response(request, "options", lambda catalog: _options(get_data(catalog)))
+
 @router.get("/styles")
-def get_styles():
-    data = get_data()
-    return data.get("styles", [])
+def get_styles(request: Request):
+    return _catalog_response(request, "styles", lambda catalog: get_data(catalog).get("styles", []))
+
+def _people_response(request: Request, kind: str, style_id: Optional[str]):
+    # ?styleId= is a lookup in the precomputed style -> people index
+    catalog = get_catalog()
+    if not style_id:
+        return _catalog_response(request, kind, lambda c: get_data(c).get(kind, []), catalog)
+    people = catalog.raw_data["people_by_style"][kind].get(style_id) if catalog else None
+    if people is None:
+        # Unknown styles share one cached empty list rather than growing the cache
+        return _catalog_response(request, (kind, None), lambda c: [], catalog)
+    return _catalog_response(request, (kind, style_id), lambda c: people, catalog)
 
 @router.get("/architects")
-def get_architects(styleId: Optional[str] = None):
-    data = get_data()
-    architects = data.get("architects", [])
-    
-    if styleId:
-        return [a for a in architects if styleId in a["styleIds"]]
-    
-    return architects
+def get_architects(request: Request, styleId: Optional[str] = None):
+    return _people_response(request, "architects", styleId)
 
 @router.get("/designers")
-def get_designers(styleId: Optional[str] = None):
-    data = get_data()
-    designers = data.get("designers", [])
-    
-    if styleId:
-        return [d for d in designers if styleId in d["styleIds"]]
-    
-    return designers
+def get_designers(request: Request, styleId: Optional[str] = None):
+    return _people_response(request, "designers", styleId)
+
+@router.get("/bootstrap")
+def get_bootstrap(request: Request):
+    """Everything the Generator page needs on load, in one response."""
+    def build(catalog):
+        data = get_data(catalog)
+        return {
+            "catalogVersion": catalog.version if catalog else None,
+            "options": _options(data),
+            "styles": data.get("styles", []),
+            "architects": data.get("architects", []),
+            "designers": data.get("designers", []),
+        }
+    return _catalog_response(request, "bootstrap", build)
+
+@router.get("/catalog")
+def get_catalog_version():
+    """The catalog version this worker is serving (a hash of the CSV contents)."""
+    return _catalog_info(get_catalog())
+
+@router.post("/catalog/reload")
+async def reload_catalog(force: bool = Query(False)):
+    """
+    Re-read the catalog CSVs in this worker if they changed (or always, with
+    force). A catalog that fails to load is rejected and the current one kept.
+    """
+    try:
+        catalog, changed = await catalog_reloader.reload(force)
+    except CatalogLoadError as e:
+        current = get_catalog()
+        raise HTTPException(
+            status_code=422,
+            detail=f"Catalog rejected ({e}); still serving {current.version if current else 'nothing'}",
+        )
+    return {**_catalog_info(catalog), "changed": changed}
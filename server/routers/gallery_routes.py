@@ -1,31 +1,185 @@
-from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
 from services.gallery_service import gallery_service
+from services.image_storage import image_storage
+from services.session_access import session_access
+from services.zip_stream import stream_zip
+import base64
+import hashlib
+import json
+import re
 
 router = APIRouter()
 
+# Matches the client's day-granularity filter: a session counts as "today"
+# until it is a full day old, "this week" until 8 days old, and so on.
+DATE_RANGE_DAYS = {
+    "today": 1,
+    "this-week": 8,
+    "this-month": 31,
+}
+MAX_PAGE_SIZE = 500
+
+def _split_values(values: Optional[List[str]]) -> List[str]:
+    """Accept repeated query params and/or comma-separated values."""
+    if not values:
+        return []
+    return [v.strip() for value in values for v in value.split(",") if v.strip()]
+
+def encode_cursor(session: dict) -> str:
+    raw = json.dumps([session.get("createdAt", ""), session.get("id", "")])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (str(created_at), str(session_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/gallery/sessions")
 def get_sessions(
-    roomType: Optional[str] = None,
-    style: Optional[str] = None,
-    dateRange: Optional[str] = None
+    request: Request,
+    response: Response,
+    roomType: Optional[List[str]] = Query(None),
+    style: Optional[List[str]] = Query(None),
+    dateRange: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
 ):
-    sessions = gallery_service.get_sessions()
-    
-    # Simple filtering on the backend if needed, but primarily client-side filtering logic
-    # is often richer. However, filtering here saves bandwidth.
-    
-    filtered_sessions = sessions
-
-    if style:
-        filtered_sessions = [s for s in filtered_sessions if s.get("designStyle", {}).get("id") == style]
-    
-    # Note: efficient filtering would require more complex logic especially for dates and "any of roomTypes"
-    # For now, we return all and let client filter, OR implement basic single-value matching.
-    # The requirement says "Implement API endpoints for filtering", so we should support it.
-    
-    # This is a basic implementation. Ideally we process `activeFilters` from client.
-    # But since the client likely has full dataset or handles it, we can just return all for now unless dataset is huge.
-    # We will return all for MVP as dataset is local JSON.
-    
+    """
+    List sessions newest-first.
+
+    `roomType` and `style` accept several values (repeated or comma-separated);
+    a session matches if it has any of the room types and any of the styles.
+    With `limit`, the `X-Next-Cursor` response header carries an opaque cursor
+    for the next page; it is absent on the last page.
+
+    Responses carry an ETag; a matching `If-None-Match` gets a 304 so polling
+    clients don't re-download an unchanged gallery.
+    """
+    # The list only changes when the gallery does, so version + query is enough.
+    # dateRange is resolved against the clock, so its answer can change without
+    # a write; folding in the current hour makes those ETags expire.
+    etag_source = json.dumps([
+        gallery_service.revision, roomType, style, dateRange, limit, cursor,
+        datetime.utcnow().strftime("%Y-%m-%dT%H") if dateRange and dateRange != "all-time" else None,
+    ])
+    etag = '"' + hashlib.sha256(etag_source.encode("utf-8")).hexdigest()[:32] + '"'
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    ):
+        return Response(status_code=304, headers=cache_headers)
+    response.headers.update(cache_headers)
+
+    since = None
+    if dateRange and dateRange != "all-time":
+        days = DATE_RANGE_DAYS.get(dateRange)
+        if days is None:
+            raise HTTPException(status_code=400, detail=f"Unknown dateRange '{dateRange}'")
+        since = (datetime.utcnow() - timedelta(days=days)).isoformat() + "Z"
+
+    sessions, has_more = gallery_service.query_sessions(
+        room_types=_split_values(roomType),
+        styles=_split_values(style),
+        since=since,
+        limit=limit,
+        before=decode_cursor(cursor) if cursor else None,
+    )
+
+    if has_more and sessions:
+        response.headers["X-Next-Cursor"] = encode_cursor(sessions[-1])
+
     return sessions
+
+class SessionUpdate(BaseModel):
+    starred: bool
+
+@router.patch("/gallery/sessions/{session_id}")
+def update_session(session_id: str, update: SessionUpdate):
+    """Star or unstar a session. Starred sessions are exempt from retention and quota eviction."""
+    session = gallery_service.set_starred(session_id, update.starred)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@router.delete("/gallery/sessions/{session_id}", status_code=202)
+def delete_session(session_id: str):
+    """
+    Remove a session from the gallery at once; its image files are deleted
+    in the background, so the response doesn't wait on the filesystem.
+    """
+    if not gallery_service.remove_sessions([session_id]):
+        raise HTTPException(status_code=404, detail="Session not found")
+    image_storage.delete_session_images_later(session_id)
+    session_access.forget([session_id])
+    return {"id": session_id, "status": "deleting"}
+
+def _archive_entries(sessions: List[Dict], folder: str, image_ids: Optional[set] = None):
+    """(arcname, path) pairs for the stored images of `sessions`, with unique names."""
+    used = set()
+    for session in sessions:
+        style_id = (session.get("designStyle") or {}).get("id", "session")
+        for image in session.get("images", []):
+            if image_ids is not None and image.get("id") not in image_ids:
+                continue
+            path = image_storage.get_image_path(image.get("url", ""))
+            if not path:
+                continue
+            room_id = (image.get("roomType") or {}).get("id", "image")
+            base = f"{style_id}-{room_id}-{str(image.get('id', ''))[:8]}"
+            name = base
+            counter = 1
+            while name in used:
+                counter += 1
+                name = f"{base}-{counter}"
+            used.add(name)
+            yield f"{folder}/{name}{path.suffix.lower()}", path
+
+def _zip_response(sessions: List[Dict], name: str, image_ids: Optional[set] = None):
+    folder = re.sub(r"[^A-Za-z0-9._-]+", "-", name).strip("-.") or "images"
+    entries = list(_archive_entries(sessions, folder, image_ids))
+    if not entries:
+        raise HTTPException(status_code=404, detail="No stored images to download")
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{folder}.zip"'},
+    )
+
+@router.get("/gallery/sessions/{session_id}/download")
+def download_session(session_id: str, name: Optional[str] = None):
+    """Stream a ZIP of one session's images, built on the fly."""
+    session = gallery_service.get_session_by_id(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return _zip_response([session], name or f"session-{session_id[:8]}")
+
+@router.get("/gallery/download")
+def download_sessions(
+    sessionIds: List[str] = Query(...),
+    imageIds: Optional[List[str]] = Query(None),
+    name: Optional[str] = None,
+):
+    """
+    Stream a ZIP of several sessions' images. `imageIds` optionally narrows
+    the archive to specific images; both accept comma-separated values.
+    """
+    sessions = []
+    for session_id in _split_values(sessionIds):
+        session = gallery_service.get_session_by_id(session_id)
+        if session:
+            sessions.append(session)
+    if not sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    selected = set(_split_values(imageIds)) if imageIds else None
+    return _zip_response(sessions, name or "gallery-images", selected)
@@ -1,13 +1,28 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional
-from services.gemini_service import generate_room_image
+from typing import Dict, List, Optional
+from config import BATCH_MAX_ROOMS
+from services.batch_service import batch_size_bound, expand_batch
 from services.gallery_service import gallery_service
-from services.image_storage import image_storage
+from services.gemini_service import QUALITY_CONFIG, generation_limiter
+from services.generation_cache import generation_cache
+from services.generation_service import build_session, generate_rooms, new_room_plan
+from services.log import get_logger
+from services.job_queue import batch_to_response, job_store, job_workers, job_to_response
+from services.rate_limiter import GenerationOverloaded
+from services.session_access import active_sessions
+import asyncio
+import json
 import uuid
-from datetime import datetime
 
 router = APIRouter()
+log = get_logger("generate")
+
+# Streams keep generating (and save their session) if the client disconnects;
+# hold references so those tasks aren't garbage collected mid-run.
+_stream_tasks = set()
 
 class GenerateRequest(BaseModel):
     room_type_ids: List[str]
@@ -19,130 +34,212 @@ class GenerateRequest(BaseModel):
     image_quality_id: str
     flooring_type_id: Optional[str] = None
     floor_board_width_id: Optional[str] = None
+    # Bypass the generation cache and always call the model
+    force_fresh: bool = False
+
+class BatchRequest(BaseModel):
+    # Every combination of these lists is generated
+    design_style_ids: List[str]
+    room_type_ids: List[str]
+    color_wheel_ids: List[str]
+    flooring_type_ids: List[Optional[str]] = [None]
+    floor_board_width_ids: List[Optional[str]] = [None]
+    aspect_ratio_id: str
+    image_quality_id: str
+    # Default to the first architect/designer listed for each style
+    architect_id: Optional[str] = None
+    designer_id: Optional[str] = None
+    force_fresh: bool = False
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    total_jobs: int
+    total_rooms: int
+    duplicates_dropped: int
 
 class GenerationResponse(BaseModel):
     job_id: str
     status: str
     results: List[dict] = []
 
-@router.post("/generate")
-async def generate_images(request: GenerateRequest):    
-    results = []
-    generated_images = []
+def _lane(request: GenerateRequest) -> str:
+    return request.image_quality_id if request.image_quality_id in QUALITY_CONFIG else "1k"
+
+async def _admit(request: GenerateRequest):
+    """Reject with 429 + Retry-After when the request's quality lane is full."""
+    lane = _lane(request)
+    backlog = await run_in_threadpool(job_store.backlog, lane)
+    try:
+        generation_limiter.admit(lane, QUALITY_CONFIG[lane]["model"], len(request.room_type_ids), backlog)
+    except GenerationOverloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+@router.post("/generate", response_model=GenerationResponse, status_code=202)
+async def generate_images(request: GenerateRequest):
+    """
+    Queue a generation job and return immediately.
+
+    Progress and results are available from GET /jobs/{job_id}.
+    """
+    if not request.room_type_ids:
+        raise HTTPException(status_code=400, detail="No room types requested")
+    await _admit(request)
+
+    # Store the lane, not the raw id, so the lane's backlog counts this job
+    params = {**request.model_dump(), "image_quality_id": _lane(request)}
+    job = await run_in_threadpool(job_store.enqueue, params)
+    job_workers.notify()
+
+    return GenerationResponse(job_id=job["id"], status=job["status"])
+
+@router.get("/generate/cache")
+def get_cache_stats():
+    return generation_cache.stats()
+
+@router.get("/generate/limits")
+def get_limiter_stats():
+    return generation_limiter.stats()
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(job_store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_response(job)
+
+@router.post("/generate/batch", response_model=BatchResponse, status_code=202)
+async def generate_batch(request: BatchRequest):
+    """
+    Queue a catalog build: styles x rooms x color wheels x flooring.
+
+    Prompts are compiled and de-duplicated up front, then each style
+    combination is queued as one job (and becomes one gallery session).
+    Batch jobs run behind interactive requests. Progress is available from
+    GET /batches/{batch_id}.
+    """
+    if not (request.design_style_ids and request.room_type_ids and request.color_wheel_ids):
+        raise HTTPException(status_code=400, detail="Styles, room types and color wheels are required")
+
+    spec = request.model_dump()
+    # Reject oversized batches before compiling any prompts
+    bound = batch_size_bound(spec)
+    if bound > BATCH_MAX_ROOMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch has up to {bound} rooms; the limit is {BATCH_MAX_ROOMS}",
+        )
+    try:
+        jobs, duplicates = await run_in_threadpool(expand_batch, spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    total_rooms = sum(len(job["room_type_ids"]) for job in jobs)
+    if total_rooms > BATCH_MAX_ROOMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch has {total_rooms} rooms; the limit is {BATCH_MAX_ROOMS}",
+        )
+    if not jobs:
+        raise HTTPException(status_code=400, detail="Batch has no rooms to generate")
+
+    batch_id = await run_in_threadpool(job_store.enqueue_batch, spec, jobs, duplicates)
+    job_workers.notify()
+
+    return BatchResponse(
+        batch_id=batch_id,
+        total_jobs=len(jobs),
+        total_rooms=total_rooms,
+        duplicates_dropped=duplicates,
+    )
+
+@router.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = await run_in_threadpool(job_store.get_batch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_to_response(batch)
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/generate/stream")
+async def generate_images_stream(request: GenerateRequest):
+    """
+    Generate rooms inline and stream each result as Server-Sent Events.
+
+    Emits a `room` event as each room's image is stored, then a final
+    `complete` event carrying the session id (or an `error` event).
+    """
+    if not request.room_type_ids:
+        raise HTTPException(status_code=400, detail="No room types requested")
+    await _admit(request)
+
+    params = request.model_dump()
     session_id = str(uuid.uuid4())
-    
-    # Helper to format names nicely
-    def format_name(kebab_id):
-        return kebab_id.replace("-", " ").title()
-
-    style_name = format_name(request.design_style_id)
-    architect_name = format_name(request.architect_id)
-    designer_name = format_name(request.designer_id)
-
-    for room_id in request.room_type_ids:
-        room_name = format_name(room_id)
-        image_id = str(uuid.uuid4())
-        
+    rooms = new_room_plan(request.room_type_ids)
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def on_room_finished(index: int, outcome):
+        room_id = rooms[index][0]
+        if outcome is None:
+            await events.put(_sse("room", {
+                "room_type_id": room_id,
+                "success": False,
+                "error": "Generation failed",
+            }))
+            return
+
+        api_result = outcome[0]["result"]
+        payload = {
+            "room_type_id": room_id,
+            "success": bool(api_result.get("success")),
+            "model_used": api_result.get("model_used"),
+        }
+        if payload["success"]:
+            payload["url"] = api_result.get("data")
+        else:
+            payload["error"] = api_result.get("error")
+        await events.put(_sse("room", payload))
+
+    async def run():
+        held = False
         try:
-            # generate_room_image returns base64 + mime data for storage
-            response_data = generate_room_image(
-                room_type_id=room_id,
-                design_style_id=request.design_style_id,
-                architect_id=request.architect_id,
-                designer_id=request.designer_id,
-                color_wheel_id=request.color_wheel_id,
-                aspect_ratio_id=request.aspect_ratio_id,
-                model_id=request.image_quality_id,
-                flooring_type_id=request.flooring_type_id,
-                floor_board_width_id=request.floor_board_width_id
-            )
-            
-            # Extract URL for internal storage (Gallery/Session) which expects a string
-            if response_data.get("success"):
+            # Images land before the session does; keep the orphan sweep off them
+            await run_in_threadpool(active_sessions.add, session_id)
+            held = True
+            with generation_limiter.reserve(_lane(request), len(rooms)):
+                outcomes = await generate_rooms(params, session_id, rooms, on_room_finished=on_room_finished)
+            images = [image for _, image in filter(None, outcomes)]
+            if not images:
+                await events.put(_sse("error", {"detail": "No rooms generated"}))
+                return
+            session = build_session(params, session_id, images)
+            await run_in_threadpool(gallery_service.add_session, session)
+            await events.put(_sse("complete", {"session_id": session_id}))
+        except Exception as e:
+            log.error("Streaming generation failed", session=session_id, error=str(e))
+            await events.put(_sse("error", {"detail": "Generation failed"}))
+        finally:
+            if held:
                 try:
-                    image_url = image_storage.save_image(
-                        session_id=session_id,
-                        room_type_id=room_id,
-                        image_id=image_id,
-                        base64_data=response_data.get("base64_data"),
-                        mime_type=response_data.get("mime_type", "image/jpeg"),
-                    )
-                    api_result = {
-                        "success": True,
-                        "data": image_url,
-                        "model_used": response_data.get("model_used"),
-                        "prompt": response_data.get("prompt"),
-                    }
+                    await run_in_threadpool(active_sessions.remove, session_id)
                 except Exception as e:
-                    print(f"Failed to store {room_name}: {e}")
-                    image_url = "https://placehold.co/1024x1024?text=Storage+Failed"
-                    api_result = {
-                        "success": False,
-                        "error": "Image storage failed",
-                        "prompt": response_data.get("prompt"),
-                    }
-            else:
-                print(f"Failed to generate {room_name}: {response_data.get('error')}")
-                image_url = "https://placehold.co/1024x1024?text=Generation+Failed"
-                api_result = response_data
-
-            # API Response: Frontend expects { result: { success, data, ... } }
-            results.append({
-                "room_type_id": room_id,
-                "result": api_result
-            })
-
-            # Session Storage: Expects { url: "string_url" }
-            generated_images.append({
-                "id": image_id,
-                "roomType": {
-                    "id": room_id,
-                    "name": room_name
-                },
-                "url": image_url, # Ensure this is a string
-                "selected": False
-            })
-            
-        except Exception as e:
-            print(f"Error generating {room_name}: {e}")
-            # Continue with other rooms even if one fails
-            continue
-    
-    if not results:
-        raise HTTPException(status_code=500, detail="No rooms generated")
-
-    # Create and save session
-    quality_labels = {
-        "1k": "1K",
-        "2k": "2K",
-        "4k": "4K"
-    }
-    image_quality_label = quality_labels.get(request.image_quality_id, request.image_quality_id)
-
-    session = {
-        "id": session_id,
-        "createdAt": datetime.utcnow().isoformat() + "Z", # proper ISO format
-        "designStyle": {
-            "id": request.design_style_id,
-            "name": style_name
-        },
-        "architect": {
-            "id": request.architect_id,
-            "name": architect_name
-        },
-        "designer": {
-            "id": request.designer_id,
-            "name": designer_name
-        },
-        "colorWheel": request.color_wheel_id, # Assumes valid value passed 'Light'|'Medium'|'Dark'
-        "aspectRatio": request.aspect_ratio_id.replace(":", ":"), # careful if format differs
-        "imageQuality": image_quality_label,
-        "images": generated_images
-    }
-
-    gallery_service.add_session(session)
-
-    return {
-        "success": True,
-        "results": results
-    }
+                    log.warning("Failed to release active session", session=session_id, error=str(e))
+            await events.put(None)
+
+    task = asyncio.create_task(run())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def event_stream():
+        while True:
+            message = await events.get()
+            if message is None:
+                break
+            yield message
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,35 +1,135 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from fastapi.responses import FileResponse
-from services.image_storage import image_storage
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from services.image_storage import ImageFileInfo, image_storage
+from services.metrics import IMAGE_SERVE_BYTES, IMAGE_SERVE_SECONDS
+from services.session_access import session_access
+import time
 
 router = APIRouter()
 
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+
+class _MeteredFileResponse(FileResponse):
+    """FileResponse that records serve latency (including the transfer) and bytes sent."""
+
+    def __init__(self, *args, variant: str, started: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.variant = variant
+        self.started = started
+
+    async def __call__(self, scope, receive, send):
+        status = None
+        sent = 0
+
+        async def metered_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                sent += self.stat_result.st_size
+            await send(message)
+
+        try:
+            await super().__call__(scope, receive, metered_send)
+        finally:
+            IMAGE_SERVE_BYTES.inc(sent, variant=self.variant)
+            IMAGE_SERVE_SECONDS.observe(
+                time.perf_counter() - self.started, variant=self.variant, status=str(status or 499)
+            )
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison, as RFC 9110 specifies for If-None-Match
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _not_modified_since(if_modified_since: str, info: ImageFileInfo) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have one-second resolution
+    return int(info.stat.st_mtime) <= since
+
 
 @router.get("/images/sessions/{session_id}/{filename}")
-async def serve_image(session_id: str, filename: str):
+def serve_image(
+    request: Request,
+    session_id: str,
+    filename: str,
+    size: Optional[int] = Query(None, ge=1),
+):
     """
     Serve an image file from storage.
+
+    With `size`, serve the smallest WebP derivative at least that wide,
+    falling back to the original if none has been generated yet.
+
+    Responses carry a strong content ETag and Last-Modified; matching
+    If-None-Match / If-Modified-Since requests get a 304, and Range requests
+    are answered with partial content.
     """
+    started = time.perf_counter()
     relative_url = f"/api/images/sessions/{session_id}/{filename}"
-    file_path = image_storage.get_image_path(relative_url)
+    info = image_storage.stat_image(relative_url)
 
-    if not file_path:
+    if not info:
         raise HTTPException(status_code=404, detail="Image not found")
+    # Last view time drives quota eviction; an in-memory write, flushed later
+    session_access.touch(session_id)
+
+    # CORS is handled by the global CORSMiddleware in main.py.
+    cache_control = "public, max-age=31536000"
 
-    ext = file_path.suffix.lower()
-    media_types = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".webp": "image/webp",
+    variant = "original"
+    if size:
+        derivative = image_storage.get_derivative(info.path, size)
+        if derivative:
+            info = derivative
+            variant = "derivative"
+        elif image_storage.derivative_widths and not image_storage.has_derivatives(info.path):
+            # Derivatives still being generated: don't pin the original to this URL.
+            # (Once they exist, a missing width just means the original is smaller.)
+            cache_control = "public, max-age=60"
+
+    headers = {
+        "Cache-Control": cache_control,
+        "ETag": info.etag,
+        "Last-Modified": formatdate(info.stat.st_mtime, usegmt=True),
     }
-    media_type = media_types.get(ext, "image/jpeg")
 
-    # CORS is handled by the global CORSMiddleware in main.py.
-    headers = {"Cache-Control": "public, max-age=31536000"}
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    not_modified = (
+        _etag_matches(if_none_match, info.etag) if if_none_match is not None
+        else bool(if_modified_since) and _not_modified_since(if_modified_since, info)
+    )
+    if not_modified:
+        IMAGE_SERVE_SECONDS.observe(time.perf_counter() - started, variant=variant, status="304")
+        return Response(status_code=304, headers=headers)
+
+    media_type = MEDIA_TYPES.get(info.path.suffix.lower(), "image/jpeg")
 
-    return FileResponse(
-        path=file_path,
+    # Passing the cached stat spares FileResponse its own stat; it handles
+    # Range / If-Range against the ETag and Last-Modified set above.
+    return _MeteredFileResponse(
+        path=info.path,
         media_type=media_type,
         headers=headers,
+        stat_result=info.stat,
+        variant=variant,
+        started=started,
     )
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Create WebP derivatives for images saved before derivatives existed.
+
+Usage: python scripts/backfill_derivatives.py [--overwrite] [--workers N]
+
+Existing derivatives are kept unless --overwrite is given.
+"""
+
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).parent.parent
+sys.path.append(str(SERVER_DIR))
+
+from services.gallery_service import gallery_service
+from services.image_storage import image_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--overwrite", action="store_true", help="Regenerate existing derivatives")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel resize workers")
+    args = parser.parse_args()
+
+    if not image_storage.derivative_widths:
+        print("Derivatives are disabled (Pillow missing or IMAGE_DERIVATIVE_WIDTHS empty).")
+        return
+
+    paths = []
+    for session in gallery_service.get_sessions():
+        for image in session.get("images", []):
+            path = image_storage.get_image_path(image.get("url", ""))
+            if path:
+                paths.append(path)
+
+    def process(path: Path) -> int:
+        try:
+            return image_storage.create_derivatives(path, overwrite=args.overwrite)
+        except Exception as e:
+            print(f"Error processing {path}: {e}")
+            return 0
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        written = sum(pool.map(process, paths))
+
+    print("Backfill complete!")
+    print(f"Images scanned: {len(paths)}")
+    print(f"Derivatives written: {written}")
+
+
+if __name__ == "__main__":
+    main()
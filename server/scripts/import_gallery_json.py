@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Import gallery_data.json into the SQLite gallery store.
+
+Usage: python scripts/import_gallery_json.py [path/to/gallery_data.json]
+
+The SQLite store also imports automatically on first start when its database
+is empty; this script is for re-running the import explicitly. Sessions that
+already exist are replaced.
+"""
+
+import sys
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).parent.parent
+sys.path.append(str(SERVER_DIR))
+
+from services.gallery_store import SqliteGalleryStore
+GALLERY_FILE = SERVER_DIR / "gallery_data.json"
+
+
+def main():
+    json_path = Path(sys.argv[1]) if len(sys.argv) > 1 else GALLERY_FILE
+    if not json_path.exists():
+        print(f"Gallery file not found: {json_path}")
+        return
+
+    store = SqliteGalleryStore(import_from=None)
+    count = store.import_json(str(json_path))
+
+    print("Import complete!")
+    print(f"Sessions imported: {count}")
+    print(f"Database: {store.db_path}")
+
+
+if __name__ == "__main__":
+    main()
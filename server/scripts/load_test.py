@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Load-test a running server: generation jobs, gallery pages and image fetches.
+
+Usage: python scripts/load_test.py [--base-url URL] [--duration S] [--concurrency N]
+                                   [--mix generate=1,gallery=5,image=10] [--json]
+
+Point it at a server started with GENERATION_BACKEND=fake to measure the
+service itself without spending model quota, e.g.
+
+    GENERATION_BACKEND=fake FAKE_BACKEND_LATENCY_MS=800 uvicorn main:app
+    python scripts/load_test.py --duration 60 --concurrency 32
+
+Each virtual user loops picking an operation by weight. Generation is timed
+end to end (submit, then poll the job until it finishes); 429s from
+admission control are counted separately from errors. Reports throughput
+and p50/p95/p99 latency per operation.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+ROOM_TYPES = ["kitchen", "living-room", "primary-bedroom", "primary-bath", "dining-room"]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, int] = defaultdict(int)
+
+    def report(self, elapsed: float) -> Dict:
+        result = {}
+        for op in sorted(set(self.latencies) | set(self.errors) | set(self.rejected)):
+            values = sorted(self.latencies[op])
+            result[op] = {
+                "ok": len(values),
+                "errors": self.errors[op],
+                "rejected_429": self.rejected[op],
+                "throughput_per_s": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+            }
+        return result
+
+
+async def load_catalog(client: httpx.AsyncClient) -> Dict:
+    styles = (await client.get("/styles")).json()
+    options = (await client.get("/options")).json()
+    architects = (await client.get("/architects")).json()
+    designers = (await client.get("/designers")).json()
+    return {
+        "styles": [s["id"] for s in styles],
+        "rooms": [r["id"] for r in options.get("roomTypes", [])] or ROOM_TYPES,
+        "colors": [c["id"] for c in options.get("colorWheelOptions", [])] or ["medium"],
+        "architects": architects,
+        "designers": designers,
+    }
+
+
+async def image_urls(client: httpx.AsyncClient) -> List[str]:
+    res = await client.get("/gallery/sessions", params={"limit": 200})
+    urls = []
+    for session in res.json():
+        for image in session.get("images", []):
+            url = image.get("url", "")
+            if url.startswith("/api/images/"):
+                urls.append(url)
+    return urls
+
+
+async def op_generate(client: httpx.AsyncClient, catalog: Dict, args, rng: random.Random, rec: Recorder):
+    style = rng.choice(catalog["styles"])
+    architect = next((a["id"] for a in catalog["architects"] if style in a["styleIds"]), "architect")
+    designer = next((d["id"] for d in catalog["designers"] if style in d["styleIds"]), "designer")
+    body = {
+        "room_type_ids": rng.sample(catalog["rooms"], min(args.rooms, len(catalog["rooms"]))),
+        "design_style_id": style,
+        "architect_id": architect,
+        "designer_id": designer,
+        "color_wheel_id": rng.choice(catalog["colors"]),
+        "aspect_ratio_id": "1:1",
+        "image_quality_id": args.quality,
+        "force_fresh": True,
+    }
+    start = time.perf_counter()
+    res = await client.post("/generate", json=body)
+    if res.status_code == 429:
+        rec.rejected["generate"] += 1
+        await asyncio.sleep(min(float(res.headers.get("Retry-After", "1")), 5))
+        return
+    if res.status_code != 202:
+        rec.errors["generate"] += 1
+        return
+    rec.latencies["generate_submit"].append(time.perf_counter() - start)
+
+    job_id = res.json()["job_id"]
+    while True:
+        await asyncio.sleep(args.poll_interval)
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            break
+    if job["status"] == "completed":
+        rec.latencies["generate"].append(time.perf_counter() - start)
+    else:
+        rec.errors["generate"] += 1
+
+
+async def op_gallery(client: httpx.AsyncClient, catalog: Dict, args, rng: random.Random, rec: Recorder):
+    params = {"limit": 50}
+    if rng.random() < 0.3:
+        params["style"] = rng.choice(catalog["styles"])
+    start = time.perf_counter()
+    res = await client.get("/gallery/sessions", params=params)
+    if res.status_code == 200:
+        rec.latencies["gallery"].append(time.perf_counter() - start)
+    else:
+        rec.errors["gallery"] += 1
+
+
+async def op_image(client: httpx.AsyncClient, urls: List[str], args, rng: random.Random, rec: Recorder):
+    if not urls:
+        return
+    url = rng.choice(urls)
+    if rng.random() < 0.5:
+        url += f"?size={rng.choice([256, 512, 1024])}"
+    start = time.perf_counter()
+    res = await client.get(args.origin + url)
+    if res.status_code == 200:
+        rec.latencies["image"].append(time.perf_counter() - start)
+    else:
+        rec.errors["image"] += 1
+
+
+async def run(args) -> Dict:
+    weights = {}
+    for entry in args.mix.split(","):
+        name, _, weight = entry.partition("=")
+        weights[name.strip()] = float(weight or 1)
+
+    rec = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        catalog = await load_catalog(client)
+        urls = await image_urls(client)
+        if weights.get("image") and not urls:
+            print("No stored images in the gallery yet; image fetches will be skipped.")
+
+        deadline = time.monotonic() + args.duration
+        ops = list(weights)
+
+        async def user(index: int):
+            rng = random.Random(args.seed + index)
+            while time.monotonic() < deadline:
+                op = rng.choices(ops, weights=[weights[o] for o in ops])[0]
+                try:
+                    if op == "generate":
+                        await op_generate(client, catalog, args, rng, rec)
+                    elif op == "gallery":
+                        await op_gallery(client, catalog, args, rng, rec)
+                    elif op == "image":
+                        await op_image(client, urls, args, rng, rec)
+                except httpx.HTTPError:
+                    rec.errors[op] += 1
+
+        start = time.monotonic()
+        await asyncio.gather(*(user(i) for i in range(args.concurrency)))
+        return rec.report(time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000/api")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--concurrency", type=int, default=16, help="Virtual users")
+    parser.add_argument("--mix", default="generate=1,gallery=5,image=10", help="Operation weights")
+    parser.add_argument("--rooms", type=int, default=2, help="Rooms per generation request")
+    parser.add_argument("--quality", default="1k", help="image_quality_id for generation")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Job polling interval")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request HTTP timeout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    args.origin = args.base_url.rstrip("/").removesuffix("/api")
+
+    report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'operation':<16}{'ok':>7}{'err':>6}{'429':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, stats in report.items():
+        print(
+            f"{op:<16}{stats['ok']:>7}{stats['errors']:>6}{stats['rejected_429']:>6}"
+            f"{stats['throughput_per_s']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
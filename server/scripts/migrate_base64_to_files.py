@@ -2,21 +2,44 @@
 """
 Migration script: Convert base64 images in gallery_data.json to file storage.
 
-Usage: python scripts/migrate_base64_to_files.py
+Usage: python scripts/migrate_base64_to_files.py [--dry-run] [--workers N] [--restart]
+
+Sessions are parsed one at a time and images are decoded and written across a
+worker pool, so memory stays bounded however large the gallery file is. Each
+written image is recorded in a checkpoint file; an interrupted run resumes
+from it without rewriting those images.
+
+gallery_data.json is only replaced, atomically, once every image is written.
+The replacement is built from the file as it is at that moment, under the
+gallery's own lock, so sessions a running server saved meanwhile are kept, as
+are top-level keys other than "sessions". Only the JSON gallery backend is
+supported; with GALLERY_BACKEND=sqlite the script refuses to run.
 """
 
+import argparse
 import json
+import os
 import shutil
 import sys
+import textwrap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
 
 SERVER_DIR = Path(__file__).parent.parent
 sys.path.append(str(SERVER_DIR))
 
+from config import GALLERY_BACKEND
+from services.file_lock import FileLock
 from services.image_storage import image_storage
 GALLERY_FILE = SERVER_DIR / "gallery_data.json"
 BACKUP_DIR = SERVER_DIR / "backups"
+CHECKPOINT_FILE = SERVER_DIR / "gallery_data.migrate-checkpoint.jsonl"
+OUTPUT_FILE = SERVER_DIR / "gallery_data.json.migrating"
+
+READ_CHUNK_SIZE = 4 * 1024 * 1024
 
 
 def parse_data_url(data_url: str):
@@ -31,65 +54,290 @@ def parse_data_url(data_url: str):
         return None, None
 
 
-def migrate():
-    if not GALLERY_FILE.exists():
-        print(f"Gallery file not found: {GALLERY_FILE}")
-        return
+def decoded_size(b64_data: str) -> int:
+    return len(b64_data) * 3 // 4 - b64_data[-2:].count("=")
 
-    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
-    backup_name = f"gallery_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    backup_path = BACKUP_DIR / backup_name
-    shutil.copy(GALLERY_FILE, backup_path)
-    print(f"Backed up to {backup_path}")
+def iter_sessions(path: Path, extras: Optional[Dict] = None,
+                  chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    Yield the objects of the top-level "sessions" array one at a time,
+    reading the file in chunks rather than loading it whole. Any other
+    top-level keys are parsed whole and stored in `extras`, if given.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = " \t\r\n"
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
 
-    with open(GALLERY_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+        def fill(min_chars: int) -> bool:
+            # Read at least as much again as is buffered, so a session much
+            # larger than one chunk is re-scanned only a logarithmic number of times.
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            data = f.read(max(chunk_size, min_chars))
+            if not data:
+                eof = True
+                return False
+            buffer = buffer[pos:] + data
+            pos = 0
+            return True
 
-    sessions = data.get("sessions", [])
-    total_images = 0
-    migrated_images = 0
+        def peek(skip: str) -> Optional[str]:
+            """Advance past any of `skip`; the next character, or None at end of file."""
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in skip:
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not fill(chunk_size):
+                    return None
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not fill(len(buffer) - pos):
+                        raise
+                    continue
+                # A number may continue in the next chunk
+                if end == len(buffer) and fill(chunk_size):
+                    continue
+                pos = end
+                return value
+
+        if peek(whitespace) != "{":
+            return
+        pos += 1
+        while True:
+            char = peek(whitespace + ",")
+            if char is None or char == "}":
+                return
+            key = decode()
+            if peek(whitespace) != ":":
+                raise ValueError(f"Malformed gallery file: expected ':' after {key!r}")
+            pos += 1
 
-    for session in sessions:
-        session_id = session.get("id")
-        if not session_id:
-            continue
+            if peek(whitespace) != "[" or key != "sessions":
+                value = decode()
+                if extras is not None and key != "sessions":
+                    extras[key] = value
+                continue
+
+            pos += 1
+            while True:
+                char = peek(whitespace + ",")
+                if char is None:
+                    return
+                if char == "]":
+                    pos += 1
+                    break
+                yield decode()
 
+
+def load_checkpoint() -> Dict[Tuple[str, str], str]:
+    done = {}
+    if not CHECKPOINT_FILE.exists():
+        return done
+    with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                done[(entry["session_id"], entry["image_id"])] = entry["url"]
+            except (ValueError, KeyError):
+                continue  # torn last line from an interrupted run
+    return done
+
+
+def dry_run():
+    sessions = 0
+    total_images = 0
+    inline_images = 0
+    inline_bytes = 0
+    done = load_checkpoint()
+    already = 0
+
+    for session in iter_sessions(GALLERY_FILE):
+        sessions += 1
         for image in session.get("images", []):
             total_images += 1
             url = image.get("url", "")
             if not isinstance(url, str) or not url.startswith("data:"):
                 continue
-
-            b64_data, mime = parse_data_url(url)
+            b64_data, _ = parse_data_url(url)
             if not b64_data:
                 continue
+            inline_images += 1
+            inline_bytes += decoded_size(b64_data)
+            if (session.get("id"), image.get("id", "unknown")) in done:
+                already += 1
+
+    print("Dry run - nothing written.")
+    print(f"Sessions: {sessions}")
+    print(f"Total images: {total_images}")
+    print(f"Inline base64 images: {inline_images} ({inline_bytes / (1024 * 1024):.1f} MiB decoded)")
+    if already:
+        print(f"Already written by a previous run: {already}")
+
+
+def migrate_image(session_id: str, image: Dict, b64_data: str, mime: Optional[str]) -> str:
+    return image_storage.save_image_base64(
+        session_id=session_id,
+        room_type_id=image.get("roomType", {}).get("id", "unknown"),
+        image_id=image.get("id", "unknown"),
+        base64_data=b64_data,
+        mime_type=mime or "image/jpeg",
+    )
 
-            room_type_id = image.get("roomType", {}).get("id", "unknown")
-            image_id = image.get("id", "unknown")
 
+def write_output(done: Dict[Tuple[str, str], str]) -> int:
+    """
+    Rewrite the current gallery file into OUTPUT_FILE, pointing every
+    migrated image at its stored file. Returns the images left inline.
+    """
+    extras = {}
+    inline = 0
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as out:
+        out.write('{\n  "sessions": [')
+        written_sessions = 0
+        for session in iter_sessions(GALLERY_FILE, extras):
+            for image in session.get("images", []):
+                url = image.get("url", "")
+                if not isinstance(url, str) or not url.startswith("data:"):
+                    continue
+                new_url = done.get((session.get("id"), image.get("id", "unknown")))
+                if new_url:
+                    image["url"] = new_url
+                else:
+                    inline += 1
+
+            out.write("," if written_sessions else "")
+            out.write("\n" + textwrap.indent(json.dumps(session, indent=2), "    "))
+            written_sessions += 1
+        out.write("\n  ]")
+        for key, value in extras.items():
+            out.write(f",\n  {json.dumps(key)}: " + textwrap.indent(json.dumps(value, indent=2), "  ").lstrip())
+        out.write("\n}\n")
+        out.flush()
+        os.fsync(out.fileno())
+    return inline
+
+
+def migrate(workers: int, restart: bool):
+    if restart:
+        CHECKPOINT_FILE.unlink(missing_ok=True)
+    done = load_checkpoint()
+    resuming = bool(done)
+
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+
+    backup_name = f"gallery_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    backup_path = BACKUP_DIR / backup_name
+    if resuming:
+        print(f"Resuming: {len(done)} images already written")
+    else:
+        shutil.copy(GALLERY_FILE, backup_path)
+        print(f"Backed up to {backup_path}")
+
+    total_images = 0
+    migrated_images = 0
+    resumed_images = 0
+    failed_images = 0
+    max_in_flight = max(1, workers) * 4
+
+    # Write the images; the gallery file is left alone until they all exist
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, \
+            open(CHECKPOINT_FILE, "a", encoding="utf-8") as checkpoint:
+        # Images being written, oldest first: ((session id, image id), future)
+        pending = deque()
+
+        def collect_oldest():
+            nonlocal migrated_images, failed_images
+            key, future = pending.popleft()
             try:
-                new_url = image_storage.save_image(
-                    session_id=session_id,
-                    room_type_id=room_type_id,
-                    image_id=image_id,
-                    base64_data=b64_data,
-                    mime_type=mime or "image/jpeg",
-                )
-                image["url"] = new_url
-                migrated_images += 1
+                new_url = future.result()
             except Exception as e:
-                print(f"Error migrating {image_id}: {e}")
+                failed_images += 1
+                done.pop(key, None)
+                print(f"Error migrating {key[1]}: {e}")
+                return
+            done[key] = new_url
+            migrated_images += 1
+            checkpoint.write(json.dumps({"session_id": key[0], "image_id": key[1], "url": new_url}) + "\n")
+            checkpoint.flush()
 
-    with open(GALLERY_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+        for session in iter_sessions(GALLERY_FILE):
+            session_id = session.get("id")
+            for image in session.get("images", []) if session_id else []:
+                total_images += 1
+                url = image.get("url", "")
+                if not isinstance(url, str) or not url.startswith("data:"):
+                    continue
+
+                key = (session_id, image.get("id", "unknown"))
+                previous_url = done.get(key)
+                if previous_url and image_storage.get_image_path(previous_url):
+                    resumed_images += 1
+                    continue
+
+                b64_data, mime = parse_data_url(url)
+                if not b64_data:
+                    continue
+                pending.append((key, pool.submit(migrate_image, session_id, image, b64_data, mime)))
+                while len(pending) >= max_in_flight:
+                    collect_oldest()
+
+        while pending:
+            collect_oldest()
+
+    # Rebuild from the file as it is now, holding the lock the server's
+    # JSON store writes under, so nothing it saved meanwhile is lost
+    with FileLock(f"{GALLERY_FILE}.lock").hold():
+        still_inline = write_output(done)
+        os.replace(OUTPUT_FILE, GALLERY_FILE)
+    CHECKPOINT_FILE.unlink(missing_ok=True)
 
     print("Migration complete!")
     print(f"Total images: {total_images}")
     print(f"Migrated: {migrated_images}")
-    print(f"Skipped: {total_images - migrated_images}")
-    print(f"Backup: {backup_path}")
+    if resumed_images:
+        print(f"Resumed from checkpoint: {resumed_images}")
+    if failed_images:
+        print(f"Failed: {failed_images}")
+    print(f"Skipped: {total_images - migrated_images - resumed_images - failed_images}")
+    if still_inline:
+        print(f"Still inline (failed, or saved during the run): {still_inline}; run again to migrate them")
+    if not resuming:
+        print(f"Backup: {backup_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Report image counts and sizes without writing")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel decode/write workers")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint from a previous run")
+    args = parser.parse_args()
+
+    if GALLERY_BACKEND != "json":
+        print(f"GALLERY_BACKEND={GALLERY_BACKEND}: the live gallery is not {GALLERY_FILE.name}.")
+        print("This script only migrates the JSON gallery; refusing to run.")
+        sys.exit(1)
+
+    if not GALLERY_FILE.exists():
+        print(f"Gallery file not found: {GALLERY_FILE}")
+        return
+
+    if args.dry_run:
+        dry_run()
+    else:
+        migrate(args.workers, args.restart)
 
 
 if __name__ == "__main__":
-    migrate()
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Move images from per-session directories into the content-addressed blob store.
+
+Usage: python scripts/migrate_to_content_store.py [--dry-run] [--copy] [--workers N]
+
+Every original under IMAGE_STORAGE_DIR/<session>/ is hashed and stored once
+under IMAGE_BLOB_DIR/ab/cd/<sha256>.<ext>. A reference is recorded for its
+existing URL, so gallery data needs no changes. Identical files collapse into
+one blob, and derivatives move along with their original. Session directories
+are removed once empty.
+
+Each file is migrated on its own and the script is safe to re-run, so an
+interrupted run simply continues. With --copy the originals are left in place
+and nothing is removed. Start the server with IMAGE_STORAGE_LAYOUT=content
+afterwards so that new images use the blob store too. Existing references
+resolve in either layout.
+"""
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, Tuple
+
+SERVER_DIR = Path(__file__).parent.parent
+sys.path.append(str(SERVER_DIR))
+
+from services.image_storage import MIME_TO_EXT, ImageStorageService
+
+DERIVATIVE_NAME = re.compile(r"\.w(\d+)\.webp$")
+IMAGE_EXTENSIONS = set(MIME_TO_EXT.values()) | {".jpeg"}
+
+
+def iter_originals(storage: ImageStorageService) -> Iterator[Tuple[str, Path]]:
+    """(session id, path) for every stored original in the session layout."""
+    if not storage.base_dir.exists():
+        return
+    with os.scandir(storage.base_dir) as sessions:
+        for session in sessions:
+            if not session.is_dir():
+                continue
+            with os.scandir(session.path) as files:
+                for entry in files:
+                    name = entry.name
+                    if (name.startswith(".") or DERIVATIVE_NAME.search(name)
+                            or Path(name).suffix.lower() not in IMAGE_EXTENSIONS):
+                        continue
+                    yield session.name, Path(entry.path)
+
+
+def file_blob_name(path: Path) -> str:
+    with open(path, "rb") as f:
+        return ImageStorageService.blob_name(f.read(), path.suffix.lower())
+
+
+def migrate_file(storage: ImageStorageService, session_id: str, path: Path, copy: bool) -> Tuple[bool, int]:
+    """Store one original as a blob and reference it. Returns (new blob, bytes)."""
+    size = path.stat().st_size
+    blob = file_blob_name(path)
+
+    def write(target: Path):
+        if copy:
+            tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+            shutil.copy2(path, tmp_path)
+            os.replace(tmp_path, target)
+        else:
+            shutil.move(str(path), str(target))
+
+    created = storage.add_blob_ref(session_id, path.name, blob, write)
+
+    # Derivatives follow their original; the blob may already have its own
+    blob_path = storage.blob_path(blob)
+    for derivative in path.parent.glob(f"{glob.escape(path.stem)}.w*.webp"):
+        match = DERIVATIVE_NAME.search(derivative.name)
+        if not match:
+            continue
+        target = storage.derivative_path(blob_path, int(match.group(1)))
+        if copy:
+            if not target.exists():
+                shutil.copy2(derivative, target)
+        elif target.exists():
+            derivative.unlink()
+        else:
+            shutil.move(str(derivative), str(target))
+
+    if not copy and path.exists():
+        path.unlink()
+    return created, size
+
+
+def dry_run(storage: ImageStorageService, workers: int):
+    files = list(iter_originals(storage))
+
+    def measure(item):
+        _, path = item
+        return file_blob_name(path), path.stat().st_size
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(measure, files))
+
+    unique = {}
+    for blob, size in results:
+        unique.setdefault(blob, size)
+    total = sum(size for _, size in results)
+    print("Dry run: no files changed.")
+    print(f"Images found: {len(files)} in {len({s for s, _ in files})} sessions")
+    print(f"Unique blobs: {len(unique)}")
+    print(f"Bytes: {total} -> {sum(unique.values())} after de-duplication")
+
+
+def migrate(storage: ImageStorageService, workers: int, copy: bool):
+    files = list(iter_originals(storage))
+
+    def process(item):
+        session_id, path = item
+        try:
+            return migrate_file(storage, session_id, path, copy)
+        except Exception as e:
+            print(f"Error migrating {session_id}/{path.name}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(process, files))
+
+    created = sum(1 for r in results if r and r[0])
+    deduplicated = [r for r in results if r and not r[0]]
+    errors = sum(1 for r in results if r is None)
+
+    removed_dirs = 0
+    if not copy:
+        for session_id in {session_id for session_id, _ in files}:
+            try:
+                (storage.base_dir / session_id).rmdir()
+                removed_dirs += 1
+            except OSError:
+                pass  # Not empty: errors, or files this script doesn't know
+
+    print("Migration complete!")
+    print(f"Images migrated: {len(files) - errors}")
+    print(f"New blobs: {created}")
+    print(f"Duplicates stored once: {len(deduplicated)} ({sum(size for _, size in deduplicated)} bytes saved)")
+    print(f"Session directories removed: {removed_dirs}")
+    print(f"Errors: {errors}")
+    print(f"References: {storage.refs.count()} in {storage.refs.db_path}")
+    print("Run the server with IMAGE_STORAGE_LAYOUT=content so new images use the blob store.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Report counts and savings without changing files")
+    parser.add_argument("--copy", action="store_true", help="Copy into the blob store, keeping the originals")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel hash/move workers")
+    args = parser.parse_args()
+
+    storage = ImageStorageService(layout="content", derivative_widths=())
+    print(f"Sessions: {storage.base_dir}")
+    print(f"Blobs:    {storage.blob_dir}")
+
+    if args.dry_run:
+        dry_run(storage, args.workers)
+    else:
+        migrate(storage, args.workers, args.copy)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import hashlib
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from services.data_loader import Catalog, get_catalog, get_people_for_style, get_style
+from services.gemini_service import compile_prompt
+
+
+def default_reference(kind: str, style_id: str, catalog: Optional[Catalog] = None) -> Optional[str]:
+    """First architect or designer associated with a style, for specs that omit one."""
+    people = get_people_for_style(kind, style_id, catalog)
+    return people[0]["id"] if people else None
+
+
+def batch_size_bound(spec: Dict) -> int:
+    """
+    Rooms a batch can expand to at most (before prompt de-duplication); cheap
+    enough to check before expand_batch compiles a prompt for each of them.
+    """
+    return (
+        len(dict.fromkeys(spec["design_style_ids"]))
+        * len(dict.fromkeys(spec["room_type_ids"]))
+        * len(dict.fromkeys(spec["color_wheel_ids"]))
+        * len(dict.fromkeys(spec.get("flooring_type_ids") or [None]))
+        * len(dict.fromkeys(spec.get("floor_board_width_ids") or [None]))
+    )
+
+
+def expand_batch(spec: Dict) -> Tuple[List[Dict], int]:
+    """
+    Expand a batch specification into job params, one per
+    style x color wheel x flooring combination (each becomes one gallery
+    session), with the rooms that combination still needs.
+
+    Every room's prompt is compiled up front; a room whose prompt (at the
+    same quality and aspect ratio) was already produced by an earlier
+    combination is dropped, e.g. board widths for non-wood flooring.
+    Returns (job params, number of rooms dropped as duplicates).
+
+    The whole expansion reads one catalog snapshot.
+
+    Raises ValueError for unknown styles.
+    """
+    catalog = get_catalog()
+    unknown = [style_id for style_id in spec["design_style_ids"] if not get_style(style_id, catalog)]
+    if unknown:
+        raise ValueError(f"Unknown design styles: {', '.join(unknown)}")
+
+    seen = set()
+    duplicates = 0
+    jobs = []
+    combinations = itertools.product(
+        dict.fromkeys(spec["design_style_ids"]),
+        dict.fromkeys(spec["color_wheel_ids"]),
+        dict.fromkeys(spec.get("flooring_type_ids") or [None]),
+        dict.fromkeys(spec.get("floor_board_width_ids") or [None]),
+    )
+    for style_id, color_wheel_id, flooring_type_id, floor_board_width_id in combinations:
+        architect_id = spec.get("architect_id") or default_reference("architects", style_id, catalog) or ""
+        designer_id = spec.get("designer_id") or default_reference("designers", style_id, catalog) or ""
+
+        room_type_ids = []
+        for room_type_id in dict.fromkeys(spec["room_type_ids"]):
+            prompt, aspect_ratio = compile_prompt(
+                room_type_id=room_type_id,
+                design_style_id=style_id,
+                architect_id=architect_id,
+                designer_id=designer_id,
+                color_wheel_id=color_wheel_id,
+                aspect_ratio_id=spec["aspect_ratio_id"],
+                flooring_type_id=flooring_type_id,
+                floor_board_width_id=floor_board_width_id,
+                catalog=catalog,
+            )
+            key = hashlib.sha256(
+                f"{spec['image_quality_id']}\0{aspect_ratio}\0{prompt}".encode("utf-8")
+            ).digest()
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            room_type_ids.append(room_type_id)
+
+        if room_type_ids:
+            jobs.append({
+                "room_type_ids": room_type_ids,
+                "design_style_id": style_id,
+                "architect_id": architect_id,
+                "designer_id": designer_id,
+                "color_wheel_id": color_wheel_id,
+                "aspect_ratio_id": spec["aspect_ratio_id"],
+                "image_quality_id": spec["image_quality_id"],
+                "flooring_type_id": flooring_type_id,
+                "floor_board_width_id": floor_board_width_id,
+                "force_fresh": spec.get("force_fresh", False),
+            })
+    return jobs, duplicates
@@ -1,10 +1,47 @@
-import pandas as pd
+import asyncio
+import csv
+import hashlib
 import os
 import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from config import CATALOG_LOADER, CATALOG_RELOAD_INTERVAL_SECONDS
+from services.log import get_logger
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 ROOM_CREATOR_PATH = os.path.join(DATA_DIR, "room_creator.csv")
 COLOR_PALETTES_PATH = os.path.join(DATA_DIR, "color_palettes.csv")
+CATALOG_SOURCES = (ROOM_CREATOR_PATH, COLOR_PALETTES_PATH)
+
+log = get_logger("catalog")
+
+def _read_csv_stdlib(path: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        rows = [
+            {key: value or "" for key, value in row.items() if key is not None}
+            for row in reader
+            if any(value for value in row.values())
+        ]
+        return list(reader.fieldnames or []), rows
+
+def _read_csv_pandas(path: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    # Optional: only imported when CATALOG_LOADER=pandas, since the import
+    # alone dominates a worker's cold start.
+    import pandas as pd
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return [str(c) for c in df.columns], df.to_dict("records")
+
+def read_csv(path: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """Return (column names, rows as dicts of strings); empty cells are ''."""
+    if CATALOG_LOADER == "pandas":
+        try:
+            return _read_csv_pandas(path)
+        except ImportError:
+            log.warning("pandas not installed, using the csv module")
+    return _read_csv_stdlib(path)
 
 def to_kebab(s):
     if not isinstance(s, str):
@@ -19,9 +56,9 @@ NON_ROOM_COLUMNS = {
     "Architectural elements for rooms",
 }
 
-def build_room_column_map(room_df):
+def build_room_column_map(columns):
     room_columns = {}
-    for col in room_df.columns:
+    for col in columns:
         if col in NON_ROOM_COLUMNS:
             continue
         base = re.sub(r'\s*\(.*\)$', '', str(col)).strip()
@@ -33,21 +70,78 @@ def build_room_column_map(room_df):
         room_columns[room_id] = col
     return room_columns
 
-# Global cache to hold the processed data AND the raw lookups
-_DATA_CACHE = None
+COLOR_INTENSITY_COLUMNS = ("Light", "Medium", "Dark")
+
+def build_palette_index(color_rows):
+    """
+    Pre-compute the palette string for every (style_id, intensity_id) pair.
+    intensity_id is the lowercase column name: 'light', 'medium', 'dark'.
+    """
+    rows_by_style = {}
+    for r in color_rows:
+        rows_by_style.setdefault(to_kebab(r['Design Style']), []).append(r)
+
+    palettes = {}
+    for style_id, rows in rows_by_style.items():
+        for col_name in COLOR_INTENSITY_COLUMNS:
+            if col_name not in rows[0]:
+                continue
+            # Expected categories: Dominant, Grounding, Accent
+            palette_parts = []
+            for r in rows:
+                category = r.get("Category", "")
+                val = r.get(col_name, "")
+                if val and isinstance(val, str):
+                    palette_parts.append(f"{category}: {val}")
+            palettes[(style_id, col_name.lower())] = "; ".join(palette_parts)
+    return palettes
+
+def build_room_index(room_rows, room_column_map):
+    """
+    Index style rows by style_id (first match wins) and room specifics by
+    (style_id, room_id).
+    """
+    style_rows = {}
+    room_specifics = {}
+    for r in room_rows:
+        style_id = to_kebab(r['Design Style'])
+        if style_id in style_rows:
+            continue
+        style_rows[style_id] = r
+        for room_id, col_name in room_column_map.items():
+            if col_name in r:
+                room_specifics[(style_id, room_id)] = r[col_name]
+    return style_rows, room_specifics
+
+def build_style_index(people):
+    """style_id -> the architects (or designers) associated with it, in list order."""
+    index = {}
+    for person in people:
+        for style_id in person["styleIds"]:
+            index.setdefault(style_id, []).append(person)
+    return index
+
+class CatalogLoadError(RuntimeError):
+    pass
 
 def load_data():
+    """Read both CSVs and build the frontend data and raw lookups."""
     try:
         # Load Raw Data
-        room_df = pd.read_csv(ROOM_CREATOR_PATH)
-        color_df = pd.read_csv(COLOR_PALETTES_PATH)
+        room_columns, room_rows = read_csv(ROOM_CREATOR_PATH)
+        _, color_rows = read_csv(COLOR_PALETTES_PATH)
         
         styles = []
         architects_map = {} 
         designers_map = {} 
 
+        # First color row per style carries the Mood/Undertone/Note metadata
+        first_color_rows = {}
+        for r in color_rows:
+            first_color_rows.setdefault(r['Design Style'], r)
+
         # 1. Process Styles
-        for _, row in room_df.iterrows():
+        for row in room_rows:
             style_name = row['Design Style']
             style_id = to_kebab(style_name)
             
@@ -57,10 +151,8 @@ def load_data():
             undertone = ""
             note = ""
             
-            # Filter color_df for this style
-            style_colors = color_df[color_df['Design Style'] == style_name]
-            if not style_colors.empty:
-                first_row = style_colors.iloc[0]
+            first_row = first_color_rows.get(style_name)
+            if first_row is not None:
                 mood = first_row.get('Mood', '')
                 undertone = first_row.get('Undertone', '')
                 note = first_row.get('Designer Note', '')
@@ -84,9 +176,9 @@ def load_data():
                     architects_map[arch_id] = {
                         "id": arch_id,
                         "name": arch_name,
-                        "styleIds": set()
+                        "styleIds": {}
                     }
-                architects_map[arch_id]["styleIds"].add(style_id)
+                architects_map[arch_id]["styleIds"][style_id] = None
 
             # Process Designers
             des_str = str(row.get('Representative Interior Designers', ''))
@@ -99,11 +191,12 @@ def load_data():
                     designers_map[des_id] = {
                         "id": des_id,
                         "name": des_name,
-                        "styleIds": set()
+                        "styleIds": {}
                     }
-                designers_map[des_id]["styleIds"].add(style_id)
+                designers_map[des_id]["styleIds"][style_id] = None
 
-        # Convert sets to lists
+        # Convert the ordered sets (dicts) to lists; catalog order keeps the
+        # serialized bytes, and so the ETags, identical across workers
         architects = [
             {**a, "styleIds": list(a["styleIds"])} 
             for a in architects_map.values()
@@ -153,7 +246,8 @@ def load_data():
             { "id": "9in", "name": "9in" },
         ]
 
-        room_column_map = build_room_column_map(room_df)
+        room_column_map = build_room_column_map(room_columns)
+        style_rows, room_specifics = build_room_index(room_rows, room_column_map)
 
         # Store in cache structure
         return {
@@ -169,99 +263,257 @@ def load_data():
                 "floorBoardWidths": floor_board_widths
             },
             "raw_data": {
-                "room_df": room_df,
-                "color_df": color_df,
-                "room_column_map": room_column_map
+                "people_by_style": {
+                    "architects": build_style_index(architects),
+                    "designers": build_style_index(designers),
+                },
+                "room_rows": room_rows,
+                "color_rows": color_rows,
+                "room_column_map": room_column_map,
+                # O(1) lookups used while building prompts
+                "styles_by_id": {s["id"]: s for s in reversed(styles)},
+                "style_rows": style_rows,
+                "room_specifics": room_specifics,
+                "palettes": build_palette_index(color_rows)
             }
         }
 
     except Exception as e:
-        print(f"Error loading data: {e}")
-        return None
-
-def get_data():
-    global _DATA_CACHE
-    if _DATA_CACHE is None:
-        _DATA_CACHE = load_data()
-    return _DATA_CACHE["frontend_data"] if _DATA_CACHE else {
-        "styles": [], "architects": [], "designers": [],
-        "roomTypes": [], "colorWheelOptions": [], "aspectRatios": [], "imageQualityOptions": [],
-        "flooringTypes": [], "floorBoardWidths": []
-    }
+        raise CatalogLoadError(f"{type(e).__name__}: {e}") from e
 
-def get_room_details(style_id: str, room_type_id: str):
-    global _DATA_CACHE
-    if _DATA_CACHE is None: _DATA_CACHE = load_data()
-    if not _DATA_CACHE: return {}
-
-    room_df = _DATA_CACHE["raw_data"]["room_df"]
-    room_column_map = _DATA_CACHE["raw_data"].get("room_column_map")
-    if not room_column_map:
-        room_column_map = build_room_column_map(room_df)
-        _DATA_CACHE["raw_data"]["room_column_map"] = room_column_map
-    
-    # helper to match style
-    # Assuming style_id is kebab case of 'Design Style' column
-    # We iterate to find match
-    row = None
-    for _, r in room_df.iterrows():
-        if to_kebab(r['Design Style']) == style_id:
-            row = r
-            break
-            
+class Catalog(NamedTuple):
+    """
+    One immutable, fully indexed version of the catalog.
+
+    Snapshots are never modified once published; a reload builds a new one
+    and swaps the module reference, so a request that captured a snapshot
+    keeps seeing it until it finishes.
+    """
+    version: str
+    signature: Tuple[Tuple[int, int], ...]
+    loaded_at: float
+    frontend_data: Dict
+    raw_data: Dict
+
+EMPTY_FRONTEND_DATA = {
+    "styles": [], "architects": [], "designers": [],
+    "roomTypes": [], "colorWheelOptions": [], "aspectRatios": [], "imageQualityOptions": [],
+    "flooringTypes": [], "floorBoardWidths": []
+}
+
+# The live snapshot. Replaced as a whole (a single reference assignment), never mutated.
+_catalog: Optional[Catalog] = None
+# Signature of sources that failed to load, so a broken file is reported once
+_rejected_signature = None
+_reload_lock = threading.Lock()
+
+def _source_signature() -> Tuple[Tuple[int, int], ...]:
+    signature = []
+    for path in CATALOG_SOURCES:
+        stat = os.stat(path)
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def build_catalog() -> Catalog:
+    """
+    Load the CSVs into a new snapshot without publishing it.
+
+    The version is a hash of the files' contents, so every worker serving the
+    same files reports the same version. Raises CatalogLoadError if the files
+    can't be read or parsed, change while being read, or contain no styles.
+    """
+    try:
+        signature = _source_signature()
+        digest = hashlib.sha256()
+        for path in CATALOG_SOURCES:
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        data = load_data()
+        if _source_signature() != signature:
+            raise CatalogLoadError("catalog files changed while being read")
+    except OSError as e:
+        raise CatalogLoadError(str(e)) from e
+
+    if not data["frontend_data"]["styles"]:
+        raise CatalogLoadError("no design styles")
+    return Catalog(
+        version=digest.hexdigest()[:12],
+        signature=signature,
+        loaded_at=time.time(),
+        frontend_data=data["frontend_data"],
+        raw_data=data["raw_data"],
+    )
+
+def _publish(catalog: Catalog):
+    global _catalog
+    _catalog = catalog
+    for problem in validate_catalog(catalog):
+        log.warning("Catalog incomplete", problem=problem, version=catalog.version)
+
+def get_catalog() -> Optional[Catalog]:
+    """The current snapshot, loading it on first use; None if it can't be loaded."""
+    catalog = _catalog
+    if catalog is not None:
+        return catalog
+    with _reload_lock:
+        if _catalog is None:
+            try:
+                _publish(build_catalog())
+            except CatalogLoadError as e:
+                log.error("Error loading data", error=str(e))
+        return _catalog
+
+def reload_catalog(force: bool = False) -> Tuple[Optional[Catalog], bool]:
+    """
+    Rebuild the catalog if its files changed (or always, with force) and swap
+    the new snapshot in. Returns (live snapshot, whether the version changed).
+
+    A snapshot that fails to build is never published: CatalogLoadError is
+    raised and the previous version keeps serving.
+    """
+    global _catalog, _rejected_signature
+    with _reload_lock:
+        current = _catalog
+        if not force:
+            try:
+                signature = _source_signature()
+            except OSError as e:
+                # Editors that save via rename can briefly remove a file
+                log.debug("Catalog source unavailable", error=str(e))
+                return current, False
+            if signature == _rejected_signature or (current and signature == current.signature):
+                return current, False
+
+        try:
+            catalog = build_catalog()
+        except CatalogLoadError:
+            _rejected_signature = None if force else signature
+            raise
+        _rejected_signature = None
+
+        if current and catalog.version == current.version:
+            # Touched but unchanged: keep the existing snapshot, note the new mtimes
+            _catalog = current._replace(signature=catalog.signature)
+            return _catalog, False
+        _publish(catalog)
+        log.info("Catalog reloaded", version=catalog.version,
+                 previous=current.version if current else None,
+                 styles=len(catalog.frontend_data["styles"]))
+        return catalog, True
+
+def get_data(catalog: Optional[Catalog] = None):
+    catalog = catalog or get_catalog()
+    return catalog.frontend_data if catalog else EMPTY_FRONTEND_DATA
+
+def _get_raw_data(catalog: Optional[Catalog] = None):
+    catalog = catalog or get_catalog()
+    return catalog.raw_data if catalog else None
+
+def validate_catalog(catalog: Catalog) -> List[str]:
+    """Gaps in a loaded catalog, e.g. room types with no details for some styles."""
+    frontend, raw = catalog.frontend_data, catalog.raw_data
+    style_ids = [style["id"] for style in frontend["styles"]]
+    problems = []
+    for option in frontend["colorWheelOptions"]:
+        missing = [s for s in style_ids if not raw["palettes"].get((s, option["id"]))]
+        if missing:
+            problems.append(f"no {option['id']} palette for {len(missing)} of {len(style_ids)} styles")
+    for room in frontend["roomTypes"]:
+        missing = [s for s in style_ids if (s, room["id"]) not in raw["room_specifics"]]
+        if missing:
+            problems.append(f"no {room['id']} details for {len(missing)} of {len(style_ids)} styles")
+    return problems
+
+def warm_up():
+    """
+    Load and validate the catalog eagerly (from the app lifespan) so the
+    first request doesn't pay for it. Raises CatalogLoadError if it can't load.
+    """
+    with _reload_lock:
+        if _catalog is None:
+            try:
+                _publish(build_catalog())
+            except CatalogLoadError as e:
+                raise CatalogLoadError(f"Catalog could not be loaded from {DATA_DIR}: {e}") from e
+    log.info("Catalog loaded", version=_catalog.version, styles=len(_catalog.frontend_data["styles"]))
+
+class CatalogReloader:
+    """
+    Watches the catalog CSVs by polling their mtimes and swaps in a rebuilt
+    snapshot when they change. Builds run on the threadpool; a file that fails
+    to load is logged once and the previous version keeps serving.
+    """
+
+    def __init__(self, interval: float = CATALOG_RELOAD_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._triggered: List[asyncio.Task] = []
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        tasks = ([self._task] if self._task else []) + self._triggered
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._triggered = []
+
+    async def reload(self, force: bool = False) -> Tuple[Optional[Catalog], bool]:
+        return await run_in_threadpool(reload_catalog, force)
+
+    def trigger(self):
+        """Force a reload from a signal handler (SIGHUP)."""
+        self._triggered = [t for t in self._triggered if not t.done()]
+        self._triggered.append(asyncio.create_task(self._reload_logged(force=True)))
+
+    async def _reload_logged(self, force: bool = False):
+        try:
+            await self.reload(force)
+        except CatalogLoadError as e:
+            current = _catalog
+            log.error("Catalog reload rejected", error=str(e),
+                      serving=current.version if current else None)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._reload_logged()
+
+catalog_reloader = CatalogReloader()
+
+def get_style(style_id: str, catalog: Optional[Catalog] = None):
+    raw = _get_raw_data(catalog)
+    if not raw: return None
+    return raw["styles_by_id"].get(style_id)
+
+def get_people_for_style(kind: str, style_id: str, catalog: Optional[Catalog] = None):
+    """Architects or designers (`kind`) associated with a style, in list order."""
+    raw = _get_raw_data(catalog)
+    if not raw: return []
+    return raw["people_by_style"][kind].get(style_id, [])
+
+def get_room_details(style_id: str, room_type_id: str, catalog: Optional[Catalog] = None):
+    raw = _get_raw_data(catalog)
+    if not raw: return {}
+
+    row = raw["style_rows"].get(style_id)
     if row is None:
         return {}
-        
-    details = {
+
+    return {
         "architectural_elements": row.get("Architectural elements for rooms", ""),
-        "room_specifics": ""
+        "room_specifics": raw["room_specifics"].get((style_id, room_type_id), "")
     }
-    
-    col_name = room_column_map.get(room_type_id)
-    if col_name and col_name in row:
-        details["room_specifics"] = row[col_name]
-        
-    return details
 
-def get_color_details(style_id: str, intensity_id: str):
+def get_color_details(style_id: str, intensity_id: str, catalog: Optional[Catalog] = None):
     """
     intensity_id: 'light', 'medium', 'dark'
-    Returns a string dict or formatted string of colors
+    Returns a formatted string of colors
     """
-    global _DATA_CACHE
-    if _DATA_CACHE is None: _DATA_CACHE = load_data()
-    if not _DATA_CACHE: return ""
-
-    color_df = _DATA_CACHE["raw_data"]["color_df"]
-    
-    # Filter by style
-    # We need to find rows where to_kebab(Design Style) == style_id
-    # We can't just use vector operations easily with custom function, loop is fine for small data
-    matching_rows = []
-    for _, r in color_df.iterrows():
-        if to_kebab(r['Design Style']) == style_id:
-            matching_rows.append(r)
-            
-    if not matching_rows:
-        return ""
-        
-    # Map intensity_id to CSV Column
-    # id='light' -> Col='Light'
-    col_name = intensity_id.title() # Light, Medium, Dark
-    
-    if col_name not in matching_rows[0]:
-        return ""
-        
-    # Construct palette string
-    # Expected categories: Dominant, Grounding, Accent
-    palette_parts = []
-    
-    for r in matching_rows:
-        category = r.get("Category", "")
-        # clear " (60%)" etc from category if desired, or keep it
-        # The prompt might benefit from "Dominant (60%): color"
-        val = r.get(col_name, "")
-        if val and isinstance(val, str):
-            palette_parts.append(f"{category}: {val}")
-            
-    return "; ".join(palette_parts)
+    raw = _get_raw_data(catalog)
+    if not raw: return ""
+
+    return raw["palettes"].get((style_id, intensity_id.lower()), "")
@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, NamedTuple, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; without it clients get gzip
+    brotli = None
+
+# Below this, compression costs more in headers and CPU than it saves
+MIN_COMPRESS_BYTES = 256
+
+
+class EncodedPayload(NamedTuple):
+    """A JSON body serialized once, with its compressed variants and ETag."""
+    etag: str
+    bodies: Dict[str, bytes]  # content-coding ("identity", "gzip", "br") -> bytes
+
+
+def encode_json(content) -> EncodedPayload:
+    # Same serialization as FastAPI's JSONResponse
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+    bodies = {"identity": body}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        # mtime=0 keeps the gzip bytes identical across workers and restarts
+        bodies["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, quality=11)
+    # Weak: the compressed variants are the same representation
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:20]}"'
+    return EncodedPayload(etag, bodies)
+
+
+def _accepted_codings(accept_encoding: str) -> Dict[str, float]:
+    codings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            codings[name.lower()] = q
+    return codings
+
+
+def negotiate(accept_encoding: Optional[str], payload: EncodedPayload) -> str:
+    """Best content-coding the client accepts: br, then gzip, else identity."""
+    if not accept_encoding:
+        return "identity"
+    accepted = _accepted_codings(accept_encoding)
+    for coding in ("br", "gzip"):
+        if coding in payload.bodies and accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return "identity"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def encoded_response(request: Request, payload: EncodedPayload,
+                     headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serve a pre-encoded payload: 304 if the client's copy is current,
+    otherwise the best compressed variant it accepts.
+    """
+    response_headers = {
+        "ETag": payload.etag,
+        "Vary": "Accept-Encoding",
+        # Cache, but revalidate: the content changes when the catalog reloads
+        "Cache-Control": "no-cache",
+        **(headers or {}),
+    }
+    if _etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=304, headers=response_headers)
+
+    coding = negotiate(request.headers.get("accept-encoding"), payload)
+    if coding != "identity":
+        response_headers["Content-Encoding"] = coding
+    return Response(payload.bodies[coding], media_type="application/json", headers=response_headers)
+
+
+class VersionedPayloadCache:
+    """
+    Encoded payloads keyed by data version. Entries are built on first use.
+    The most recently used `max_versions` versions are kept, so requests
+    still holding the previous snapshot during a reload don't evict the
+    current one and force every request to re-encode.
+    """
+
+    def __init__(self, max_versions: int = 2):
+        self.max_versions = max(1, max_versions)
+        self._lock = threading.Lock()
+        self._versions: "OrderedDict[str, Dict[Hashable, EncodedPayload]]" = OrderedDict()
+
+    def get(self, version: str, key: Hashable, build: Callable[[], object]) -> EncodedPayload:
+        with self._lock:
+            payloads = self._versions.get(version)
+            if payloads is not None:
+                self._versions.move_to_end(version)
+                if key in payloads:
+                    return payloads[key]
+        # Encode outside the lock; a concurrent duplicate build is harmless
+        payload = encode_json(build())
+        with self._lock:
+            payloads = self._versions.setdefault(version, {})
+            self._versions.move_to_end(version)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+            return payloads.setdefault(key, payload)
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+if os.name == "nt":
+    import msvcrt
+
+    def _acquire(fd: int):
+        # LK_LOCK gives up after ~10 s of retries; keep waiting like flock does
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+
+    def _try_acquire(fd: int) -> bool:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _release(fd: int):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _acquire(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _try_acquire(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _release(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    Exclusive lock shared by every process (and thread) using the same path.
+
+    The lock lives on a separate sidecar file, never on the data file itself,
+    so the data file can be replaced by rename while the lock is held.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def hold(self):
+        with self._thread_lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                _acquire(fd)
+                try:
+                    yield
+                finally:
+                    _release(fd)
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def try_hold(self):
+        """Like hold(), but yields False at once if someone else has the lock."""
+        if not self._thread_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                acquired = _try_acquire(fd)
+                try:
+                    yield acquired
+                finally:
+                    if acquired:
+                        _release(fd)
+            finally:
+                os.close(fd)
+        finally:
+            self._thread_lock.release()
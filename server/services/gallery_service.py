@@ -1,54 +1,80 @@
-import json
-import os
-from typing import List, Dict, Optional
-from datetime import datetime
+import hashlib
+import threading
+import time
+from typing import Hashable, List, Dict, Optional, Tuple
+from config import GALLERY_REFRESH_INTERVAL_SECONDS
+from services.gallery_store import GalleryStore, WriteTokens, create_gallery_store
+from services.image_storage import image_storage
+from services.metrics import GALLERY_SAVE_SECONDS
+from services.log import get_logger
+from services.session_index import SessionIndex, SessionKey
+
+log = get_logger("gallery")
 
-GALLERY_DATA_FILE = "gallery_data.json"
 VALID_COLOR_WHEELS = {"light", "medium", "dark"}
 VALID_IMAGE_QUALITIES = {"1k", "2k", "4k"}
 
 class GalleryService:
-    def __init__(self, data_file: str = GALLERY_DATA_FILE):
-        self.data_file = data_file
+    """
+    In-memory gallery (sessions plus their query index) over a GalleryStore.
+
+    Other worker processes may write to the same store, so the cache is
+    tied to the store's change token and reloaded only when the token moves.
+    The token is checked at most every GALLERY_REFRESH_INTERVAL_SECONDS;
+    this process's own writes are visible immediately.
+    """
+
+    def __init__(self, store: Optional[GalleryStore] = None,
+                 refresh_interval: float = GALLERY_REFRESH_INTERVAL_SECONDS):
+        self.store = store or create_gallery_store()
+        self.refresh_interval = refresh_interval
         self._cache: Dict | None = None  # In-memory cache
         self._cache_loaded = False
-        self._ensure_data_file()
-
-    def _ensure_data_file(self):
-        if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w') as f:
-                json.dump({"sessions": []}, f)
+        self._index = SessionIndex()
+        # Store change token the cache reflects, and when it was last compared
+        self._token: Hashable = None
+        self._checked_at = 0.0
+        # Sessions are added from worker threads while requests read the index.
+        self._lock = threading.RLock()
 
     def _load_data(self) -> Dict:
-        # Return cached data if available
+        # Return cached data if it still matches the store
         if self._cache_loaded and self._cache is not None:
-            return self._cache
-
-        # Load from file
-        try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            data = self._sanitize_data(data)
-        except (json.JSONDecodeError, FileNotFoundError):
-            data = {"sessions": []}
+            now = time.monotonic()
+            if now - self._checked_at < self.refresh_interval:
+                return self._cache
+            self._checked_at = now
+            if self.store.change_token() == self._token:
+                return self._cache
+            log.debug("Gallery changed by another process, reloading")
+
+        # Load from the storage backend. The token is read first: a write that
+        # lands during the load just triggers another reload later.
+        self._token = self.store.change_token()
+        self._checked_at = time.monotonic()
+        data = self._sanitize_data({"sessions": self.store.load_sessions()})
+        self._add_derivative_urls(data["sessions"])
 
         # Cache the data
         self._cache = data
+        self._index = SessionIndex(data["sessions"])
         self._cache_loaded = True
         return self._cache
 
-    def _save_data(self, data: Dict):
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f, indent=2)
-        # Update cache after writing
-        self._cache = data
-        self._cache_loaded = True
-
     def _invalidate_cache(self):
         """Clear the cache, forcing next load to read from disk."""
         self._cache = None
+        self._index = SessionIndex()
         self._cache_loaded = False
 
+    def _after_write(self, tokens: WriteTokens):
+        """Keep the cache if this write was the only change since it was loaded."""
+        before, after = tokens
+        if before == self._token:
+            self._token = after
+        else:
+            self._invalidate_cache()
+
     def _sanitize_data(self, data: Dict) -> Dict:
         if not isinstance(data, dict):
             return {"sessions": []}
@@ -60,11 +86,26 @@ class GalleryService:
         valid_sessions = [s for s in sessions if self._is_valid_session(s)]
 
         if len(valid_sessions) != len(sessions):
+            valid_ids = {s["id"] for s in valid_sessions if s.get("id")}
+            invalid_ids = [
+                s["id"] for s in sessions
+                if isinstance(s, dict) and s.get("id") and s["id"] not in valid_ids
+            ]
             data["sessions"] = valid_sessions
-            self._save_data(data)
+            # Entries without an id can't be removed by id; dropping them from
+            # memory is enough, and a no-op write would make every worker reload
+            if invalid_ids:
+                self._after_write(self.store.remove_sessions(invalid_ids))
 
         return data
 
+    def _add_derivative_urls(self, sessions: List[Dict]):
+        """Sessions saved before derivatives existed get their srcset URLs in memory."""
+        for session in sessions:
+            for image in session.get("images", []):
+                if "derivatives" not in image:
+                    image["derivatives"] = image_storage.derivative_urls(image.get("url"))
+
     def _is_valid_session(self, session: Dict) -> bool:
         if not isinstance(session, dict):
             return False
@@ -98,24 +139,87 @@ class GalleryService:
         return True
 
     def get_sessions(self) -> List[Dict]:
-        data = self._load_data()
-        # Return sessions sorted by createdAt desc
-        sessions = data.get("sessions", [])
-        sessions.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
+        # Sessions sorted by createdAt desc, read from the maintained index
+        sessions, _ = self.query_sessions()
         return sessions
 
     def get_session_by_id(self, session_id: str) -> Optional[Dict]:
-        sessions = self.get_sessions()
-        for session in sessions:
-            if session["id"] == session_id:
-                return session
-        return None
+        with self._lock:
+            self._load_data()
+            return self._index.by_id.get(session_id)
+
+    @property
+    def revision(self) -> str:
+        """
+        Opaque token that changes whenever the gallery contents change. It
+        derives from the store's change token, so workers agree on it.
+        """
+        with self._lock:
+            self._load_data()
+            return hashlib.sha256(repr(self._token).encode()).hexdigest()[:16]
+
+    def query_sessions(
+        self,
+        room_types: Optional[List[str]] = None,
+        styles: Optional[List[str]] = None,
+        since: Optional[str] = None,
+        limit: Optional[int] = None,
+        before: Optional[SessionKey] = None,
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Filter and page sessions newest-first using the session index.
+        Returns (sessions, has_more).
+        """
+        with self._lock:
+            self._load_data()
+            return self._index.query(
+                styles=styles, room_types=room_types, since=since, limit=limit, before=before
+            )
+
+    def warm_up(self):
+        """Load the gallery and build its index before serving requests."""
+        with self._lock:
+            self._load_data()
 
     def add_session(self, session: Dict):
-        data = self._load_data()
-        if "sessions" not in data:
-            data["sessions"] = []
-        data["sessions"].append(session)
-        self._save_data(data)
+        with self._lock:
+            data = self._load_data()
+            with GALLERY_SAVE_SECONDS.time(backend=type(self.store).__name__):
+                tokens = self.store.add_session(session)
+            data["sessions"].append(session)
+            self._index.add(session)
+            # If another process wrote in the meantime, reload on next access
+            self._after_write(tokens)
+
+    def set_starred(self, session_id: str, starred: bool) -> Optional[Dict]:
+        """Star or unstar a session; starred sessions are never evicted. None if unknown."""
+        with self._lock:
+            data = self._load_data()
+            session = self._index.by_id.get(session_id)
+            if session is None:
+                return None
+            if bool(session.get("starred")) == starred:
+                return session
+            updated = {**session, "starred": starred}
+            tokens = self.store.update_session(updated)
+            data["sessions"] = [updated if s is session else s for s in data["sessions"]]
+            self._index.add(updated)
+            self._after_write(tokens)
+            return updated
+
+    def remove_sessions(self, session_ids: List[str]) -> List[Dict]:
+        """Remove sessions from the gallery (not their images); returns those that existed."""
+        with self._lock:
+            data = self._load_data()
+            removed = [self._index.by_id[i] for i in dict.fromkeys(session_ids) if i in self._index.by_id]
+            if not removed:
+                return []
+            ids = {session["id"] for session in removed}
+            tokens = self.store.remove_sessions(ids)
+            data["sessions"] = [s for s in data["sessions"] if s.get("id") not in ids]
+            for session_id in ids:
+                self._index.remove(session_id)
+            self._after_write(tokens)
+            return removed
 
 gallery_service = GalleryService()
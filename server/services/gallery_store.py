@@ -0,0 +1,305 @@
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from config import GALLERY_BACKEND
+from services.file_lock import FileLock
+from services.log import get_logger
+
+SERVER_ROOT = Path(__file__).parent.parent
+GALLERY_DATA_FILE = "gallery_data.json"
+DEFAULT_GALLERY_DB_PATH = SERVER_ROOT / "gallery.db"
+
+log = get_logger("gallery")
+
+
+def _resolve_db_path() -> Path:
+    env_value = os.getenv("GALLERY_DB_PATH")
+    if not env_value:
+        return DEFAULT_GALLERY_DB_PATH
+
+    env_path = Path(env_value)
+    if not env_path.is_absolute():
+        env_path = SERVER_ROOT / env_path
+    return env_path
+
+
+# (token before the write, token after it); see GalleryStore.change_token
+WriteTokens = Tuple[Hashable, Hashable]
+
+
+class GalleryStore:
+    """
+    Persistence backend for gallery sessions.
+
+    Several server processes may share one store, so writes must be safe
+    across processes, and change_token() lets each process notice writes
+    made by the others.
+    """
+
+    def change_token(self) -> Hashable:
+        """Cheap value that changes whenever any process writes to the store."""
+        raise NotImplementedError
+
+    def load_sessions(self) -> List[Dict]:
+        """Return every stored session."""
+        raise NotImplementedError
+
+    def add_session(self, session: Dict) -> WriteTokens:
+        """
+        Persist one new session. Returns the change tokens from just before
+        and just after the write, so a caller whose cache matched the first
+        knows the write was the only change.
+        """
+        raise NotImplementedError
+
+    def update_session(self, session: Dict) -> WriteTokens:
+        """Replace a stored session (matched by id); returns change tokens like add_session."""
+        raise NotImplementedError
+
+    def remove_sessions(self, session_ids: Iterable[str]) -> WriteTokens:
+        """Delete sessions by id; returns change tokens like add_session."""
+        raise NotImplementedError
+
+
+class JsonGalleryStore(GalleryStore):
+    """
+    Keeps the whole gallery in a single JSON file.
+
+    Every write rewrites the file, so this suits small installs only. Writes
+    are read-modify-write under a cross-process lock (a .lock file next to
+    the data file) and land via temp file and rename, so concurrent workers
+    don't lose each other's sessions and readers never see a partial file.
+    """
+
+    def __init__(self, data_file: str = GALLERY_DATA_FILE):
+        self.data_file = data_file
+        self._lock = FileLock(f"{data_file}.lock")
+        self._ensure_data_file()
+
+    def _ensure_data_file(self):
+        if os.path.exists(self.data_file):
+            return
+        with self._lock.hold():
+            if not os.path.exists(self.data_file):
+                self._write({"sessions": []})
+
+    def _read(self) -> Dict:
+        try:
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return {"sessions": []}
+        if not isinstance(data, dict) or not isinstance(data.get("sessions"), list):
+            return {"sessions": []}
+        return data
+
+    def _write(self, data: Dict):
+        directory = os.path.dirname(os.path.abspath(self.data_file))
+        tmp_path = os.path.join(directory, f".{os.path.basename(self.data_file)}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.data_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def change_token(self) -> Hashable:
+        # Every write renames a new file into place, so the inode changes too
+        try:
+            stat = os.stat(self.data_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def load_sessions(self) -> List[Dict]:
+        return self._read()["sessions"]
+
+    def add_session(self, session: Dict) -> WriteTokens:
+        with self._lock.hold():
+            before = self.change_token()
+            data = self._read()
+            data["sessions"].append(session)
+            self._write(data)
+            return before, self.change_token()
+
+    def update_session(self, session: Dict) -> WriteTokens:
+        with self._lock.hold():
+            before = self.change_token()
+            data = self._read()
+            data["sessions"] = [
+                session if isinstance(s, dict) and s.get("id") == session["id"] else s
+                for s in data["sessions"]
+            ]
+            self._write(data)
+            return before, self.change_token()
+
+    def remove_sessions(self, session_ids: Iterable[str]) -> WriteTokens:
+        ids = set(session_ids)
+        with self._lock.hold():
+            before = self.change_token()
+            data = self._read()
+            data["sessions"] = [
+                s for s in data["sessions"] if isinstance(s, dict) and s.get("id") not in ids
+            ]
+            self._write(data)
+            return before, self.change_token()
+
+
+class SqliteGalleryStore(GalleryStore):
+    """
+    Stores sessions in an embedded SQLite database.
+
+    Each session is one row (plus one row per image) inserted in a single
+    transaction, so a write costs the same regardless of gallery size and a
+    crash can't corrupt existing sessions. SQLite serializes writers across
+    processes; every write transaction also bumps a revision counter that
+    serves as the change token.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, import_from: Optional[str] = GALLERY_DATA_FILE):
+        self.db_path = db_path or _resolve_db_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+        if import_from and self._is_empty() and os.path.exists(import_from):
+            count = self.import_json(import_from)
+            log.info("Imported gallery sessions", count=count, source=import_from)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _init_schema(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    design_style_id TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at);
+                CREATE INDEX IF NOT EXISTS idx_sessions_style ON sessions (design_style_id, created_at);
+
+                CREATE TABLE IF NOT EXISTS images (
+                    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+                    id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    room_type_id TEXT,
+                    url TEXT NOT NULL,
+                    PRIMARY KEY (session_id, id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_images_room_type ON images (room_type_id, session_id);
+
+                CREATE TABLE IF NOT EXISTS gallery_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO gallery_meta (key, value) VALUES ('revision', 0);
+                """
+            )
+
+    def _bump_revision(self, conn: sqlite3.Connection) -> WriteTokens:
+        before = conn.execute("SELECT value FROM gallery_meta WHERE key = 'revision'").fetchone()[0]
+        conn.execute("UPDATE gallery_meta SET value = ? WHERE key = 'revision'", (before + 1,))
+        return before, before + 1
+
+    def change_token(self) -> Hashable:
+        with self._connect() as conn:
+            return conn.execute("SELECT value FROM gallery_meta WHERE key = 'revision'").fetchone()[0]
+
+    def _is_empty(self) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+
+    def _insert(self, conn: sqlite3.Connection, session: Dict):
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, created_at, design_style_id, data) VALUES (?, ?, ?, ?)",
+            (
+                session["id"],
+                session.get("createdAt", ""),
+                (session.get("designStyle") or {}).get("id"),
+                json.dumps(session),
+            ),
+        )
+        conn.execute("DELETE FROM images WHERE session_id = ?", (session["id"],))
+        conn.executemany(
+            "INSERT OR REPLACE INTO images (session_id, id, position, room_type_id, url) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    session["id"],
+                    image.get("id") or str(position),
+                    position,
+                    (image.get("roomType") or {}).get("id"),
+                    image.get("url", ""),
+                )
+                for position, image in enumerate(session.get("images", []))
+            ],
+        )
+
+    def load_sessions(self) -> List[Dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT data FROM sessions ORDER BY created_at DESC").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add_session(self, session: Dict) -> WriteTokens:
+        with self._transaction() as conn:
+            self._insert(conn, session)
+            return self._bump_revision(conn)
+
+    def update_session(self, session: Dict) -> WriteTokens:
+        with self._transaction() as conn:
+            self._insert(conn, session)
+            return self._bump_revision(conn)
+
+    def remove_sessions(self, session_ids: Iterable[str]) -> WriteTokens:
+        ids = [(session_id,) for session_id in session_ids]
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM images WHERE session_id = ?", ids)
+            conn.executemany("DELETE FROM sessions WHERE id = ?", ids)
+            return self._bump_revision(conn)
+
+    def import_json(self, json_path: str) -> int:
+        """Copy every session with an id from a gallery_data.json file in one transaction."""
+        with open(json_path, 'r', encoding="utf-8") as f:
+            data = json.load(f)
+        sessions = data.get("sessions", []) if isinstance(data, dict) else []
+        sessions = [s for s in sessions if isinstance(s, dict) and s.get("id")]
+
+        with self._transaction() as conn:
+            for session in sessions:
+                self._insert(conn, session)
+            self._bump_revision(conn)
+        return len(sessions)
+
+
+def create_gallery_store(backend: str = GALLERY_BACKEND) -> GalleryStore:
+    if backend == "sqlite":
+        return SqliteGalleryStore()
+    if backend != "json":
+        log.warning("Unknown gallery backend, using json", backend=backend)
+    return JsonGalleryStore()
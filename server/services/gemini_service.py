@@ -1,16 +1,32 @@
-from google import genai
-from google.genai import types
-from config import GOOGLE_API_KEY
+from concurrent.futures import Executor
+from google.genai import errors
+from config import (
+    GEMINI_CALL_TIMEOUT_SECONDS,
+    GEMINI_MAX_RETRIES,
+    GEMINI_QUALITY_FALLBACK,
+    GEMINI_RETRY_BASE_DELAY_SECONDS,
+    GEMINI_RETRY_MAX_DELAY_SECONDS,
+    GEMINI_TOTAL_DEADLINE_SECONDS,
+)
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import httpx
 import os
-from services.data_loader import get_data, get_room_details, get_color_details
+import random
+from services.data_loader import Catalog, get_catalog, get_style, get_room_details, get_color_details
+from services.generation_cache import generation_cache
+from services.image_backend import create_image_backend
+from services.log import get_logger
+from services.metrics import GENERATION_CACHE_LOOKUPS, MODEL_CALL_SECONDS, PROMPT_BUILD_SECONDS
+from services.rate_limiter import GenerationLimiter, SlotTimeout
+from services.system_prompt import system_prompt
 import time
 
-# Configure Gemini Client (v1beta/v0.8+ SDK)
-if GOOGLE_API_KEY:
-    client = genai.Client(api_key=GOOGLE_API_KEY)
-else:
-    print("Gemini API Key missing")
-    client = None
+log = get_logger("generation")
+
+# Live Gemini API, or the offline fake (GENERATION_BACKEND)
+backend = create_image_backend()
 
 # Quality Mapping
 QUALITY_CONFIG = {
@@ -19,20 +35,32 @@ QUALITY_CONFIG = {
     "4k": {"model": "gemini-3-pro-image-preview", "image_size": "4K"},
 }
 
-def generate_room_image(
+# Per-model quota limiting; lanes are the qualities above, cheapest first
+generation_limiter = GenerationLimiter(lanes=list(QUALITY_CONFIG))
+
+# Upstream statuses worth retrying: timeouts, rate limits and server errors
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def compile_prompt(
     room_type_id: str,
     design_style_id: str,
     architect_id: str,
     designer_id: str,
     color_wheel_id: str,
     aspect_ratio_id: str,
-    model_id: str = "1k",
     flooring_type_id: str = None,
-    floor_board_width_id: str = None
-):
+    floor_board_width_id: str = None,
+    catalog: Optional[Catalog] = None,
+) -> Tuple[str, str]:
+    """
+    Build the user prompt for one room; returns (prompt, API aspect ratio).
+
+    All lookups use one catalog snapshot (the live one unless given), so a
+    reload in the middle can't mix two versions into one prompt.
+    """
     # Data Lookup
-    all_data = get_data()
-    style_obj = next((s for s in all_data['styles'] if s['id'] == design_style_id), None)
+    catalog = catalog or get_catalog()
+    style_obj = get_style(design_style_id, catalog)
     
     def clean_name(s): return s.replace('-', ' ').title()
 
@@ -40,11 +68,11 @@ def generate_room_image(
     mood = style_obj['mood'] if style_obj else ""
     note = style_obj['designerNote'] if style_obj else ""
     
-    room_details = get_room_details(design_style_id, room_type_id)
+    room_details = get_room_details(design_style_id, room_type_id, catalog)
     arch_elements = room_details.get('architectural_elements', '')
     room_specifics = room_details.get('room_specifics', '')
     
-    color_details = get_color_details(design_style_id, color_wheel_id)
+    color_details = get_color_details(design_style_id, color_wheel_id, catalog)
     
     room_name = clean_name(room_type_id)
     architect_name = clean_name(architect_id)
@@ -63,7 +91,7 @@ def generate_room_image(
     if aspect_ratio_id in allowed_aspect_ratios:
         aspect_ratio = aspect_ratio_id
     else:
-        print(f"Unknown aspect ratio '{aspect_ratio_id}', defaulting to 1:1")
+        log.warning("Unknown aspect ratio, defaulting to 1:1", aspect_ratio=aspect_ratio_id)
         aspect_ratio = "1:1"
 
     # Flooring Specification (conditional)
@@ -111,71 +139,277 @@ Designer: {designer_name}
 Format: {ratio_instruction}
 High quality, detailed, architectural photography, 8k resolution."""
 
-    print("Gemini user prompt:\n" + prompt)
+    return prompt, aspect_ratio
+
+
+class RoomPrompt(NamedTuple):
+    """What a model call for one room needs, fixed before the first attempt."""
+    room_type_id: str
+    prompt: str
+    aspect_ratio: str
+    quality_id: str
+    system_instruction: Optional[str]
+    prompt_version: Optional[str]
+    catalog_version: Optional[str]
+
+
+def prepare_room_image(
+    room_type_id: str,
+    design_style_id: str,
+    architect_id: str,
+    designer_id: str,
+    color_wheel_id: str,
+    aspect_ratio_id: str,
+    model_id: str = "1k",
+    flooring_type_id: str = None,
+    floor_board_width_id: str = None,
+    force_fresh: bool = False,
+    catalog: Optional[Catalog] = None
+) -> Tuple[RoomPrompt, Optional[Dict]]:
+    """
+    Build the prompt and check the generation cache (blocking, no model call).
+
+    Returns the prompt plus the finished result when no model call is
+    needed: a cache hit, or a failure that calling again wouldn't fix.
+    """
+    catalog = catalog or get_catalog()
+    catalog_version = catalog.version if catalog else None
+    with PROMPT_BUILD_SECONDS.time():
+        prompt, aspect_ratio = compile_prompt(
+            room_type_id=room_type_id,
+            design_style_id=design_style_id,
+            architect_id=architect_id,
+            designer_id=designer_id,
+            color_wheel_id=color_wheel_id,
+            aspect_ratio_id=aspect_ratio_id,
+            flooring_type_id=flooring_type_id,
+            floor_board_width_id=floor_board_width_id,
+            catalog=catalog,
+        )
 
-    quality_settings = QUALITY_CONFIG.get(model_id, QUALITY_CONFIG["1k"])
-    target_model = quality_settings["model"]
-    image_size = quality_settings["image_size"]
+    log.debug("User prompt", room=room_type_id, style=design_style_id, prompt=prompt)
+
+    quality_id = model_id if model_id in QUALITY_CONFIG else "1k"
     
-    # Try Generation
-    if client:
+    # Identical selections compile to identical prompts; serve repeats from the cache.
+    # The system prompt version is a hash of its text, so it stands in for it in the key.
+    prompt_version = None
+    try:
+        system_instruction, prompt_version = system_prompt.get()
+    except RuntimeError as e:
+        log.warning("System prompt unavailable", error=str(e))
+        system_instruction = None
+
+    room = RoomPrompt(room_type_id, prompt, aspect_ratio, quality_id,
+                      system_instruction, prompt_version, catalog_version)
+
+    cache_key = _cache_key(room, QUALITY_CONFIG[quality_id])
+    if cache_key and not force_fresh:
+        cached = generation_cache.get(cache_key)
+        GENERATION_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+        if cached:
+            image_bytes, mime = cached
+            log.info("Generation cache hit", room=room_type_id, model=QUALITY_CONFIG[quality_id]["model"])
+            return room, {
+                **_success(room, quality_id, image_bytes, mime),
+                "cached": True,
+            }
+
+    if not backend.available:
+        return room, _failure(room)
+
+    if system_instruction is None:
+        # Fail fast if the system prompt is missing or unreadable
         try:
-            print(f"Generating with model: {target_model}")
-            
-            # Read System Prompt (fail fast if missing or unreadable)
-            import pathlib
-            current_file = pathlib.Path(__file__)
-            server_root = current_file.parent.parent
-            system_prompt_path = server_root / "data" / "system_prompt.txt"
-            try:
-                with open(system_prompt_path, "r", encoding="utf-8") as f:
-                    system_instruction = f.read()
-                print(f"Loaded system prompt from server/data ({len(system_instruction)} chars)")
-                print("Gemini system prompt:\n" + system_instruction)
-            except Exception as e:
-                raise RuntimeError(f"System prompt load failed: {system_prompt_path} ({e})")
-
-            print(f"Gemini image_config aspect_ratio: {aspect_ratio}, image_size: {image_size}")
-            config = types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                    image_size=image_size
-                )
-            )
-
-            response = client.models.generate_content(
-                model=target_model,
-                contents=prompt,
-                config=config
-            )
-            
-            # Parse Response
-            if response.candidates:
-                for part in response.candidates[0].content.parts:
-                    if part.inline_data:
-                        import base64
-                        b64_data = base64.b64encode(part.inline_data.data).decode("utf-8")
-                        mime = part.inline_data.mime_type or "image/jpeg"
-
-                        return {
-                            "success": True,
-                            "base64_data": b64_data,
-                            "mime_type": mime,
-                            "model_used": target_model,
-                            "prompt": prompt,
-                        }
-                        
-            print("No inline image data found in response.")
-            
-        except Exception as e:
-            print(f"Model {target_model} failed: {e}")
+            system_instruction, prompt_version = system_prompt.get()
+        except RuntimeError as e:
+            log.error("Generation aborted", room=room_type_id, error=str(e))
+            return room, {"success": False, "error": str(e), "prompt": prompt}
+        room = room._replace(system_instruction=system_instruction, prompt_version=prompt_version)
+    return room, None
+
+
+async def generate_room_image(
+    room_type_id: str,
+    design_style_id: str,
+    architect_id: str,
+    designer_id: str,
+    color_wheel_id: str,
+    aspect_ratio_id: str,
+    model_id: str = "1k",
+    flooring_type_id: str = None,
+    floor_board_width_id: str = None,
+    force_fresh: bool = False,
+    catalog: Optional[Catalog] = None,
+    executor: Optional[Executor] = None,
+) -> Dict:
+    """
+    Generate one room's image, falling back through lower qualities.
+
+    Only the model calls themselves run on `executor`; waiting between
+    attempts happens on the event loop, so a backing-off room doesn't hold
+    one of the executor's threads.
+    """
+    room, result = await run_in_threadpool(
+        prepare_room_image,
+        room_type_id=room_type_id,
+        design_style_id=design_style_id,
+        architect_id=architect_id,
+        designer_id=designer_id,
+        color_wheel_id=color_wheel_id,
+        aspect_ratio_id=aspect_ratio_id,
+        model_id=model_id,
+        flooring_type_id=flooring_type_id,
+        floor_board_width_id=floor_board_width_id,
+        force_fresh=force_fresh,
+        catalog=catalog,
+    )
+    if result is not None:
+        return result
+
+    deadline = time.monotonic() + GEMINI_TOTAL_DEADLINE_SECONDS
+    for attempt_quality in quality_chain(room.quality_id):
+        settings = QUALITY_CONFIG[attempt_quality]
+        image = await _generate_with_retries(
+            attempt_quality, settings["model"], settings["image_size"], room, deadline, executor
+        )
+        if image is None:
+            if time.monotonic() >= deadline:
+                log.warning("Generation deadline reached", room=room_type_id)
+                break
+            continue
+
+        image_bytes, mime = image
+        # Cache under the quality actually produced, never the one requested
+        key = _cache_key(room, settings)
+        if key:
+            await run_in_threadpool(_cache_put, key, image_bytes, mime)
+
+        if attempt_quality != room.quality_id:
+            log.warning("Fell back to a lower quality", room=room_type_id,
+                        requested=room.quality_id, used=attempt_quality)
+        return _success(room, attempt_quality, image_bytes, mime)
+
+    return _failure(room)
+
+
+def _cache_key(room: RoomPrompt, settings: Dict) -> Optional[str]:
+    if not generation_cache.enabled or not room.prompt_version:
+        return None
+    return generation_cache.make_key(
+        room.prompt, room.prompt_version, settings["model"], settings["image_size"], room.aspect_ratio
+    )
+
+
+def _cache_put(key: str, image_bytes: bytes, mime: str):
+    try:
+        generation_cache.put(key, image_bytes, mime)
+    except OSError as e:
+        log.warning("Generation cache write failed", error=str(e))
+
+
+def _success(room: RoomPrompt, quality_id: str, image_bytes: bytes, mime: str) -> Dict:
+    return {
+        "success": True,
+        "image_data": image_bytes,
+        "mime_type": mime,
+        "model_used": QUALITY_CONFIG[quality_id]["model"],
+        "quality_used": quality_id,
+        "prompt": room.prompt,
+        "system_prompt_version": room.prompt_version,
+        "catalog_version": room.catalog_version,
+    }
 
-    # Fallback to Placeholder
-    print("Generation failed. Using Placeholder.")
-    time.sleep(2) 
+
+def _failure(room: RoomPrompt) -> Dict:
+    log.warning("Generation failed, using placeholder", room=room.room_type_id, backend=backend.name)
     return {
         "success": False,
         "error": "Generation API failed or returned no image.",
-        "prompt": prompt
+        "prompt": room.prompt
     }
+
+
+def quality_chain(quality_id: str) -> List[str]:
+    """
+    Qualities to try for a request, best first: the requested one, then (with
+    GEMINI_QUALITY_FALLBACK) each lower entry of QUALITY_CONFIG, e.g. 4k -> 2k -> 1k.
+    """
+    order = list(QUALITY_CONFIG)
+    if quality_id not in QUALITY_CONFIG:
+        quality_id = order[0]
+    if not GEMINI_QUALITY_FALLBACK:
+        return [quality_id]
+    return order[order.index(quality_id)::-1]
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, errors.APIError):
+        return e.code in TRANSIENT_STATUS_CODES
+    # Timeouts and dropped connections
+    return isinstance(e, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError))
+
+
+def _backoff_delay(retry: int) -> float:
+    """Full-jitter exponential backoff."""
+    ceiling = min(GEMINI_RETRY_MAX_DELAY_SECONDS, GEMINI_RETRY_BASE_DELAY_SECONDS * (2 ** retry))
+    return random.uniform(0, ceiling)
+
+
+def _call_model(model: str, image_size: str, aspect_ratio: str, system_instruction: str,
+                prompt: str, timeout: float) -> Optional[Tuple[bytes, str]]:
+    """One backend call; returns (image bytes, mime) or None if no image came back."""
+    log.info("Calling model", model=model, image_size=image_size, aspect_ratio=aspect_ratio,
+             timeout=round(timeout))
+    with MODEL_CALL_SECONDS.time(model=model, outcome="error") as labels:
+        try:
+            image = backend.generate(model, image_size, aspect_ratio, system_instruction, prompt, timeout)
+        except errors.APIError as e:
+            labels["outcome"] = "rate_limited" if e.code == 429 else "error"
+            raise
+        except httpx.TimeoutException:
+            labels["outcome"] = "timeout"
+            raise
+        labels["outcome"] = "ok" if image else "empty"
+    return image
+
+
+async def _generate_with_retries(lane: str, model: str, image_size: str, room: RoomPrompt,
+                                 deadline: float, executor: Optional[Executor]) -> Optional[Tuple[bytes, str]]:
+    """
+    Call `model`, retrying transient failures with backoff until the retries
+    or the overall deadline run out. Returns None if this model gave no image.
+
+    Each call first takes a slot from the model's limiter in `lane`, waiting
+    at most until the deadline; upstream 429s pause the model for everyone.
+    Backoff is awaited here, not slept in the executor thread.
+    """
+    loop = asyncio.get_running_loop()
+    for retry in range(GEMINI_MAX_RETRIES + 1):
+        if deadline - time.monotonic() <= 1:
+            return None
+        try:
+            async with generation_limiter.slot(model, lane, timeout=deadline - time.monotonic() - 1):
+                # Only now, with a slot granted, is an executor thread taken
+                image = await loop.run_in_executor(
+                    executor, _call_model, model, image_size, room.aspect_ratio, room.system_instruction,
+                    room.prompt, min(GEMINI_CALL_TIMEOUT_SECONDS, max(1.0, deadline - time.monotonic()))
+                )
+            if image is None:
+                # A response without an image (e.g. blocked) won't change on retry
+                log.warning("Model returned no inline image data", model=model)
+            return image
+        except SlotTimeout as e:
+            log.warning("Model rate limited locally", model=model, error=str(e))
+            return None
+        except Exception as e:
+            if isinstance(e, errors.APIError) and e.code == 429:
+                generation_limiter.penalize(model, _backoff_delay(retry) + GEMINI_RETRY_BASE_DELAY_SECONDS)
+            if not _is_transient(e) or retry == GEMINI_MAX_RETRIES:
+                log.error("Model call failed", model=model, error=str(e))
+                return None
+            delay = min(_backoff_delay(retry), max(0.0, deadline - time.monotonic() - 1))
+            log.warning("Model call failed, retrying", model=model, error=str(e),
+                        retry=f"{retry + 1}/{GEMINI_MAX_RETRIES}", delay=round(delay, 2))
+            await asyncio.sleep(delay)
+    return None
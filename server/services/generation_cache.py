@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import GENERATION_CACHE_ENABLED, GENERATION_CACHE_MAX_BYTES
+
+SERVER_ROOT = Path(__file__).parent.parent
+DEFAULT_CACHE_DIR = SERVER_ROOT / "cache" / "generations"
+
+EXT_TO_MIME = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+MIME_TO_EXT = {mime: ext for ext, mime in EXT_TO_MIME.items()}
+
+
+def _resolve_cache_dir() -> Path:
+    env_value = os.getenv("GENERATION_CACHE_DIR")
+    if not env_value:
+        return DEFAULT_CACHE_DIR
+
+    env_path = Path(env_value)
+    if not env_path.is_absolute():
+        env_path = SERVER_ROOT / env_path
+    return env_path
+
+
+class GenerationCache:
+    """
+    On-disk cache of generated images keyed by everything sent to the model.
+
+    Entries are stored as `{key}{ext}` files. Recency is tracked in memory and
+    persisted through file mtimes, so LRU order survives a restart. When the
+    total size exceeds `max_bytes` the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None, max_bytes: int = GENERATION_CACHE_MAX_BYTES,
+                 enabled: bool = GENERATION_CACHE_ENABLED):
+        self.cache_dir = cache_dir or _resolve_cache_dir()
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Path, int]]" = OrderedDict()
+        self._total_bytes = 0
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    def _load_index(self):
+        files = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix not in EXT_TO_MIME:
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path, stat.st_size))
+
+        # Oldest first, so the front of the OrderedDict is the eviction candidate
+        for _, path, size in sorted(files):
+            self._entries[path.stem] = (path, size)
+            self._total_bytes += size
+
+    @staticmethod
+    def make_key(prompt: str, system_prompt: str, model: str, image_size: str, aspect_ratio: str) -> str:
+        payload = json.dumps([prompt, system_prompt, model, image_size, aspect_ratio])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """Return (image bytes, mime type) for a cached entry, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        path, _ = entry
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                if self._entries.pop(key, None):
+                    self._total_bytes -= entry[1]
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data, EXT_TO_MIME[path.suffix]
+
+    def put(self, key: str, data: bytes, mime_type: str):
+        ext = MIME_TO_EXT.get(mime_type, ".jpg")
+        path = self.cache_dir / f"{key}{ext}"
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._total_bytes -= previous[1]
+                if previous[0] != path:
+                    evicted.append(previous[0])
+            self._entries[key] = (path, len(data))
+            self._total_bytes += len(data)
+
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (old_path, old_size) = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            try:
+                old_path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+generation_cache = GenerationCache()
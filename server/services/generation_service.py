@@ -0,0 +1,211 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import GENERATION_MAX_CONCURRENCY, GENERATION_PER_REQUEST_CONCURRENCY
+from services.data_loader import Catalog, get_catalog
+from services.gemini_service import generate_room_image
+from services.image_storage import image_storage
+from services.log import get_logger
+from services.metrics import ROOM_GENERATION_SECONDS
+
+log = get_logger("generation")
+
+# Model calls block for the whole upstream round trip, so they run on a dedicated
+# pool. Its size is the global concurrency limit shared by every request; retry
+# backoff and storage happen off this pool, so its threads only ever wait on calls.
+_generation_executor = ThreadPoolExecutor(
+    max_workers=max(1, GENERATION_MAX_CONCURRENCY),
+    thread_name_prefix="generate",
+)
+
+QUALITY_LABELS = {
+    "1k": "1K",
+    "2k": "2K",
+    "4k": "4K"
+}
+
+RoomOutcome = Optional[Tuple[Dict, Dict]]
+
+
+# Helper to format names nicely
+def format_name(kebab_id):
+    return kebab_id.replace("-", " ").title()
+
+
+async def generate_room(params: Dict, session_id: str, room_id: str, image_id: str,
+                        catalog: Optional[Catalog] = None) -> RoomOutcome:
+    """
+    Generate and store a single room image.
+
+    Returns a (result, image) pair for the API response and the gallery
+    session, or None if the room should be skipped.
+    """
+    room_name = format_name(room_id)
+    quality = params.get("image_quality_id", "")
+    started = time.perf_counter()
+
+    try:
+        # generate_room_image returns raw image bytes + mime type for storage
+        response_data = await generate_room_image(
+            room_type_id=room_id,
+            design_style_id=params["design_style_id"],
+            architect_id=params["architect_id"],
+            designer_id=params["designer_id"],
+            color_wheel_id=params["color_wheel_id"],
+            aspect_ratio_id=params["aspect_ratio_id"],
+            model_id=params["image_quality_id"],
+            flooring_type_id=params.get("flooring_type_id"),
+            floor_board_width_id=params.get("floor_board_width_id"),
+            force_fresh=params.get("force_fresh", False),
+            catalog=catalog,
+            executor=_generation_executor,
+        )
+
+        # Extract URL for internal storage (Gallery/Session) which expects a string
+        if response_data.get("success"):
+            try:
+                image_url = await run_in_threadpool(
+                    image_storage.save_image,
+                    session_id=session_id,
+                    room_type_id=room_id,
+                    image_id=image_id,
+                    image_data=response_data.pop("image_data", None),
+                    mime_type=response_data.get("mime_type", "image/jpeg"),
+                )
+                api_result = {
+                    "success": True,
+                    "data": image_url,
+                    "model_used": response_data.get("model_used"),
+                    "quality_used": response_data.get("quality_used"),
+                    "prompt": response_data.get("prompt"),
+                    "cached": response_data.get("cached", False),
+                    "system_prompt_version": response_data.get("system_prompt_version"),
+                    "catalog_version": response_data.get("catalog_version"),
+                }
+            except Exception as e:
+                log.error("Failed to store room image", room=room_id, session=session_id, error=str(e))
+                image_url = "https://placehold.co/1024x1024?text=Storage+Failed"
+                api_result = {
+                    "success": False,
+                    "error": "Image storage failed",
+                    "prompt": response_data.get("prompt"),
+                }
+        else:
+            log.warning("Failed to generate room", room=room_id, session=session_id,
+                        error=response_data.get("error"))
+            image_url = "https://placehold.co/1024x1024?text=Generation+Failed"
+            api_result = response_data
+
+        # API Response: Frontend expects { result: { success, data, ... } }
+        result = {
+            "room_type_id": room_id,
+            "result": api_result
+        }
+
+        # Session Storage: Expects { url: "string_url" }
+        image = {
+            "id": image_id,
+            "roomType": {
+                "id": room_id,
+                "name": room_name
+            },
+            "url": image_url, # Ensure this is a string
+            "derivatives": image_storage.derivative_urls(image_url),
+            "selected": False
+        }
+        if api_result.get("system_prompt_version"):
+            image["systemPromptVersion"] = api_result["system_prompt_version"]
+        if api_result.get("catalog_version"):
+            image["catalogVersion"] = api_result["catalog_version"]
+        ROOM_GENERATION_SECONDS.observe(
+            time.perf_counter() - started,
+            quality=quality,
+            outcome="ok" if api_result.get("success") else "failed",
+        )
+        return result, image
+
+    except Exception as e:
+        ROOM_GENERATION_SECONDS.observe(time.perf_counter() - started, quality=quality, outcome="error")
+        log.error("Error generating room", room=room_id, session=session_id, error=str(e))
+        # Continue with other rooms even if one fails
+        return None
+
+
+async def generate_rooms(
+    params: Dict,
+    session_id: str,
+    rooms: List[Tuple[str, str]],
+    on_room_started: Optional[Callable[[int], Awaitable[None]]] = None,
+    on_room_finished: Optional[Callable[[int, RoomOutcome], Awaitable[None]]] = None,
+) -> List[RoomOutcome]:
+    """
+    Generate a list of (room_id, image_id) pairs concurrently.
+
+    Outcomes come back in the order of `rooms`. The optional callbacks receive
+    the room's index as it starts and finishes. Every room uses the catalog
+    snapshot that was live when the request started, even across a reload.
+    """
+    # The per-request semaphore keeps one large request from occupying every
+    # slot of the shared executor.
+    room_slots = asyncio.Semaphore(max(1, GENERATION_PER_REQUEST_CONCURRENCY))
+    catalog = get_catalog()
+
+    async def run_room(index: int, room_id: str, image_id: str) -> RoomOutcome:
+        async with room_slots:
+            if on_room_started:
+                await on_room_started(index)
+            outcome = await generate_room(params, session_id, room_id, image_id, catalog)
+        if on_room_finished:
+            await on_room_finished(index, outcome)
+        return outcome
+
+    # gather preserves the requested room order regardless of completion order.
+    # If a callback raises (e.g. the job's lease was lost), stop the other rooms.
+    tasks = [
+        asyncio.ensure_future(run_room(index, room_id, image_id))
+        for index, (room_id, image_id) in enumerate(rooms)
+    ]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def new_room_plan(room_type_ids: List[str]) -> List[Tuple[str, str]]:
+    """Assign an image id to each requested room."""
+    return [(room_id, str(uuid.uuid4())) for room_id in room_type_ids]
+
+
+def build_session(params: Dict, session_id: str, images: List[Dict]) -> Dict:
+    """Create the gallery session record for a finished generation."""
+    image_quality_id = params["image_quality_id"]
+    image_quality_label = QUALITY_LABELS.get(image_quality_id, image_quality_id)
+
+    return {
+        "id": session_id,
+        "createdAt": datetime.utcnow().isoformat() + "Z", # proper ISO format
+        "designStyle": {
+            "id": params["design_style_id"],
+            "name": format_name(params["design_style_id"])
+        },
+        "architect": {
+            "id": params["architect_id"],
+            "name": format_name(params["architect_id"])
+        },
+        "designer": {
+            "id": params["designer_id"],
+            "name": format_name(params["designer_id"])
+        },
+        "colorWheel": params["color_wheel_id"], # Assumes valid value passed 'Light'|'Medium'|'Dark'
+        "aspectRatio": params["aspect_ratio_id"].replace(":", ":"), # careful if format differs
+        "imageQuality": image_quality_label,
+        "images": images
+    }
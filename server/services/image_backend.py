@@ -0,0 +1,177 @@
+import hashlib
+import random
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+import httpx
+from google import genai
+from google.genai import errors, types
+
+from config import (
+    FAKE_BACKEND_EMPTY_RATE,
+    FAKE_BACKEND_FAILURE_RATE,
+    FAKE_BACKEND_IMAGE_WIDTH,
+    FAKE_BACKEND_LATENCY_MS,
+    FAKE_BACKEND_LATENCY_SIGMA,
+    FAKE_BACKEND_RATE_LIMIT_RATE,
+    FAKE_BACKEND_SEED,
+    GENERATION_BACKEND,
+    GOOGLE_API_KEY,
+)
+from services.log import get_logger
+from services.metrics import RESPONSE_DECODE_SECONDS
+
+ImageResult = Optional[Tuple[bytes, str]]
+
+log = get_logger("backend")
+
+
+class ImageBackend:
+    """Produces one image per call; returns (bytes, mime) or None if no image came back."""
+
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def generate(self, model: str, image_size: str, aspect_ratio: str, system_instruction: str,
+                 prompt: str, timeout: float) -> ImageResult:
+        raise NotImplementedError
+
+
+class GeminiBackend(ImageBackend):
+    """The live Gemini API."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = GOOGLE_API_KEY):
+        # Configure Gemini Client (v1beta/v0.8+ SDK)
+        if api_key:
+            self.client = genai.Client(api_key=api_key)
+        else:
+            log.warning("Gemini API key missing; generation will return placeholders")
+            self.client = None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    def generate(self, model: str, image_size: str, aspect_ratio: str, system_instruction: str,
+                 prompt: str, timeout: float) -> ImageResult:
+        config = types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            image_config=types.ImageConfig(
+                aspect_ratio=aspect_ratio,
+                image_size=image_size
+            ),
+            http_options=types.HttpOptions(timeout=int(timeout * 1000)),
+        )
+
+        response = self.client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=config
+        )
+
+        # Parse Response
+        with RESPONSE_DECODE_SECONDS.time():
+            if response.candidates and response.candidates[0].content:
+                for part in response.candidates[0].content.parts or []:
+                    if part.inline_data:
+                        # Raw bytes from the SDK are passed through untouched
+                        return part.inline_data.data, part.inline_data.mime_type or "image/jpeg"
+        return None
+
+
+def _png(width: int, height: int, top: Tuple[int, int, int], bottom: Tuple[int, int, int]) -> bytes:
+    """A vertical two-colour gradient as PNG, using only the stdlib."""
+    rows = []
+    for y in range(height):
+        t = y / max(1, height - 1)
+        pixel = bytes(round(a + (b - a) * t) for a, b in zip(top, bottom))
+        rows.append(b"\x00" + pixel * width)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+class FakeImageBackend(ImageBackend):
+    """
+    Offline stand-in for the model API.
+
+    Images are a pure function of (model, size, aspect ratio, prompt), so the
+    same request always yields the same bytes. Latency and failures are drawn
+    from a seeded RNG and surface as the same exception types the live
+    backend raises, so retries, fallbacks and rate limiting are exercised too.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = FAKE_BACKEND_LATENCY_MS,
+        latency_sigma: float = FAKE_BACKEND_LATENCY_SIGMA,
+        failure_rate: float = FAKE_BACKEND_FAILURE_RATE,
+        rate_limit_rate: float = FAKE_BACKEND_RATE_LIMIT_RATE,
+        empty_rate: float = FAKE_BACKEND_EMPTY_RATE,
+        image_width: int = FAKE_BACKEND_IMAGE_WIDTH,
+        seed: int = FAKE_BACKEND_SEED,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.empty_rate = empty_rate
+        self.image_width = max(1, image_width)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self) -> Tuple[float, float]:
+        with self._lock:
+            latency = self.latency_ms / 1000 * self._rng.lognormvariate(0, self.latency_sigma) if self.latency_ms > 0 else 0.0
+            return latency, self._rng.random()
+
+    def generate(self, model: str, image_size: str, aspect_ratio: str, system_instruction: str,
+                 prompt: str, timeout: float) -> ImageResult:
+        latency, outcome = self._draw()
+        if latency > timeout:
+            time.sleep(timeout)
+            raise httpx.ReadTimeout(f"Fake backend exceeded the {timeout:.0f}s deadline")
+        time.sleep(latency)
+
+        if outcome < self.failure_rate:
+            raise errors.ServerError(503, {"error": {"message": "Fake backend: service unavailable"}})
+        outcome -= self.failure_rate
+        if outcome < self.rate_limit_rate:
+            raise errors.ClientError(429, {"error": {"message": "Fake backend: quota exceeded"}})
+        outcome -= self.rate_limit_rate
+        if outcome < self.empty_rate:
+            return None
+
+        digest = hashlib.sha256(f"{model}\0{image_size}\0{aspect_ratio}\0{prompt}".encode("utf-8")).digest()
+        try:
+            ratio_w, ratio_h = (int(n) for n in aspect_ratio.split(":"))
+        except ValueError:
+            ratio_w, ratio_h = 1, 1
+        height = max(1, round(self.image_width * ratio_h / ratio_w))
+        return _png(self.image_width, height, tuple(digest[:3]), tuple(digest[3:6])), "image/png"
+
+
+def create_image_backend(backend: str = GENERATION_BACKEND) -> ImageBackend:
+    if backend == "fake":
+        log.info("Using the fake image backend; no model calls will be made")
+        return FakeImageBackend()
+    if backend != "gemini":
+        log.warning("Unknown generation backend, using gemini", backend=backend)
+    return GeminiBackend()
@@ -0,0 +1,107 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+
+class ImageRefStore:
+    """
+    Maps each stored image's (session id, filename) to a content-addressed
+    blob, in a small SQLite file.
+
+    Many references can share one blob. Write transactions are IMMEDIATE, so
+    adding a reference and collecting unreferenced blobs never interleave,
+    even across processes.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _init_schema(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS image_refs (
+                    session_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    blob TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, filename)
+                );
+                CREATE INDEX IF NOT EXISTS idx_image_refs_blob ON image_refs (blob);
+                """
+            )
+
+    def lookup(self, session_id: str, filename: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT blob FROM image_refs WHERE session_id = ? AND filename = ?",
+                (session_id, filename),
+            ).fetchone()
+        return row[0] if row else None
+
+    def add(self, conn: sqlite3.Connection, session_id: str, filename: str, blob: str):
+        conn.execute(
+            "INSERT OR REPLACE INTO image_refs (session_id, filename, blob, created_at) VALUES (?, ?, ?, ?)",
+            (session_id, filename, blob, time.time()),
+        )
+
+    def remove_session(self, conn: sqlite3.Connection, session_id: str) -> Tuple[int, List[str]]:
+        """
+        Drop a session's references. Returns (references removed, blobs that
+        nothing references any more).
+        """
+        blobs = [row[0] for row in conn.execute(
+            "SELECT DISTINCT blob FROM image_refs WHERE session_id = ?", (session_id,)
+        )]
+        removed = conn.execute("DELETE FROM image_refs WHERE session_id = ?", (session_id,)).rowcount
+        return removed, [
+            blob for blob in blobs
+            if conn.execute("SELECT 1 FROM image_refs WHERE blob = ? LIMIT 1", (blob,)).fetchone() is None
+        ]
+
+    def sessions_older_than(self, cutoff: float) -> List[str]:
+        """Sessions whose newest reference was created before `cutoff` (epoch seconds)."""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT session_id FROM image_refs GROUP BY session_id HAVING MAX(created_at) < ?",
+                (cutoff,),
+            )]
+
+    def referenced(self, conn: sqlite3.Connection, blobs: List[str]) -> Set[str]:
+        """The subset of `blobs` that at least one reference points to."""
+        found = set()
+        for start in range(0, len(blobs), 500):
+            chunk = blobs[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(row[0] for row in conn.execute(
+                f"SELECT DISTINCT blob FROM image_refs WHERE blob IN ({placeholders})", chunk
+            ))
+        return found
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM image_refs").fetchone()[0]
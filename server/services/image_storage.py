@@ -1,10 +1,42 @@
 import base64
+import hashlib
 import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from config import (
+    IMAGE_DERIVATIVE_WIDTHS,
+    IMAGE_STAT_CACHE_SIZE,
+    IMAGE_STAT_CACHE_TTL_SECONDS,
+    IMAGE_STORAGE_LAYOUT,
+)
+from services.image_refs import ImageRefStore
+from services.log import get_logger
+from services.metrics import IMAGE_DEDUP_HITS, IMAGE_WRITE_BYTES, IMAGE_WRITE_SECONDS
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
 
 SERVER_ROOT = Path(__file__).parent.parent
 DEFAULT_IMAGES_DIR = SERVER_ROOT / "images" / "sessions"
+URL_PREFIX = "/api/images/sessions/"
+DERIVATIVE_QUALITY = 80
+MIME_TO_EXT = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+}
+BLOB_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+log = get_logger("images")
 
 
 def _resolve_base_dir() -> Path:
@@ -18,11 +50,131 @@ def _resolve_base_dir() -> Path:
     return env_path
 
 
+def _resolve_blob_dir(base_dir: Path) -> Path:
+    env_value = os.getenv("IMAGE_BLOB_DIR")
+    if not env_value:
+        return base_dir.parent / "blobs"
+
+    env_path = Path(env_value)
+    if not env_path.is_absolute():
+        env_path = SERVER_ROOT / env_path
+    return env_path
+
+
+def _resolve_refs_path(base_dir: Path) -> Path:
+    env_value = os.getenv("IMAGE_REFS_DB_PATH")
+    if not env_value:
+        return base_dir.parent / "image_refs.db"
+
+    env_path = Path(env_value)
+    if not env_path.is_absolute():
+        env_path = SERVER_ROOT / env_path
+    return env_path
+
+
+class ImageFileInfo(NamedTuple):
+    path: Path
+    stat: os.stat_result
+    etag: str
+
+
+class _LRUCache:
+    """Small thread-safe LRU map with optional per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[object, tuple]" = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            stored_at, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+
+_MISSING = object()
+
+
+def _content_etag(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()[:32]}"'
+
+
 class ImageStorageService:
-    def __init__(self, base_dir: Optional[Path] = None):
+    """
+    Stores generated images and maps their API URLs back to files.
+
+    In the "session" layout each image is a file in its session's directory.
+    In the "content" layout the bytes are stored once per SHA-256 under
+    blob_dir/ab/cd/<hash>.<ext> (two fan-out levels keep directories small),
+    and each session image is just a row in the reference store. The URLs are
+    the same in both layouts, so stored galleries don't change.
+    """
+
+    def __init__(self, base_dir: Optional[Path] = None, derivative_widths=IMAGE_DERIVATIVE_WIDTHS,
+                 layout: str = IMAGE_STORAGE_LAYOUT):
         self.base_dir = base_dir or _resolve_base_dir()
+        if layout not in ("session", "content"):
+            log.warning("Unknown image storage layout, using session", layout=layout)
+            layout = "session"
+        self.layout = layout
+        self.blob_dir = _resolve_blob_dir(self.base_dir)
+        self._refs_path = _resolve_refs_path(self.base_dir)
+        self._refs = ImageRefStore(self._refs_path) if layout == "content" else None
+        self._refs_checked_at = float("-inf")
+        self.derivative_widths = tuple(sorted(derivative_widths)) if Image else ()
+        # Resizing is CPU-bound and never on the request path
+        self._derivative_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="derivatives")
+        # Deleting a session's files happens after the API call returns
+        self._deletion_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-delete")
+        # URL -> validated path never changes; stat results are re-checked after the TTL
+        self._resolved_base_dir = self.base_dir.resolve()
+        self._url_paths = _LRUCache(IMAGE_STAT_CACHE_SIZE)
+        self._stats = _LRUCache(IMAGE_STAT_CACHE_SIZE, ttl=IMAGE_STAT_CACHE_TTL_SECONDS)
+        self._stats_by_signature = _LRUCache(IMAGE_STAT_CACHE_SIZE)
         self._ensure_directory()
 
+    @property
+    def refs(self) -> Optional[ImageRefStore]:
+        """
+        The reference store, or None while there is none. References are
+        resolved whenever they exist, e.g. after switching back from the
+        content layout, or once migrate_to_content_store.py has run while the
+        server is up; the file is looked for again every few seconds.
+        """
+        if self._refs is None:
+            now = time.monotonic()
+            if now - self._refs_checked_at >= IMAGE_STAT_CACHE_TTL_SECONDS:
+                self._refs_checked_at = now
+                if self._refs_path.exists():
+                    self._refs = ImageRefStore(self._refs_path)
+                    # URLs resolved without references may point at moved files
+                    self._url_paths.discard_where(lambda _: True)
+        return self._refs
+
     def _ensure_directory(self):
         """Create images directory if it doesn't exist."""
         self.base_dir.mkdir(parents=True, exist_ok=True)
@@ -32,64 +184,320 @@ class ImageStorageService:
         session_id: str,
         room_type_id: str,
         image_id: str,
-        base64_data: str,
+        image_data: Union[bytes, bytearray, memoryview],
         mime_type: str = "image/jpeg",
     ) -> str:
         """
-        Save a base64-encoded image to disk.
+        Save raw image bytes to disk.
+
+        The file is written to a temporary name and renamed into place, so
+        readers never see a partially written image.
 
         Returns:
             Relative API URL for the saved image.
         """
-        if not base64_data:
-            raise ValueError("base64_data is required to save an image")
+        if not image_data:
+            raise ValueError("image_data is required to save an image")
+
+        ext = MIME_TO_EXT.get(mime_type, ".jpg")
+        filename = f"{room_type_id}-{image_id[:8]}{ext}"
+
+        if self.layout == "content":
+            self._save_blob(session_id, filename, image_data, ext)
+            return f"{URL_PREFIX}{session_id}/{filename}"
 
         session_dir = self.base_dir / session_id
         session_dir.mkdir(exist_ok=True)
+        file_path = session_dir / filename
+
+        tmp_path = file_path.with_name(f".{filename}.{threading.get_ident()}.tmp")
+        try:
+            with IMAGE_WRITE_SECONDS.time():
+                with open(tmp_path, "wb") as f:
+                    f.write(image_data)
+                os.replace(tmp_path, file_path)
+            IMAGE_WRITE_BYTES.inc(len(image_data))
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
 
-        ext_map = {
-            "image/jpeg": ".jpg",
-            "image/png": ".png",
-            "image/webp": ".webp",
-        }
-        ext = ext_map.get(mime_type, ".jpg")
+        self.schedule_derivatives(file_path)
 
-        filename = f"{room_type_id}-{image_id[:8]}{ext}"
-        file_path = session_dir / filename
+        return f"{URL_PREFIX}{session_id}/{filename}"
 
-        image_bytes = base64.b64decode(base64_data)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
+    @staticmethod
+    def blob_name(image_data: Union[bytes, bytearray, memoryview], ext: str) -> str:
+        return f"{hashlib.sha256(image_data).hexdigest()}{ext}"
 
-        return f"/api/images/sessions/{session_id}/{filename}"
+    def blob_path(self, blob: str) -> Path:
+        return self.blob_dir / blob[:2] / blob[2:4] / blob
 
-    def get_image_path(self, relative_url: str) -> Optional[Path]:
+    def add_blob_ref(self, session_id: str, filename: str, blob: str, write) -> bool:
         """
-        Convert an API URL to a filesystem path.
+        Reference `blob` from a session image, calling write(path) to create
+        the blob first if it isn't stored yet. Runs inside a reference-store
+        write transaction, so a concurrent sweep can't delete the blob
+        between the existence check and the new reference. Returns whether
+        the blob was created.
         """
-        prefix = "/api/images/sessions/"
-        if not relative_url.startswith(prefix):
+        path = self.blob_path(blob)
+        with self.refs.transaction() as conn:
+            created = not path.exists()
+            if created:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                write(path)
+            self.refs.add(conn, session_id, filename, blob)
+        self._url_paths.put(f"{URL_PREFIX}{session_id}/{filename}", path)
+        return created
+
+    def _save_blob(self, session_id: str, filename: str, image_data, ext: str):
+        blob = self.blob_name(image_data, ext)
+
+        def write(path: Path):
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(image_data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+
+        with IMAGE_WRITE_SECONDS.time():
+            created = self.add_blob_ref(session_id, filename, blob, write)
+        if created:
+            IMAGE_WRITE_BYTES.inc(len(image_data))
+            self.schedule_derivatives(self.blob_path(blob))
+        else:
+            IMAGE_DEDUP_HITS.inc()
+
+    def save_image_base64(
+        self,
+        session_id: str,
+        room_type_id: str,
+        image_id: str,
+        base64_data: str,
+        mime_type: str = "image/jpeg",
+    ) -> str:
+        """Compatibility shim for legacy data: URLs (used by the migration script)."""
+        if not base64_data:
+            raise ValueError("base64_data is required to save an image")
+        return self.save_image(
+            session_id=session_id,
+            room_type_id=room_type_id,
+            image_id=image_id,
+            image_data=base64.b64decode(base64_data),
+            mime_type=mime_type,
+        )
+
+    @staticmethod
+    def derivative_path(original: Path, width: int) -> Path:
+        return original.with_name(f"{original.stem}.w{width}.webp")
+
+    def derivative_urls(self, url: str) -> Dict[str, str]:
+        """
+        Sized variants of a stored image, keyed by width, for srcset.
+        The image route falls back to the original until they exist.
+        """
+        if not isinstance(url, str) or not url.startswith(URL_PREFIX):
+            return {}
+        return {str(width): f"{url}?size={width}" for width in self.derivative_widths}
+
+    def schedule_derivatives(self, original: Path) -> Optional[Future]:
+        """
+        Queue derivative generation for a stored original. Best-effort: the
+        original is already saved, so a failure to schedule (e.g. during
+        shutdown) is logged, not raised; backfill_derivatives.py fills gaps.
+        """
+        if not self.derivative_widths:
             return None
+        try:
+            return self._derivative_executor.submit(self._create_derivatives_logged, original)
+        except Exception as e:
+            log.error("Failed to schedule derivatives", image=original.name, error=str(e))
+            return None
+
+    def _create_derivatives_logged(self, original: Path):
+        try:
+            self.create_derivatives(original)
+        except Exception as e:
+            log.error("Failed to create derivatives", image=original.name, error=str(e))
+
+    def create_derivatives(self, original: Path, overwrite: bool = False) -> int:
+        """
+        Write downscaled WebP copies of `original` next to it. Widths at or
+        above the original's width are skipped. Returns the number written.
+        """
+        if not self.derivative_widths:
+            return 0
+
+        written = 0
+        with Image.open(original) as img:
+            img.load()
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+            for width in self.derivative_widths:
+                target = self.derivative_path(original, width)
+                if width >= img.width or (target.exists() and not overwrite):
+                    continue
+                height = max(1, round(img.height * width / img.width))
+                resized = img.resize((width, height), Image.LANCZOS)
+                tmp_path = target.with_name(f".{target.name}.tmp")
+                resized.save(tmp_path, "WEBP", quality=DERIVATIVE_QUALITY)
+                os.replace(tmp_path, target)
+                written += 1
+        return written
+
+    def get_derivative(self, original: Path, width: int) -> Optional[ImageFileInfo]:
+        """Existing derivative closest to (and at least) `width`, if any."""
+        for candidate in self.derivative_widths:
+            if candidate >= width:
+                info = self.stat_path(self.derivative_path(original, candidate))
+                if info:
+                    return info
+        return None
+
+    def has_derivatives(self, original: Path) -> bool:
+        if not self.derivative_widths:
+            return False
+        return self.stat_path(self.derivative_path(original, self.derivative_widths[0])) is not None
 
-        relative_path = relative_url[len(prefix):].lstrip("/")
-        full_path = (self.base_dir / relative_path).resolve()
+    def _resolve_url(self, relative_url: str) -> Optional[Path]:
+        """Map an API URL to a path inside base_dir without touching the disk cache."""
+        refs = self.refs
+        cached = self._url_paths.get(relative_url, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        path = None
+        if relative_url.startswith(URL_PREFIX):
+            relative_path = relative_url[len(URL_PREFIX):].lstrip("/")
+            if refs is not None:
+                session_id, _, filename = relative_path.partition("/")
+                blob = refs.lookup(session_id, filename)
+                if blob and BLOB_NAME.match(blob):
+                    path = self.blob_path(blob)
+                    self._url_paths.put(relative_url, path)
+                    return path
+            full_path = (self.base_dir / relative_path).resolve()
+            try:
+                full_path.relative_to(self._resolved_base_dir)
+                path = full_path
+            except ValueError:
+                path = None
+
+        # With references, a miss isn't cached: the image may be saved later
+        if refs is None:
+            self._url_paths.put(relative_url, path)
+        return path
+
+    def stat_path(self, path: Path) -> Optional[ImageFileInfo]:
+        """
+        Cached stat of a stored file plus a strong content ETag. The hash is
+        only recomputed when the file's mtime or size changes.
+        """
+        cached = self._stats.get(path, _MISSING)
+        if cached is not _MISSING:
+            return cached
 
         try:
-            full_path.relative_to(self.base_dir.resolve())
-        except ValueError:
+            stat = os.stat(path)
+        except OSError:
+            self._stats.put(path, None)
             return None
 
-        return full_path if full_path.exists() else None
+        previous = self._stats_by_signature.get(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if previous and previous[0] == signature:
+            etag = previous[1]
+        else:
+            etag = _content_etag(path)
+            self._stats_by_signature.put(path, (signature, etag))
+
+        info = ImageFileInfo(path=path, stat=stat, etag=etag)
+        self._stats.put(path, info)
+        return info
+
+    def stat_image(self, relative_url: str) -> Optional[ImageFileInfo]:
+        path = self._resolve_url(relative_url)
+        return self.stat_path(path) if path else None
+
+    def get_image_path(self, relative_url: str) -> Optional[Path]:
+        """
+        Convert an API URL to a filesystem path.
+        """
+        info = self.stat_image(relative_url)
+        return info.path if info else None
+
+    def invalidate_session(self, session_id: str, blob_paths=()):
+        """Forget cached URLs and stats for a session's files (after deleting them)."""
+        session_dir = self.base_dir.resolve() / session_id
+        prefix = f"{URL_PREFIX}{session_id}/"
+        paths = set(blob_paths)
+        self._url_paths.discard_where(lambda url: url.startswith(prefix))
+        self._stats.discard_where(lambda path: path.parent == session_dir or path in paths)
+        self._stats_by_signature.discard_where(lambda path: path.parent == session_dir or path in paths)
+
+    def delete_blob(self, blob: str) -> int:
+        """Remove a blob and its derivatives; returns the bytes freed."""
+        original = self.blob_path(blob)
+        freed = 0
+        for path in [original] + [self.derivative_path(original, w) for w in self.derivative_widths]:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def delete_session_images(self, session_id: str) -> int:
+        """
+        Delete all images for a session; returns the bytes freed. Shared
+        blobs stay until the last session referencing them is deleted.
+        """
+        freed = 0
+        blob_paths = []
+        if self.refs is not None:
+            with self.refs.transaction() as conn:
+                _, orphans = self.refs.remove_session(conn, session_id)
+                for blob in orphans:
+                    freed += self.delete_blob(blob)
+                    original = self.blob_path(blob)
+                    blob_paths.append(original)
+                    blob_paths.extend(self.derivative_path(original, w) for w in self.derivative_widths)
 
-    def delete_session_images(self, session_id: str) -> bool:
-        """Delete all images for a session."""
         session_dir = self.base_dir / session_id
-        if session_dir.exists():
-            import shutil
+        if session_dir.is_dir():
+            freed += tree_bytes(session_dir)
+            shutil.rmtree(session_dir, ignore_errors=True)
+        self.invalidate_session(session_id, blob_paths)
+        return freed
+
+    def delete_session_images_later(self, session_id: str) -> Future:
+        """Delete a session's images on a background thread."""
+        return self._deletion_executor.submit(self._delete_session_images_logged, session_id)
+
+    def _delete_session_images_logged(self, session_id: str) -> int:
+        try:
+            freed = self.delete_session_images(session_id)
+            log.info("Deleted session images", session=session_id, bytes=freed)
+            return freed
+        except Exception as e:
+            log.error("Failed to delete session images", session=session_id, error=str(e))
+            return 0
+
 
-            shutil.rmtree(session_dir)
-            return True
-        return False
+def tree_bytes(path: Path) -> int:
+    """Total size of the files under a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
 
 
 image_storage = ImageStorageService()
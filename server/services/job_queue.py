@@ -0,0 +1,499 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from config import JOB_LEASE_SECONDS, JOB_POLL_INTERVAL_SECONDS, JOB_WORKERS
+from services.gallery_service import gallery_service
+from services.generation_service import build_session, generate_rooms, new_room_plan
+from services.log import get_logger
+
+SERVER_ROOT = Path(__file__).parent.parent
+DEFAULT_JOB_STORE_PATH = SERVER_ROOT / "jobs.db"
+
+log = get_logger("jobs")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+ROOM_PENDING = "pending"
+ROOM_IN_PROGRESS = "in-progress"
+ROOM_COMPLETED = "completed"
+ROOM_FAILED = "failed"
+
+# Lower runs first: interactive requests ahead of queued batch work
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+def _resolve_store_path() -> Path:
+    env_value = os.getenv("JOB_STORE_PATH")
+    if not env_value:
+        return DEFAULT_JOB_STORE_PATH
+
+    env_path = Path(env_value)
+    if not env_path.is_absolute():
+        env_path = SERVER_ROOT / env_path
+    return env_path
+
+
+class JobStore:
+    """
+    Durable generation queue backed by a local SQLite file.
+
+    A job is claimed under a lease that its worker keeps renewing. Jobs whose
+    lease lapses (the worker crashed or the server restarted) are handed out
+    again, and rooms that already finished are not regenerated.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path or _resolve_store_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_schema(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    rooms TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL
+                )
+                """
+            )
+            # Columns added after the first release
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "batch_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN batch_id TEXT")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS batches (
+                    id TEXT PRIMARY KEY,
+                    spec TEXT NOT NULL,
+                    duplicates INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "params": json.loads(row["params"]),
+            "session_id": row["session_id"],
+            "rooms": json.loads(row["rooms"]),
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "priority": row["priority"],
+            "batch_id": row["batch_id"],
+        }
+
+    def _insert_job(self, conn: sqlite3.Connection, params: Dict, priority: int = PRIORITY_INTERACTIVE,
+                    batch_id: Optional[str] = None) -> str:
+        now = time.time()
+        rooms = [
+            {"room_type_id": room_id, "image_id": image_id, "status": ROOM_PENDING}
+            for room_id, image_id in new_room_plan(params["room_type_ids"])
+        ]
+        job_id = str(uuid.uuid4())
+        conn.execute(
+            """
+            INSERT INTO jobs (id, status, params, session_id, rooms, created_at, updated_at, priority, batch_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job_id, JOB_QUEUED, json.dumps(params), str(uuid.uuid4()), json.dumps(rooms), now, now,
+             priority, batch_id),
+        )
+        return job_id
+
+    def enqueue(self, params: Dict) -> Dict:
+        """Persist a new job and return it."""
+        with self._connect() as conn:
+            job_id = self._insert_job(conn, params)
+        return self.get(job_id)
+
+    def enqueue_batch(self, spec: Dict, jobs: List[Dict], duplicates: int) -> str:
+        """
+        Persist a batch and its jobs (one params dict each) in one transaction.
+        Batch jobs run after any queued interactive job.
+        """
+        batch_id = str(uuid.uuid4())
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO batches (id, spec, duplicates, created_at) VALUES (?, ?, ?, ?)",
+                    (batch_id, json.dumps(spec), duplicates, time.time()),
+                )
+                for params in jobs:
+                    self._insert_job(conn, params, PRIORITY_BATCH, batch_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return batch_id
+
+    def get_batch(self, batch_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if row is None:
+                return None
+            jobs = conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at, rowid", (batch_id,)
+            ).fetchall()
+        return {
+            "id": row["id"],
+            "spec": json.loads(row["spec"]),
+            "duplicates": row["duplicates"],
+            "created_at": row["created_at"],
+            "jobs": [self._row_to_job(job) for job in jobs],
+        }
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def backlog(self, lane: str) -> int:
+        """Unfinished rooms of interactive jobs in this quality lane (batches don't count)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT COUNT(*) FROM jobs, json_each(jobs.rooms) AS room
+                WHERE jobs.status IN (?, ?)
+                  AND jobs.priority = ?
+                  AND json_extract(jobs.params, '$.image_quality_id') = ?
+                  AND json_extract(room.value, '$.status') IN (?, ?)
+                """,
+                (JOB_QUEUED, JOB_RUNNING, PRIORITY_INTERACTIVE, lane, ROOM_PENDING, ROOM_IN_PROGRESS),
+            ).fetchone()
+        return row[0]
+
+    def claim(self, owner: str) -> Optional[Dict]:
+        """Atomically take the oldest queued (or abandoned) job."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE status = ? OR (status = ? AND lease_expires_at < ?)
+                    ORDER BY priority, created_at
+                    LIMIT 1
+                    """,
+                    (JOB_QUEUED, JOB_RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        """
+                        UPDATE jobs SET status = ?, lease_owner = ?, lease_expires_at = ?, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        (JOB_RUNNING, owner, now + JOB_LEASE_SECONDS, now, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return self._row_to_job(row)
+
+    # Writes from a job's worker only land while it still holds the lease; once
+    # another worker reclaims the job they return False and change nothing.
+    # Rooms arrive already serialized, as a snapshot taken by the worker.
+
+    def renew_lease(self, job_id: str, owner: str) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND lease_owner = ?",
+                (now + JOB_LEASE_SECONDS, job_id, owner),
+            ).rowcount > 0
+
+    def update_rooms(self, job_id: str, owner: str, rooms: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET rooms = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                (rooms, time.time(), job_id, owner),
+            ).rowcount > 0
+
+    def active_session_ids(self) -> Set[str]:
+        """Sessions of queued or running jobs, whose images may not be in the gallery yet."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT session_id FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return {row["session_id"] for row in rows}
+
+    def finish(self, job_id: str, owner: str, status: str, rooms: str, error: Optional[str] = None) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs SET status = ?, rooms = ?, error = ?, updated_at = ?,
+                    lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ? AND lease_owner = ?
+                """,
+                (status, rooms, error, time.time(), job_id, owner),
+            ).rowcount > 0
+
+    def purge_finished(self, cutoff: float, limit: int = 500) -> int:
+        """
+        Delete up to `limit` finished interactive jobs, and up to `limit`
+        batches whose jobs all finished, last updated before `cutoff`
+        (epoch seconds). Returns the number of jobs and batches deleted.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = conn.execute(
+                    """
+                    DELETE FROM jobs WHERE rowid IN (
+                        SELECT rowid FROM jobs
+                        WHERE batch_id IS NULL AND status IN (?, ?) AND updated_at < ?
+                        LIMIT ?
+                    )
+                    """,
+                    (JOB_COMPLETED, JOB_FAILED, cutoff, limit),
+                ).rowcount
+                # A batch goes as a whole, so its progress never reads partially purged
+                batch_ids = [row["id"] for row in conn.execute(
+                    """
+                    SELECT id FROM batches
+                    WHERE created_at < ? AND NOT EXISTS (
+                        SELECT 1 FROM jobs
+                        WHERE jobs.batch_id = batches.id AND (status NOT IN (?, ?) OR updated_at >= ?)
+                    )
+                    LIMIT ?
+                    """,
+                    (cutoff, JOB_COMPLETED, JOB_FAILED, cutoff, limit),
+                )]
+                for batch_id in batch_ids:
+                    deleted += conn.execute("DELETE FROM jobs WHERE batch_id = ?", (batch_id,)).rowcount
+                    conn.execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return deleted + len(batch_ids)
+
+
+def job_to_response(job: Dict) -> Dict:
+    """Shape a job record for GET /jobs/{id}."""
+    rooms = job["rooms"]
+    finished = [r for r in rooms if r["status"] in (ROOM_COMPLETED, ROOM_FAILED)]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "session_id": job["session_id"],
+        "error": job.get("error"),
+        "total_rooms": len(rooms),
+        "completed_rooms": len(finished),
+        "rooms": [
+            {"room_type_id": r["room_type_id"], "status": r["status"]}
+            for r in rooms
+        ],
+        "results": [r["result"] for r in finished if r.get("result")],
+    }
+
+
+def batch_to_response(batch: Dict) -> Dict:
+    """Shape a batch record for GET /batches/{id}: overall and per-session progress."""
+    jobs = [job_to_response(job) for job in batch["jobs"]]
+    statuses = {job["status"] for job in jobs}
+    if statuses <= {JOB_QUEUED}:
+        status = JOB_QUEUED
+    elif statuses & {JOB_QUEUED, JOB_RUNNING}:
+        status = JOB_RUNNING
+    elif statuses == {JOB_FAILED}:
+        status = JOB_FAILED
+    else:
+        status = JOB_COMPLETED
+
+    for job, record in zip(jobs, batch["jobs"]):
+        params = record["params"]
+        job["design_style_id"] = params["design_style_id"]
+        job["color_wheel_id"] = params["color_wheel_id"]
+        job["flooring_type_id"] = params.get("flooring_type_id")
+        job["floor_board_width_id"] = params.get("floor_board_width_id")
+        del job["results"]
+
+    return {
+        "batch_id": batch["id"],
+        "status": status,
+        "total_jobs": len(jobs),
+        "completed_jobs": sum(job["status"] in (JOB_COMPLETED, JOB_FAILED) for job in jobs),
+        "failed_jobs": sum(job["status"] == JOB_FAILED for job in jobs),
+        "total_rooms": sum(job["total_rooms"] for job in jobs),
+        "completed_rooms": sum(job["completed_rooms"] for job in jobs),
+        "duplicates_dropped": batch["duplicates"],
+        "jobs": jobs,
+    }
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker reclaimed it; stop working on it."""
+
+
+class JobWorkerPool:
+    """Drains the job store with a fixed number of asyncio workers."""
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = max(1, workers)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def notify(self):
+        """Wake idle workers after a job is enqueued."""
+        self._wakeup.set()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await run_in_threadpool(self.store.claim, self.owner)
+            except Exception as e:
+                log.error("Job claim failed", error=str(e))
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+            try:
+                await self._run_job(job)
+            except LeaseLost:
+                log.warning("Job lease lost to another worker; abandoning it", job=job["id"])
+            except Exception as e:
+                log.error("Job failed", job=job["id"], error=str(e))
+                await run_in_threadpool(
+                    self.store.finish, job["id"], self.owner, JOB_FAILED, json.dumps(job["rooms"]), str(e)
+                )
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            if not await run_in_threadpool(self.store.renew_lease, job_id, self.owner):
+                # The job's next write notices too, and stops it
+                return
+
+    async def _update_rooms(self, job_id: str, rooms: List[Dict], lock: asyncio.Lock):
+        # Rooms start and finish concurrently; one write at a time, each
+        # serialized under the lock, keeps an older snapshot from landing last.
+        async with lock:
+            if not await run_in_threadpool(self.store.update_rooms, job_id, self.owner, json.dumps(rooms)):
+                raise LeaseLost(job_id)
+
+    async def _run_job(self, job: Dict):
+        job_id = job["id"]
+        params = job["params"]
+        session_id = job["session_id"]
+        rooms = job["rooms"]
+        lock = asyncio.Lock()
+
+        # Resume: only rooms that did not finish before a restart are generated.
+        pending = [i for i, r in enumerate(rooms) if r["status"] not in (ROOM_COMPLETED, ROOM_FAILED)]
+
+        async def on_room_started(index: int):
+            rooms[pending[index]]["status"] = ROOM_IN_PROGRESS
+            await self._update_rooms(job_id, rooms, lock)
+
+        async def on_room_finished(index: int, outcome):
+            room = rooms[pending[index]]
+            if outcome is None:
+                room["status"] = ROOM_FAILED
+            else:
+                result, image = outcome
+                room["status"] = ROOM_COMPLETED if result["result"].get("success") else ROOM_FAILED
+                room["result"] = result
+                room["image"] = image
+            await self._update_rooms(job_id, rooms, lock)
+
+        if pending:
+            await generate_rooms(
+                params,
+                session_id,
+                [(rooms[i]["room_type_id"], rooms[i]["image_id"]) for i in pending],
+                on_room_started=on_room_started,
+                on_room_finished=on_room_finished,
+            )
+
+        images = [r["image"] for r in rooms if r.get("image")]
+        if not images:
+            await run_in_threadpool(
+                self.store.finish, job_id, self.owner, JOB_FAILED, json.dumps(rooms), "No rooms generated"
+            )
+            return
+
+        # Renewing proves the lease is still ours and keeps it for a full lease
+        # period, so no other worker can reclaim the job and save it as well.
+        if not await run_in_threadpool(self.store.renew_lease, job_id, self.owner):
+            raise LeaseLost(job_id)
+
+        # A job may be resumed after its session was saved but before it was
+        # marked complete; don't store the session twice.
+        existing = await run_in_threadpool(gallery_service.get_session_by_id, session_id)
+        if existing is None:
+            session = build_session(params, session_id, images)
+            await run_in_threadpool(gallery_service.add_session, session)
+
+        if not await run_in_threadpool(self.store.finish, job_id, self.owner, JOB_COMPLETED, json.dumps(rooms)):
+            raise LeaseLost(job_id)
+
+
+job_store = JobStore()
+job_workers = JobWorkerPool(job_store)
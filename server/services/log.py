@@ -0,0 +1,89 @@
+import json
+import logging
+import sys
+import time
+
+from config import LOG_FORMAT, LOG_LEVEL
+
+_configured = False
+
+
+class _TextFormatter(logging.Formatter):
+    """`time level logger message key=value ...`, values quoted only when needed."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = (
+            f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))} "
+            f"{record.levelname:<7} {record.name} {record.getMessage()}"
+        )
+        for key, value in getattr(record, "fields", {}).items():
+            text = str(value)
+            if not text or any(c in text for c in ' ="\n'):
+                text = json.dumps(text)
+            line += f" {key}={text}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    global _configured
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_JsonFormatter() if fmt == "json" else _TextFormatter())
+    root = logging.getLogger("rsv")
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, level, logging.INFO))
+    root.propagate = False
+    _configured = True
+
+
+class StructuredLogger:
+    """
+    Thin wrapper over a stdlib logger taking a message plus key=value fields:
+
+        log.info("Room stored", room=room_id, bytes=len(data))
+
+    Fields are only formatted when the level is enabled.
+    """
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(f"rsv.{name}")
+
+    def enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, msg: str, exc_info=None, **fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg: str, **fields):
+        self._log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg: str, **fields):
+        self._log(logging.INFO, msg, **fields)
+
+    def warning(self, msg: str, **fields):
+        self._log(logging.WARNING, msg, **fields)
+
+    def error(self, msg: str, exc_info=None, **fields):
+        self._log(logging.ERROR, msg, exc_info=exc_info, **fields)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    if not _configured:
+        configure_logging()
+    return StructuredLogger(name)
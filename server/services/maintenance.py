@@ -0,0 +1,341 @@
+import asyncio
+import math
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    GALLERY_RETENTION_DAYS,
+    IMAGE_STORAGE_MAX_BYTES,
+    IMAGE_STORAGE_TARGET_RATIO,
+    JOB_RETENTION_DAYS,
+    MAINTENANCE_BATCH_PAUSE_SECONDS,
+    MAINTENANCE_BATCH_SIZE,
+    MAINTENANCE_INTERVAL_SECONDS,
+    ORPHAN_GRACE_SECONDS,
+)
+from services.file_lock import FileLock
+from services.gallery_service import gallery_service
+from services.image_storage import BLOB_NAME, image_storage
+from services.job_queue import job_store
+from services.log import get_logger
+from services.metrics import MAINTENANCE_DELETED_SESSIONS, MAINTENANCE_FREED_BYTES
+from services.session_access import active_sessions, session_access
+
+log = get_logger("maintenance")
+
+
+def created_timestamp(session: Dict) -> float:
+    try:
+        return datetime.fromisoformat(str(session.get("createdAt", "")).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _batches(iterator: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_dir(path) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            yield from entries
+    except FileNotFoundError:
+        return
+
+
+def _iter_files(root) -> Iterator[str]:
+    for directory, _, files in os.walk(root):
+        for name in files:
+            yield os.path.join(directory, name)
+
+
+class ImageMaintenance:
+    """
+    Periodic clean-up of stored images: retention by age, a disk quota with
+    least-recently-viewed eviction, and a sweeper for files that no gallery
+    session references (failed saves, crashed requests, deleted sessions).
+
+    Starred sessions, sessions of queued or running jobs and sessions still
+    being streamed are never removed, however long they run; on top of
+    that, unreferenced files are only swept once older than the grace
+    period, so images saved just before their session is stored are safe. Every step handles one batch on the threadpool and then yields to
+    the event loop for a pause, so requests are never stalled. With several
+    workers, a file lock lets only one of them run a pass at a time.
+
+    The pass also deletes finished job records after JOB_RETENTION_DAYS.
+    While the gallery reads empty but images are stored, the sweep is
+    skipped: a gallery that failed to load must not look like no sessions.
+    """
+
+    def __init__(
+        self,
+        interval: float = MAINTENANCE_INTERVAL_SECONDS,
+        batch_size: int = MAINTENANCE_BATCH_SIZE,
+        pause: float = MAINTENANCE_BATCH_PAUSE_SECONDS,
+        retention_days: float = GALLERY_RETENTION_DAYS,
+        max_bytes: int = IMAGE_STORAGE_MAX_BYTES,
+        target_ratio: float = IMAGE_STORAGE_TARGET_RATIO,
+        orphan_grace: float = ORPHAN_GRACE_SECONDS,
+        job_retention_days: float = JOB_RETENTION_DAYS,
+    ):
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self.target_ratio = min(1.0, max(0.0, target_ratio))
+        self.orphan_grace = orphan_grace
+        self.job_retention_days = job_retention_days
+        self._lock = FileLock(str(image_storage.base_dir.parent / "maintenance.lock"))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                log.error("Maintenance pass failed", error=str(e))
+
+    async def run_once(self) -> Optional[Dict]:
+        """One full pass; returns its report, or None if another worker is running one."""
+        await run_in_threadpool(session_access.flush)
+        with self._lock.try_hold() as acquired:
+            if not acquired:
+                log.debug("Maintenance already running in another worker")
+                return None
+
+            started = time.monotonic()
+            report = {"expired": 0, "evicted": 0, "orphans": 0, "freed_bytes": 0, "used_bytes": 0,
+                      "jobs_purged": 0}
+            sessions = await run_in_threadpool(gallery_service.get_sessions)
+            loaded = bool(sessions)
+            protected = await run_in_threadpool(self._in_progress)
+
+            if self.retention_days > 0:
+                cutoff = time.time() - self.retention_days * 86400
+                expired = [
+                    s["id"] for s in sessions
+                    if not s.get("starred") and s["id"] not in protected and created_timestamp(s) < cutoff
+                ]
+                await self._delete_sessions(expired, "retention", report)
+                gone = set(expired)
+                sessions = [s for s in sessions if s["id"] not in gone]
+
+            # An empty gallery next to stored images more likely failed to load
+            # (corrupt, truncated or missing file) than lost every session; the
+            # sweep would then delete every image, so skip it.
+            if not loaded and await run_in_threadpool(_has_images):
+                log.warning("Gallery is empty but images are stored; skipping the orphan sweep",
+                            images_dir=str(image_storage.base_dir))
+            else:
+                # Re-read just before sweeping: work that started since is protected too
+                protected |= await run_in_threadpool(self._in_progress)
+                keep = {s["id"] for s in sessions} | protected
+                report["used_bytes"] = await self._sweep(keep, report)
+
+            if self.max_bytes > 0 and report["used_bytes"] > self.max_bytes:
+                await self._enforce_quota(sessions, protected, report)
+
+            if self.job_retention_days > 0:
+                cutoff = time.time() - self.job_retention_days * 86400
+                while True:
+                    purged = await run_in_threadpool(job_store.purge_finished, cutoff, self.batch_size)
+                    report["jobs_purged"] += purged
+                    if not purged:
+                        break
+                    await asyncio.sleep(self.pause)
+
+            report["seconds"] = round(time.monotonic() - started, 2)
+            log.info("Maintenance pass finished", **report)
+            return report
+
+    @staticmethod
+    def _in_progress() -> Set[str]:
+        """Sessions whose images may be on disk before their gallery entry."""
+        return job_store.active_session_ids() | active_sessions.session_ids()
+
+    async def _delete_sessions(self, session_ids: List[str], reason: str, report: Dict) -> int:
+        """Remove sessions from the gallery and delete their images, a batch at a time."""
+        freed_total = 0
+        for start in range(0, len(session_ids), self.batch_size):
+            removed, freed = await run_in_threadpool(
+                self._delete_batch, session_ids[start:start + self.batch_size]
+            )
+            report["expired" if reason == "retention" else "evicted"] += removed
+            report["freed_bytes"] += freed
+            freed_total += freed
+            MAINTENANCE_DELETED_SESSIONS.inc(removed, reason=reason)
+            MAINTENANCE_FREED_BYTES.inc(freed, reason=reason)
+            await asyncio.sleep(self.pause)
+        return freed_total
+
+    @staticmethod
+    def _delete_batch(session_ids: List[str]) -> Tuple[int, int]:
+        removed = gallery_service.remove_sessions(session_ids)
+        freed = sum(image_storage.delete_session_images(s["id"]) for s in removed)
+        session_access.forget(s["id"] for s in removed)
+        return len(removed), freed
+
+    async def _sweep(self, keep: Set[str], report: Dict) -> int:
+        """Delete unreferenced image files past the grace period; returns bytes still stored."""
+        cutoff = time.time() - self.orphan_grace
+        used = 0
+
+        # Session directories (the session layout)
+        for batch in _batches(_iter_dir(image_storage.base_dir), self.batch_size):
+            kept, freed, orphans = await run_in_threadpool(self._sweep_session_dirs, batch, keep, cutoff)
+            used += kept
+            self._count_orphans(report, orphans, freed)
+            await asyncio.sleep(self.pause)
+
+        if image_storage.refs is None:
+            return used
+
+        # References whose session is gone (the content layout); this also
+        # deletes blobs no other session shares
+        stale = await run_in_threadpool(image_storage.refs.sessions_older_than, cutoff)
+        for batch in _batches((i for i in stale if i not in keep), self.batch_size):
+            freed = await run_in_threadpool(
+                lambda ids: sum(image_storage.delete_session_images(i) for i in ids), batch
+            )
+            self._count_orphans(report, len(batch), freed)
+            await asyncio.sleep(self.pause)
+
+        # Blobs nothing references
+        for batch in _batches(_iter_files(image_storage.blob_dir), self.batch_size):
+            kept, freed, orphans = await run_in_threadpool(self._sweep_blobs, batch, cutoff)
+            used += kept
+            self._count_orphans(report, orphans, freed)
+            await asyncio.sleep(self.pause)
+        return used
+
+    @staticmethod
+    def _count_orphans(report: Dict, orphans: int, freed: int):
+        report["orphans"] += orphans
+        report["freed_bytes"] += freed
+        MAINTENANCE_FREED_BYTES.inc(freed, reason="orphan")
+
+    @staticmethod
+    def _sweep_session_dirs(entries: List[os.DirEntry], keep: Set[str], cutoff: float) -> Tuple[int, int, int]:
+        kept = freed = orphans = 0
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            size = 0
+            newest = 0.0
+            for path in _iter_files(entry.path):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # Leftovers of interrupted writes
+                if os.path.basename(path).endswith(".tmp") and stat.st_mtime < cutoff:
+                    os.unlink(path)
+                    freed += stat.st_size
+                    continue
+                size += stat.st_size
+                newest = max(newest, stat.st_mtime)
+
+            if entry.name in keep or newest >= cutoff:
+                kept += size
+            else:
+                freed += image_storage.delete_session_images(entry.name)
+                orphans += 1
+        return kept, freed, orphans
+
+    @staticmethod
+    def _sweep_blobs(paths: List[str], cutoff: float) -> Tuple[int, int, int]:
+        stats = {}
+        for path in paths:
+            try:
+                stats[path] = os.stat(path)
+            except OSError:
+                pass
+        blobs = [os.path.basename(p) for p in stats if BLOB_NAME.match(os.path.basename(p))]
+
+        kept = freed = orphans = 0
+        # In a reference-store transaction, so a save can't reference a blob
+        # between the check and the delete
+        with image_storage.refs.transaction() as conn:
+            referenced = image_storage.refs.referenced(conn, blobs)
+            for path, stat in stats.items():
+                name = os.path.basename(path)
+                old = stat.st_mtime < cutoff
+                if BLOB_NAME.match(name):
+                    if name not in referenced and old:
+                        freed += image_storage.delete_blob(name)
+                        orphans += 1
+                        continue
+                elif old and (name.endswith(".tmp") or not _original_exists(path)):
+                    # Interrupted writes, and derivatives whose blob is gone
+                    try:
+                        os.unlink(path)
+                        freed += stat.st_size
+                    except FileNotFoundError:
+                        pass
+                    continue
+                kept += stat.st_size
+        return kept, freed, orphans
+
+    async def _enforce_quota(self, sessions: List[Dict], protected: Set[str], report: Dict):
+        """Evict the least recently viewed unstarred sessions until under the target."""
+        target = self.max_bytes * self.target_ratio
+        last_access = await run_in_threadpool(session_access.last_access)
+        candidates = sorted(
+            (s for s in sessions if not s.get("starred") and s["id"] not in protected),
+            key=lambda s: max(last_access.get(s["id"], 0.0), created_timestamp(s)),
+        )
+        average = report["used_bytes"] / max(1, len(sessions))
+        position = 0
+        while report["used_bytes"] > target and position < len(candidates):
+            # Size each batch to the estimated overshoot so a pass doesn't evict far too much
+            needed = math.ceil((report["used_bytes"] - target) / max(1.0, average))
+            count = max(1, min(self.batch_size, needed))
+            batch = [s["id"] for s in candidates[position:position + count]]
+            position += count
+            report["used_bytes"] -= await self._delete_sessions(batch, "quota", report)
+        if report["used_bytes"] > target:
+            log.warning("Image storage still over quota; only starred or active sessions left",
+                        used_bytes=report["used_bytes"], max_bytes=self.max_bytes)
+
+
+def _has_images() -> bool:
+    return (
+        any(entry.is_dir(follow_symlinks=False) for entry in _iter_dir(image_storage.base_dir))
+        or next(_iter_files(image_storage.blob_dir), None) is not None
+    )
+
+
+def _original_exists(derivative_path: str) -> bool:
+    # <hash>.<ext> sits next to <hash>.w<width>.webp; the extension is unknown
+    stem = os.path.basename(derivative_path).split(".", 1)[0]
+    directory = os.path.dirname(derivative_path)
+    return any(
+        BLOB_NAME.match(entry.name) and entry.name.startswith(stem + ".")
+        for entry in _iter_dir(directory)
+    )
+
+
+image_maintenance = ImageMaintenance()
@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from cache hits and disk writes up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> ([count per bucket, +Inf last], sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block; labels may be updated inside it."""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = ("le", _format_number(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+PROMPT_BUILD_SECONDS = registry.register(Histogram(
+    "rsv_prompt_build_seconds", "Catalog lookups and prompt construction per room"))
+MODEL_CALL_SECONDS = registry.register(Histogram(
+    "rsv_model_call_seconds", "Image model call latency by model and outcome", ("model", "outcome")))
+RESPONSE_DECODE_SECONDS = registry.register(Histogram(
+    "rsv_response_decode_seconds", "Extracting the image from a model response"))
+GENERATION_CACHE_LOOKUPS = registry.register(Counter(
+    "rsv_generation_cache_lookups_total", "Generation cache lookups by result", ("result",)))
+ROOM_GENERATION_SECONDS = registry.register(Histogram(
+    "rsv_room_generation_seconds", "End-to-end time to generate and store one room", ("quality", "outcome")))
+IMAGE_WRITE_SECONDS = registry.register(Histogram(
+    "rsv_image_write_seconds", "Writing a generated image to storage"))
+IMAGE_WRITE_BYTES = registry.register(Counter(
+    "rsv_image_write_bytes_total", "Bytes of generated images written to storage"))
+IMAGE_DEDUP_HITS = registry.register(Counter(
+    "rsv_image_dedup_hits_total", "Saved images whose bytes were already in the blob store"))
+GALLERY_SAVE_SECONDS = registry.register(Histogram(
+    "rsv_gallery_save_seconds", "Persisting a gallery session", ("backend",)))
+IMAGE_SERVE_SECONDS = registry.register(Histogram(
+    "rsv_image_serve_seconds", "Serving an image, including the transfer", ("variant", "status")))
+IMAGE_SERVE_BYTES = registry.register(Counter(
+    "rsv_image_serve_bytes_total", "Image bytes sent to clients", ("variant",)))
+MAINTENANCE_DELETED_SESSIONS = registry.register(Counter(
+    "rsv_maintenance_deleted_sessions_total", "Sessions removed by maintenance, by reason", ("reason",)))
+MAINTENANCE_FREED_BYTES = registry.register(Counter(
+    "rsv_maintenance_freed_bytes_total", "Image bytes freed by maintenance, by reason", ("reason",)))
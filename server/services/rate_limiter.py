@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from config import GEMINI_DEFAULT_RATE_LIMIT, GEMINI_MODEL_RATE_LIMITS, GENERATION_LANE_MAX_QUEUED
+
+
+class GenerationOverloaded(Exception):
+    """A lane's queue is full; the caller should retry after `retry_after` seconds."""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"Generation queue for {lane} is full; retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class SlotTimeout(Exception):
+    """No call slot for the model became free before the caller's deadline."""
+
+
+class ModelLimiter:
+    """
+    Token bucket plus concurrency cap for one upstream model.
+
+    Waiters are served in (lane rank, arrival) order, so cheaper lanes go
+    first when a model is saturated, and only the head waiter may take a
+    token, which keeps the order fair within a lane. Waiting happens on the
+    event loop, so a queued room holds no executor thread until its slot is
+    granted.
+    """
+
+    def __init__(self, model: str, requests_per_minute: float, max_concurrency: int):
+        self.model = model
+        self.rate = max(requests_per_minute, 0.001) / 60.0
+        self.max_concurrency = max(1, max_concurrency)
+        self.burst = float(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._changed: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = None
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int]] = []
+        self._waiting_by_rank: Dict[int, int] = {}
+        self._seq = itertools.count()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wakeup(self) -> asyncio.Event:
+        """The event set on the next state change (call with the lock held)."""
+        loop = asyncio.get_running_loop()
+        if self._changed is None or self._changed[0] is not loop:
+            self._changed = (loop, asyncio.Event())
+        return self._changed[1]
+
+    def _notify(self):
+        """Wake every waiter to re-check (call with the lock held)."""
+        changed, self._changed = self._changed, None
+        if changed:
+            loop, event = changed
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Loop already closed; nobody is waiting on it
+
+    async def acquire(self, rank: int, timeout: float) -> bool:
+        ticket = (rank, next(self._seq))
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            heapq.heappush(self._waiters, ticket)
+            self._waiting_by_rank[rank] = self._waiting_by_rank.get(rank, 0) + 1
+        granted = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    is_head = self._waiters[0] == ticket
+                    if (is_head and self._in_flight < self.max_concurrency
+                            and self._tokens >= 1 and now >= self._paused_until):
+                        heapq.heappop(self._waiters)
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        granted = True
+                        # The next waiter may be able to go too
+                        self._notify()
+                        return True
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return False
+
+                    wait = remaining
+                    if is_head and self._in_flight < self.max_concurrency:
+                        # Only time gates us: sleep until a token or the pause ends
+                        token_wait = max(0.0, (1 - self._tokens) / self.rate)
+                        wait = min(wait, max(token_wait, self._paused_until - now, 0.01))
+                    wakeup = self._wakeup()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._waiting_by_rank[rank] -= 1
+                if not granted:
+                    # Timed out or cancelled: give up our place in the queue
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._notify()
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._notify()
+
+    def penalize(self, seconds: float):
+        """Back off after an upstream quota error: pause new calls and empty the bucket."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def waiting(self, rank: Optional[int] = None) -> int:
+        with self._lock:
+            if rank is None:
+                return len(self._waiters)
+            return self._waiting_by_rank.get(rank, 0)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "requests_per_minute": round(self.rate * 60, 2),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            }
+
+
+class GenerationLimiter:
+    """
+    Per-model limiters plus admission control for the priority lanes.
+
+    Lanes are image qualities; their rank (cheapest first) follows the order
+    of `lanes`. Each lane admits a bounded amount of outstanding work and
+    beyond that callers get GenerationOverloaded instead of queueing forever.
+    """
+
+    def __init__(
+        self,
+        lanes: List[str],
+        model_limits: Dict[str, Tuple[float, int]] = GEMINI_MODEL_RATE_LIMITS,
+        default_limit: Tuple[float, int] = GEMINI_DEFAULT_RATE_LIMIT,
+        lane_max_queued: Dict[str, int] = GENERATION_LANE_MAX_QUEUED,
+    ):
+        self.lanes = list(lanes)
+        self.model_limits = model_limits
+        self.default_limit = default_limit
+        self.lane_max_queued = lane_max_queued
+        self._lock = threading.Lock()
+        self._models: Dict[str, ModelLimiter] = {}
+        self._reserved: Dict[str, int] = {}
+
+    def rank(self, lane: str) -> int:
+        return self.lanes.index(lane) if lane in self.lanes else len(self.lanes)
+
+    def for_model(self, model: str) -> ModelLimiter:
+        with self._lock:
+            limiter = self._models.get(model)
+            if limiter is None:
+                rpm, concurrency = self.model_limits.get(model, self.default_limit)
+                limiter = self._models[model] = ModelLimiter(model, rpm, concurrency)
+            return limiter
+
+    @asynccontextmanager
+    async def slot(self, model: str, lane: str, timeout: float):
+        """Hold one call slot for `model`; raises SlotTimeout if none frees up in time."""
+        limiter = self.for_model(model)
+        if not await limiter.acquire(self.rank(lane), timeout):
+            raise SlotTimeout(f"No {model} call slot within {timeout:.0f}s")
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def penalize(self, model: str, seconds: float):
+        self.for_model(model).penalize(seconds)
+
+    def admit(self, lane: str, model: str, rooms: int, backlog: int = 0):
+        """
+        Raise GenerationOverloaded if `rooms` more rooms would overflow the
+        lane. `backlog` is lane work queued elsewhere (e.g. in the job store).
+        """
+        limit = self.lane_max_queued.get(lane)
+        if limit is None:
+            return
+        limiter = self.for_model(model)
+        with self._lock:
+            outstanding = backlog + self._reserved.get(lane, 0)
+        # An idle lane always admits one request, however many rooms it has
+        if outstanding and outstanding + rooms > limit:
+            # Time for the model to work through what is already ahead
+            retry_after = math.ceil((outstanding + rooms - limit) / limiter.rate)
+            raise GenerationOverloaded(lane, max(1, retry_after))
+
+    @contextmanager
+    def reserve(self, lane: str, rooms: int):
+        """Count work running outside the job store (e.g. streams) against the lane."""
+        with self._lock:
+            self._reserved[lane] = self._reserved.get(lane, 0) + rooms
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved[lane] -= rooms
+
+    def stats(self) -> Dict:
+        with self._lock:
+            models = dict(self._models)
+            reserved = dict(self._reserved)
+        return {
+            "models": {name: limiter.stats() for name, limiter in models.items()},
+            "lanes": {
+                lane: {"max_queued": self.lane_max_queued.get(lane), "reserved": reserved.get(lane, 0)}
+                for lane in self.lanes
+            },
+        }
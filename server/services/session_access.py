@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+SERVER_ROOT = Path(__file__).parent.parent
+DEFAULT_MAINTENANCE_DB_PATH = SERVER_ROOT / "maintenance.db"
+
+# A worker that crashes mid-stream can't release its holds; they lapse after this
+ACTIVE_HOLD_SECONDS = 24 * 3600
+
+
+def _resolve_db_path() -> Path:
+    env_value = os.getenv("MAINTENANCE_DB_PATH")
+    if not env_value:
+        return DEFAULT_MAINTENANCE_DB_PATH
+
+    env_path = Path(env_value)
+    if not env_path.is_absolute():
+        env_path = SERVER_ROOT / env_path
+    return env_path
+
+
+class _MaintenanceDb:
+    """A connection to the small SQLite file shared by every worker process."""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path or _resolve_db_path()
+        self._schema_ready = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._schema_ready:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(
+                    """
+                    CREATE TABLE IF NOT EXISTS session_access (session_id TEXT PRIMARY KEY, last_access REAL NOT NULL);
+                    CREATE TABLE IF NOT EXISTS active_sessions (session_id TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+                    """
+                )
+                self._schema_ready = True
+            yield conn
+        finally:
+            conn.close()
+
+
+class SessionAccessLog(_MaintenanceDb):
+    """
+    When each session's images were last viewed, for LRU eviction.
+
+    Views are recorded in memory (a dict write on the image route) and
+    flushed to SQLite in one batch by the maintenance task, so serving an
+    image never waits on a database write.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        super().__init__(db_path)
+        self._pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str):
+        with self._lock:
+            self._pending[session_id] = time.time()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO session_access (session_id, last_access) VALUES (?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)
+                """,
+                list(pending.items()),
+            )
+        return len(pending)
+
+    def last_access(self) -> Dict[str, float]:
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT session_id, last_access FROM session_access"))
+
+    def forget(self, session_ids: Iterable[str]):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM session_access WHERE session_id = ?", [(i,) for i in session_ids])
+
+
+class ActiveSessions(_MaintenanceDb):
+    """
+    Sessions being generated outside the job store (streamed requests), in
+    any worker process. Their images are on disk before the gallery entry
+    is written, so the orphan sweep must leave them alone until released.
+    """
+
+    def add(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO active_sessions (session_id, expires_at) VALUES (?, ?)",
+                (session_id, time.time() + ACTIVE_HOLD_SECONDS),
+            )
+
+    def remove(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM active_sessions WHERE session_id = ?", (session_id,))
+
+    def session_ids(self) -> Set[str]:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM active_sessions WHERE expires_at < ?", (time.time(),))
+            return {row[0] for row in conn.execute("SELECT session_id FROM active_sessions")}
+
+
+session_access = SessionAccessLog()
+active_sessions = ActiveSessions()
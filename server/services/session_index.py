@@ -0,0 +1,154 @@
+import heapq
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Sessions are ordered by (createdAt, id); id breaks ties between sessions
+# created in the same instant so cursors are stable.
+SessionKey = Tuple[str, str]
+
+
+def session_key(session: Dict) -> SessionKey:
+    return (session.get("createdAt", ""), session.get("id", ""))
+
+
+def iter_desc(keys: List[SessionKey], before: Optional[SessionKey] = None) -> Iterator[SessionKey]:
+    """Walk an ascending key list newest-first, starting strictly before `before`."""
+    pos = bisect_left(keys, before) if before is not None else len(keys)
+    for i in range(pos - 1, -1, -1):
+        yield keys[i]
+
+
+class Facet:
+    """Sorted session keys (and id sets for membership tests) per facet value."""
+
+    def __init__(self):
+        self.keys: Dict[str, List[SessionKey]] = {}
+        self.ids: Dict[str, Set[str]] = {}
+
+    def add(self, value: str, key: SessionKey):
+        if key[1] in self.ids.setdefault(value, set()):
+            return
+        self.ids[value].add(key[1])
+        insort(self.keys.setdefault(value, []), key)
+
+    def remove(self, value: str, key: SessionKey):
+        ids = self.ids.get(value)
+        if not ids or key[1] not in ids:
+            return
+        ids.discard(key[1])
+        keys = self.keys[value]
+        pos = bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            del keys[pos]
+
+    def size(self, values: Iterable[str]) -> int:
+        return sum(len(self.keys.get(v, ())) for v in values)
+
+    def contains(self, values: Iterable[str], session_id: str) -> bool:
+        return any(session_id in self.ids.get(v, ()) for v in values)
+
+    def iter_desc(self, values: Iterable[str], before: Optional[SessionKey] = None) -> Iterator[SessionKey]:
+        """Newest-first union of the keys for any of `values`."""
+        streams = [iter_desc(self.keys[v], before) for v in values if v in self.keys]
+        previous = None
+        for key in heapq.merge(*streams, reverse=True):
+            if key != previous:
+                yield key
+            previous = key
+
+
+class SessionIndex:
+    """
+    Indexes over the cached gallery sessions: overall createdAt order, by id,
+    by design style and by room type. Updated incrementally as sessions are
+    added.
+    """
+
+    def __init__(self, sessions: Iterable[Dict] = ()):
+        self.by_id: Dict[str, Dict] = {}
+        self.ordered: List[SessionKey] = []
+        self.styles = Facet()
+        self.rooms = Facet()
+        for session in sessions:
+            self.add(session)
+
+    @staticmethod
+    def _room_ids(session: Dict) -> Set[str]:
+        return {
+            image["roomType"]["id"]
+            for image in session.get("images", [])
+            if isinstance(image.get("roomType"), dict) and image["roomType"].get("id")
+        }
+
+    def add(self, session: Dict):
+        session_id = session.get("id")
+        if not session_id:
+            return
+        if session_id in self.by_id:
+            self.remove(session_id)
+        key = session_key(session)
+        self.by_id[session_id] = session
+        insort(self.ordered, key)
+        style_id = (session.get("designStyle") or {}).get("id")
+        if style_id:
+            self.styles.add(style_id, key)
+        for room_id in self._room_ids(session):
+            self.rooms.add(room_id, key)
+
+    def remove(self, session_id: str):
+        session = self.by_id.pop(session_id, None)
+        if session is None:
+            return
+        key = session_key(session)
+        pos = bisect_left(self.ordered, key)
+        if pos < len(self.ordered) and self.ordered[pos] == key:
+            del self.ordered[pos]
+        style_id = (session.get("designStyle") or {}).get("id")
+        if style_id:
+            self.styles.remove(style_id, key)
+        for room_id in self._room_ids(session):
+            self.rooms.remove(room_id, key)
+
+    def query(
+        self,
+        styles: Optional[List[str]] = None,
+        room_types: Optional[List[str]] = None,
+        since: Optional[str] = None,
+        limit: Optional[int] = None,
+        before: Optional[SessionKey] = None,
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Return sessions newest-first matching any of `styles` and any of
+        `room_types`, created after `since`, starting strictly before the
+        `before` key. The flag is True when more results follow.
+
+        The smallest applicable index drives the walk from the cursor and the
+        other filters are set membership checks, so a page never scans the
+        whole gallery.
+        """
+        facets = []
+        if styles:
+            facets.append((self.styles, styles))
+        if room_types:
+            facets.append((self.rooms, room_types))
+
+        if facets:
+            facets.sort(key=lambda f: f[0].size(f[1]))
+            driver, driver_values = facets[0]
+            keys = driver.iter_desc(driver_values, before)
+            others = facets[1:]
+        else:
+            keys = iter_desc(self.ordered, before)
+            others = []
+
+        page: List[Dict] = []
+        for key in keys:
+            # Newest-first, so everything after the cutoff is older still
+            if since is not None and key[0] <= since:
+                break
+            if any(not facet.contains(values, key[1]) for facet, values in others):
+                continue
+            if limit is not None and len(page) == limit:
+                return page, True
+            page.append(self.by_id[key[1]])
+        return page, False
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from services.log import get_logger
+
+SERVER_ROOT = Path(__file__).parent.parent
+SYSTEM_PROMPT_PATH = SERVER_ROOT / "data" / "system_prompt.txt"
+
+log = get_logger("system_prompt")
+
+
+class SystemPromptCache:
+    """
+    Holds the system prompt in memory and re-reads it only when the file's
+    mtime or size changes, so operators can still edit it on a live server.
+    """
+
+    def __init__(self, path: Path = SYSTEM_PROMPT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # (signature, text, version), swapped as a whole so readers never see
+        # a prompt paired with another prompt's version.
+        self._state: Optional[Tuple[Tuple[int, int], str, str]] = None
+
+    def get(self) -> Tuple[str, str]:
+        """
+        Return (prompt text, version hash).
+
+        Raises RuntimeError if the prompt has never been readable.
+        """
+        state = self._state
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            # Editors that save via rename can briefly remove the file; keep
+            # serving the last good prompt if there is one.
+            if state is not None:
+                return state[1], state[2]
+            raise RuntimeError(f"System prompt load failed: {self.path} ({e})")
+
+        if state is not None and state[0] == signature:
+            return state[1], state[2]
+
+        with self._lock:
+            state = self._state
+            if state is None or state[0] != signature:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        text = f.read()
+                except Exception as e:
+                    if state is not None:
+                        return state[1], state[2]
+                    raise RuntimeError(f"System prompt load failed: {self.path} ({e})")
+
+                version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+                state = (signature, text, version)
+                self._state = state
+                log.info("Loaded system prompt", chars=len(text), version=version)
+            return state[1], state[2]
+
+    @property
+    def version(self) -> str:
+        return self.get()[1]
+
+
+system_prompt = SystemPromptCache()
@@ -0,0 +1,74 @@
+import io
+import os
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+from services.log import get_logger
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+log = get_logger("zip")
+
+# Already-compressed formats gain nothing from deflate; store them as-is.
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """
+    Write-only sink that zipfile writes into and the response drains.
+
+    It is deliberately not seekable, so zipfile emits data descriptors instead
+    of seeking back to patch headers, and output can be streamed as written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Path]], chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of (arcname, path) entries as it is built.
+
+    Files are read in `chunk_size` pieces, so memory stays constant regardless
+    of how many or how large the files are. Unreadable files are skipped.
+    """
+    sink = _ChunkBuffer()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for arcname, path in entries:
+            try:
+                src = open(path, "rb")
+            except OSError as e:
+                log.warning("Skipping unreadable file in archive", path=str(path), error=str(e))
+                continue
+
+            with src:
+                size = os.fstat(src.fileno()).st_size
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                if path.suffix.lower() in STORED_SUFFIXES:
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                with archive.open(info, mode="w", force_zip64=size >= zipfile.ZIP64_LIMIT) as dest:
+                    for chunk in iter(lambda: src.read(chunk_size), b""):
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    yield sink.drain()
@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Point every store at a scratch directory and use the offline backend; this
+# must happen before the services (which read config at import) are imported.
+_scratch = Path(tempfile.mkdtemp(prefix="rsv-tests-"))
+os.environ.setdefault("GENERATION_BACKEND", "fake")
+os.environ.setdefault("FAKE_BACKEND_LATENCY_MS", "20")
+os.environ.setdefault("FAKE_BACKEND_LATENCY_SIGMA", "1.0")
+os.environ.setdefault("FAKE_BACKEND_IMAGE_WIDTH", "64")
+os.environ.setdefault("GEMINI_MODEL_RATE_LIMITS", "")
+os.environ.setdefault("GEMINI_DEFAULT_RATE_LIMIT", "60000:8")
+os.environ.setdefault("GALLERY_BACKEND", "sqlite")
+os.environ.setdefault("GALLERY_DB_PATH", str(_scratch / "gallery.db"))
+os.environ.setdefault("JOB_STORE_PATH", str(_scratch / "jobs.db"))
+os.environ.setdefault("IMAGE_STORAGE_DIR", str(_scratch / "images"))
+os.environ.setdefault("MAINTENANCE_DB_PATH", str(_scratch / "maintenance.db"))
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
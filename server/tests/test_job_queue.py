@@ -0,0 +1,75 @@
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+
+from services.gallery_service import gallery_service
+from services.job_queue import (
+    JOB_COMPLETED,
+    ROOM_COMPLETED,
+    JobStore,
+    JobWorkerPool,
+    job_to_response,
+)
+
+ROOMS = ["living-room", "dining-room", "kitchen", "bedroom", "bathroom"]
+
+
+class SlowJobStore(JobStore):
+    """Room writes stall a random while before committing, so they land out of order."""
+
+    @contextmanager
+    def _connect(self):
+        with super()._connect() as conn:
+            yield _SlowConnection(conn)
+
+
+class _SlowConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, *args):
+        if sql.lstrip().startswith("UPDATE jobs SET rooms"):
+            time.sleep(random.uniform(0, 0.2))
+        return self._conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _params():
+    return {
+        "room_type_ids": ROOMS,
+        "design_style_id": "refined-southern-traditional",
+        "architect_id": "historical-concepts",
+        "designer_id": "bunny-williams",
+        "color_wheel_id": "light",
+        "aspect_ratio_id": "1:1",
+        "image_quality_id": "1k",
+        "flooring_type_id": None,
+        "floor_board_width_id": None,
+        "force_fresh": True,
+    }
+
+
+def test_concurrent_rooms_all_recorded(tmp_path):
+    # Rooms run concurrently (GENERATION_PER_REQUEST_CONCURRENCY > 1) and their
+    # writes race; every room's final state must end up in the store.
+    store = SlowJobStore(tmp_path / "jobs.db")
+    pool = JobWorkerPool(store)
+
+    for _ in range(5):
+        job = store.enqueue(_params())
+        claimed = store.claim(pool.owner)
+        assert claimed["id"] == job["id"]
+
+        asyncio.run(pool._run_job(claimed))
+
+        stored = store.get(job["id"])
+        assert stored["status"] == JOB_COMPLETED
+        assert [r["status"] for r in stored["rooms"]] == [ROOM_COMPLETED] * len(ROOMS)
+        assert all(r.get("result") for r in stored["rooms"])
+        assert len(job_to_response(stored)["results"]) == len(ROOMS)
+
+        session = gallery_service.get_session_by_id(job["session_id"])
+        assert session is not None